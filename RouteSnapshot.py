@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2014 Cisco Systems Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# This script saves the routing table collected by RoutingTable.py to a
+# compact snapshot file, and reports the prefixes that were added, removed
+# or changed next hops between two snapshots. In watch mode it polls a
+# switch and prints only what changed since the previous poll.
+#
+#   python RouteSnapshot.py save http://10.2.1.8/ins admin pass day1.snap
+#   python RouteSnapshot.py diff day1.snap day2.snap
+#   python RouteSnapshot.py watch http://10.2.1.8/ins admin pass -i 60 -d hist
+#   python RouteSnapshot.py replay hist --until 20140301-120000 -o then.snap
+#
+# Snapshots are gzip compressed text, one line per prefix:
+#   vrf <tab> addrf <tab> prefix <tab> nexthop,ifname,pref,metric,client;...
+# Deltas have a leading +, - or ~ column and both the old and the new next
+# hops, empty for an added or removed prefix:
+#   op <tab> vrf <tab> addrf <tab> prefix <tab> old nexthops <tab> new
+# so they can be stored and shipped instead of full dumps, applied to a
+# snapshot to bring it forward, or backwards to undo them, and checked
+# against the snapshot they are applied to.
+#
+
+import gzip
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+from RoutingTable import collect_routes
+from nxapi_utils import use_session_file
+
+HEADER = '# RouteSnapshot 1'
+DELTA_HEADER = '# RouteSnapshot delta 1'
+
+
+def snapshot_from_collection(collection):
+    '''
+        Flattens a RouteCollection into {(vrf, addrf, prefix): nexthops},
+        where nexthops is a sorted tuple of
+        (ipnexthop, ifname, pref, metric, clientname). Uptime is left out
+        so that an unchanged route compares equal between polls
+    '''
+    snapshot = {}
+    for (vrf, addrf), table in collection.tables.iteritems():
+        for route in table:
+            snapshot[(vrf, addrf, route.ipprefix)] = tuple(sorted(
+                (nh.ipnexthop, nh.ifname or '', nh.pref, nh.metric,
+                 nh.clientname)
+                for nh in route.nexthops))
+    return snapshot
+
+
+def format_nexthops(nexthops):
+    return ';'.join('%s,%s,%d,%d,%s' % nh for nh in nexthops)
+
+
+def parse_nexthops(field):
+    nexthops = []
+    for nh in field.split(';'):
+        if not nh:
+            continue
+        (ipnexthop, ifname, pref, metric, clientname) = nh.split(',', 4)
+        nexthops.append((ipnexthop, ifname, int(pref), int(metric),
+                         clientname))
+    return tuple(nexthops)
+
+
+def format_line(key, nexthops):
+    return '\t'.join([key[0], key[1], key[2], format_nexthops(nexthops)])
+
+
+def format_change(op, key, old, new):
+    return '\t'.join([op, key[0], key[1], key[2], format_nexthops(old or ()),
+                      format_nexthops(new or ())])
+
+
+def save_snapshot(snapshot, path):
+    '''Writes a snapshot, sorted by vrf, address family and prefix'''
+    f = gzip.open(path, 'wb')
+    try:
+        f.write('%s %d\n' % (HEADER, int(time.time())))
+        for key in sorted(snapshot):
+            f.write(format_line(key, snapshot[key]) + '\n')
+    finally:
+        f.close()
+
+
+def load_snapshot(path):
+    snapshot = {}
+    f = gzip.open(path, 'rb')
+    try:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            (vrf, addrf, prefix, nexthops) = line.rstrip('\n').split('\t')
+            snapshot[(vrf, addrf, prefix)] = parse_nexthops(nexthops)
+    finally:
+        f.close()
+    return snapshot
+
+
+def diff_snapshots(old, new):
+    '''
+        Compares two snapshots in one pass over each. Returns a list of
+        (op, key, old nexthops, new nexthops) sorted by key, where op is
+        '+' for an added prefix, '-' for a removed one and '~' for a
+        prefix whose next hops changed. The missing side of an added or
+        removed prefix is None
+    '''
+    delta = []
+    for key, nexthops in new.iteritems():
+        previous = old.get(key)
+        if previous is None:
+            delta.append(('+', key, None, nexthops))
+        elif previous != nexthops:
+            delta.append(('~', key, previous, nexthops))
+    for key, nexthops in old.iteritems():
+        if key not in new:
+            delta.append(('-', key, nexthops, None))
+    delta.sort(key=lambda change: change[1])
+    return delta
+
+
+def apply_delta(snapshot, delta, reverse=False, strict=False):
+    '''
+        Brings a snapshot forward by a delta, in place, or with reverse
+        back to where it was before the delta. With strict, raises
+        ValueError when a prefix the delta changes does not hold what the
+        delta says it held
+    '''
+    for op, key, old, new in delta:
+        if reverse:
+            old, new = new, old
+        if strict and snapshot.get(key) != old:
+            raise ValueError('%s %s %s: expected %s, found %s' % (
+                key + (format_nexthops(old or ()),
+                       format_nexthops(snapshot.get(key) or ()))))
+        if new is None:
+            snapshot.pop(key, None)
+        else:
+            snapshot[key] = new
+    return snapshot
+
+
+def write_delta(delta, f):
+    for op, key, old, new in delta:
+        f.write(format_change(op, key, old, new) + '\n')
+
+
+def save_delta(delta, path):
+    f = gzip.open(path, 'wb')
+    try:
+        f.write('%s %d\n' % (DELTA_HEADER, int(time.time())))
+        write_delta(delta, f)
+    finally:
+        f.close()
+
+
+def load_delta(path):
+    '''Reads a delta file written by save_delta, or by watch'''
+    delta = []
+    f = gzip.open(path, 'rb')
+    try:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            (op, vrf, addrf, prefix, old,
+             new) = line.rstrip('\n').split('\t')
+            delta.append((op, (vrf, addrf, prefix),
+                          parse_nexthops(old) if op != '+' else None,
+                          parse_nexthops(new) if op != '-' else None))
+    finally:
+        f.close()
+    return delta
+
+
+def replay(source, deltas=(), until=None, reverse=False, strict=False):
+    '''
+        Returns the snapshot source, a snapshot file or a watch delta
+        directory, brought forward by the delta files deltas in order, or
+        back by them in reverse order with reverse. For a directory, which
+        may hold several watch runs, the base is its latest snapshot at or
+        before the stamp until, and the deltas are those after it up to
+        until
+    '''
+    if os.path.isdir(source):
+        names = sorted(os.listdir(source))
+        snaps = [name[:-len('.snap')] for name in names
+                 if name.endswith('.snap')]
+        if not snaps:
+            raise ValueError('No snapshot in %s' % source)
+        if until is not None and until < snaps[0]:
+            raise ValueError('%s is before the first snapshot in %s, %s' %
+                             (until, source, snaps[0]))
+        base = [stamp for stamp in snaps
+                if until is None or stamp <= until][-1]
+        deltas = [os.path.join(source, name) for name in names
+                  if name.endswith('.delta') and
+                  base < name[:-len('.delta')] and
+                  (until is None or name[:-len('.delta')] <= until)]
+        source = os.path.join(source, base + '.snap')
+    snapshot = load_snapshot(source)
+    for path in (reversed(deltas) if reverse else deltas):
+        apply_delta(snapshot, load_delta(path), reverse, strict)
+    return snapshot
+
+
+def watch(url, username, password, interval=60, delta_dir=None):
+    '''
+        Polls the switch every interval seconds and prints the delta
+        against the previous poll. The first poll is saved as a full
+        snapshot in delta_dir, later ones as delta files only
+    '''
+    previous = None
+    while True:
+        started = time.time()
+        current = snapshot_from_collection(
+            collect_routes(url, username, password))
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        if previous is None:
+            print '# %s %d prefixes' % (stamp, len(current))
+            if delta_dir:
+                save_snapshot(current, os.path.join(delta_dir,
+                                                    stamp + '.snap'))
+        else:
+            delta = diff_snapshots(previous, current)
+            print '# %s %d changes' % (stamp, len(delta))
+            write_delta(delta, sys.stdout)
+            if delta_dir and delta:
+                save_delta(delta, os.path.join(delta_dir, stamp + '.delta'))
+        sys.stdout.flush()
+        previous = current
+        time.sleep(max(0, interval - (time.time() - started)))
+
+
+def main():
+    parser = ArgumentParser('RouteSnapshot')
+    sub = parser.add_subparsers(dest='action')
+
+    save = sub.add_parser('save', help='Collect routes and save a snapshot')
+    save.add_argument('url', help='NX-API URL, e.g. http://10.2.1.8/ins')
+    save.add_argument('username')
+    save.add_argument('password')
+    save.add_argument('file', help='Snapshot file to write')
+    save.add_argument('--session-cache',
+                      help='File that keeps the login cookie between runs')
+
+    diff = sub.add_parser('diff', help='Show changes between two snapshots')
+    diff.add_argument('old')
+    diff.add_argument('new')
+
+    poll = sub.add_parser('watch', help='Poll and print route churn')
+    poll.add_argument('url', help='NX-API URL, e.g. http://10.2.1.8/ins')
+    poll.add_argument('username')
+    poll.add_argument('password')
+    poll.add_argument('-i', '--interval', type=int, default=60,
+                      help='Seconds between polls')
+    poll.add_argument('-d', '--delta-dir',
+                      help='Directory to store the first snapshot and deltas')
+    poll.add_argument('--session-cache',
+                      help='File that keeps the login cookie between runs')
+
+    play = sub.add_parser('replay', help='Apply stored deltas to a '
+                                         'snapshot')
+    play.add_argument('source', help='Snapshot file, or a watch --delta-dir '
+                                     'directory to replay from its latest '
+                                     'snapshot up to --until')
+    play.add_argument('deltas', nargs='*', help='Delta files, in order')
+    play.add_argument('--until', help='With a directory, stop after the '
+                                      'delta of this stamp, e.g. '
+                                      '20140301-120000')
+    play.add_argument('--reverse', action='store_true',
+                      help='Undo the deltas, last first')
+    play.add_argument('--strict', action='store_true',
+                      help='Fail when a delta does not match the snapshot')
+    play.add_argument('-o', '--output',
+                      help='Save the result as a snapshot instead of '
+                           'printing it')
+
+    args = parser.parse_args()
+    if getattr(args, 'session_cache', None):
+        use_session_file(args.session_cache)
+
+    if args.action == 'save':
+        snapshot = snapshot_from_collection(
+            collect_routes(args.url, args.username, args.password))
+        save_snapshot(snapshot, args.file)
+        print 'Saved %d prefixes to %s' % (len(snapshot), args.file)
+    elif args.action == 'diff':
+        write_delta(diff_snapshots(load_snapshot(args.old),
+                                   load_snapshot(args.new)), sys.stdout)
+    elif args.action == 'replay':
+        try:
+            snapshot = replay(args.source, args.deltas, args.until,
+                              args.reverse, args.strict)
+        except ValueError, e:
+            parser.error(str(e))
+        if args.output:
+            save_snapshot(snapshot, args.output)
+            print 'Saved %d prefixes to %s' % (len(snapshot), args.output)
+        else:
+            for key in sorted(snapshot):
+                print format_line(key, snapshot[key])
+    else:
+        try:
+            watch(args.url, args.username, args.password, args.interval,
+                  args.delta_dir)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
@@ -7,16 +7,45 @@ information from NX-API. Here, we pull the contents of the routing
 table and place them into custom objects to be used elsewhere.
 '''
 
-from nxapi_utils import NXAPI, xmltodict
+import socket
+import sys
+import threading
+import time
+import Queue
+from array import array
+from binascii import hexlify
 
 #TODO: There may be additional options for other route types
 
+# Interface, protocol and uptime strings repeat across thousands of next
+# hops; keep one copy of each
+_names = {}
+
+
+def intern_name(val):
+    return _names.setdefault(val, val)
+
+
+def to_int(val):
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return 0
+
+
+def to_bool(val):
+    return str(val).lower() == 'true'
+
+
 class Prefix(object):
     '''A class to define a route prefix'''
+    __slots__ = ('ipprefix', 'ucast_nhops', 'mcast_nhops', 'attached',
+                 'nexthops')
+
     def __init__(self):
         self.ipprefix = ''
-        self.ucast_nhops = ''
-        self.mcast_nhops = ''
+        self.ucast_nhops = 0
+        self.mcast_nhops = 0
         self.attached = False
         self.nexthops = []
 
@@ -26,6 +55,9 @@ class NextHop(object):
     A class to define a next-hop route. Meant to
     be used in an array within the Prefix class
     '''
+    __slots__ = ('ipnexthop', 'ifname', 'uptime', 'pref', 'metric',
+                 'clientname', 'hoptype', 'ubest')
+
     def __init__(self):
         self.ipnexthop = ''
         self.ifname = ''
@@ -37,6 +69,38 @@ class NextHop(object):
         self.ubest = True
 
 
+# How each field NX-API returns is stored. Fields not listed here are
+# not kept
+PREFIX_FIELDS = {
+    'ipprefix': str,
+    'ucast_nhops': to_int,
+    'mcast_nhops': to_int,
+    'attached': to_bool,
+}
+
+NEXTHOP_FIELDS = {
+    'ipnexthop': str,
+    'ifname': intern_name,
+    'uptime': intern_name,
+    'pref': to_int,
+    'metric': to_int,
+    'clientname': intern_name,
+    'hoptype': intern_name,
+    'ubest': to_bool,
+}
+
+
+def row_list(table, row):
+    '''Return the rows of a TABLE_* value as a list. NX-API returns a
+       single row as a dict rather than a one-element list'''
+    if not table:
+        return []
+    rows = table.get(row) or []
+    if isinstance(rows, list):
+        return rows
+    return [rows]
+
+
 def process_nexthop(next_hop):
     '''Processes nexthop data structure'''
 
@@ -48,8 +112,9 @@ def process_nexthop(next_hop):
 
     for key, val in next_hop.iteritems():
 
-        # use setattr to set all of the object attributes
-        setattr(nexthop_obj, key, val)
+        convert = NEXTHOP_FIELDS.get(key)
+        if convert is not None:
+            setattr(nexthop_obj, key, convert(val))
 
     return nexthop_obj
 
@@ -63,63 +128,424 @@ def process_prefix(prefix_row):
 
         # Check for TABLE_path (nested next_hop structure)
         if key == 'TABLE_path':
-            # Next hop is embedded in ['TABLE_path']['ROW_path']
-            nexthop_obj = process_nexthop(val['ROW_path'])
-            if not nexthop_obj == None:
-                prefix_obj.nexthops.append(nexthop_obj)
+            # Next hop is embedded in ['TABLE_path']['ROW_path'], which is
+            # a list when there are several (ECMP) paths
+            for next_hop in row_list(val, 'ROW_path'):
+                nexthop_obj = process_nexthop(next_hop)
+                if not nexthop_obj == None:
+                    prefix_obj.nexthops.append(nexthop_obj)
 
         else:
 
             # Swap hyphen for underscore in field names
             key = key.replace('-', '_')
 
-            # use setattr to set all of the object attributes
-            setattr(prefix_obj, key, val)
+            convert = PREFIX_FIELDS.get(key)
+            if convert is not None:
+                setattr(prefix_obj, key, convert(val))
 
     return prefix_obj
 
 
-def get_routes(url='', username='', password=''):
+class RouteTable(object):
     '''
-        Retrieves a collection of route entries from the FIB
-        of an NXAPI-enabled switch
+    Column-oriented store for the routes of one address family. Prefixes
+    and next hops are packed into flat arrays and names are stored once,
+    so a full table costs a few dozen bytes per route instead of a pair
+    of Python objects per prefix and next hop. Iterating or indexing
+    returns Prefix objects with the usual attributes
+    '''
+
+    def __init__(self, family=socket.AF_INET):
+        self.family = family
+        self.width = 4 if family == socket.AF_INET else 16
+
+        # Per prefix. Next hops for prefix i are nh_first[i] up to
+        # nh_first[i + 1]
+        self.nets = bytearray()
+        self.lens = array('B')
+        self.flags = array('B')
+        self.nhops = array('H')
+        self.mnhops = array('H')
+        self.nh_first = array('I', [0])
+
+        # Per next hop
+        self.nh_addrs = bytearray()
+        self.nh_ifnames = array('I')
+        self.nh_uptimes = array('I')
+        self.nh_prefs = array('I')
+        self.nh_metrics = array('I')
+        self.nh_clients = array('I')
+        self.nh_hoptypes = array('I')
+        self.nh_flags = array('B')
+
+        self.names = []
+        self.name_index = {}
+
+        # Next hops of the other address family, which a table of this
+        # one cannot hold, e.g. an IPv4 route over an IPv6 next hop
+        self.skipped_nexthops = 0
+
+    def name_id(self, name):
+        index = self.name_index.get(name)
+        if index is None:
+            index = len(self.names)
+            self.names.append(name)
+            self.name_index[name] = index
+        return index
+
+    def parse_nexthop(self, next_hop):
+        '''The packed address and fields of one ROW_path record, or None
+           when it has no next hop address or one of the other family'''
+        if not 'ipnexthop' in next_hop:
+            return None
+        try:
+            addr = socket.inet_pton(self.family, next_hop['ipnexthop'])
+        except socket.error:
+            self.skipped_nexthops += 1
+            return None
+        pref = to_int(next_hop.get('pref'))
+        metric = to_int(next_hop.get('metric'))
+        if not (0 <= pref <= 0xffffffff and 0 <= metric <= 0xffffffff):
+            raise ValueError('Bad pref or metric for next hop %s' %
+                             next_hop['ipnexthop'])
+        return (addr, next_hop.get('ifname', ''),
+                next_hop.get('uptime', ''), pref, metric,
+                next_hop.get('clientname', ''),
+                next_hop.get('hoptype', ''),
+                to_bool(next_hop.get('ubest', 'true')))
+
+    def add_row(self, prefix_row):
+        '''Append one ROW_prefix record as returned by NX-API. Every field
+           is parsed before anything is appended, so a malformed row
+           raises without leaving the columns out of step'''
+        (net, plen) = prefix_row['ipprefix'].split('/')
+        net = socket.inet_pton(self.family, net)
+        plen = int(plen)
+        if not 0 <= plen <= self.width * 8:
+            raise ValueError('Bad prefix length in %s' %
+                             prefix_row['ipprefix'])
+        nhops = to_int(prefix_row.get('ucast-nhops'))
+        mnhops = to_int(prefix_row.get('mcast-nhops'))
+        if not (0 <= nhops <= 0xffff and 0 <= mnhops <= 0xffff):
+            raise ValueError('Bad next hop count in %s' %
+                             prefix_row['ipprefix'])
+        nexthops = []
+        for next_hop in row_list(prefix_row.get('TABLE_path'), 'ROW_path'):
+            fields = self.parse_nexthop(next_hop)
+            if fields is not None:
+                nexthops.append(fields)
+
+        self.nets += net
+        self.lens.append(plen)
+        self.flags.append(to_bool(prefix_row.get('attached')))
+        self.nhops.append(nhops)
+        self.mnhops.append(mnhops)
+        for (addr, ifname, uptime, pref, metric, clientname, hoptype,
+             ubest) in nexthops:
+            self.nh_addrs += addr
+            self.nh_ifnames.append(self.name_id(ifname))
+            self.nh_uptimes.append(self.name_id(uptime))
+            self.nh_prefs.append(pref)
+            self.nh_metrics.append(metric)
+            self.nh_clients.append(self.name_id(clientname))
+            self.nh_hoptypes.append(self.name_id(hoptype))
+            self.nh_flags.append(ubest)
+        self.nh_first.append(len(self.nh_ifnames))
+
+    @classmethod
+    def from_rows(cls, rows, family=socket.AF_INET):
+        table = cls(family)
+        for prefix_row in rows:
+            table.add_row(prefix_row)
+        return table
+
+    def __len__(self):
+        return len(self.lens)
+
+    def net(self, i):
+        w = self.width
+        return socket.inet_ntop(self.family, bytes(self.nets[i * w:(i + 1) * w]))
+
+    def nexthop(self, j):
+        w = self.width
+        names = self.names
+        nexthop_obj = NextHop()
+        nexthop_obj.ipnexthop = socket.inet_ntop(self.family,
+            bytes(self.nh_addrs[j * w:(j + 1) * w]))
+        nexthop_obj.ifname = names[self.nh_ifnames[j]]
+        nexthop_obj.uptime = names[self.nh_uptimes[j]]
+        nexthop_obj.pref = int(self.nh_prefs[j])
+        nexthop_obj.metric = int(self.nh_metrics[j])
+        nexthop_obj.clientname = names[self.nh_clients[j]]
+        nexthop_obj.hoptype = names[self.nh_hoptypes[j]]
+        nexthop_obj.ubest = bool(self.nh_flags[j])
+        return nexthop_obj
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('route index out of range')
+        prefix_obj = Prefix()
+        prefix_obj.ipprefix = '%s/%d' % (self.net(i), self.lens[i])
+        prefix_obj.ucast_nhops = self.nhops[i]
+        prefix_obj.mcast_nhops = self.mnhops[i]
+        prefix_obj.attached = bool(self.flags[i])
+        prefix_obj.nexthops = [self.nexthop(j) for j in
+                               xrange(self.nh_first[i], self.nh_first[i + 1])]
+        return prefix_obj
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
+def addr_to_int(family, packed):
+    return int(hexlify(packed), 16)
+
+
+def ip_family(ip):
+    return socket.AF_INET6 if ':' in ip else socket.AF_INET
+
+
+class RouteIndex(object):
+    '''
+    Longest-prefix-match index over collected routes, one table per VRF
+    and address family. Prefixes are kept in a dict per prefix length,
+    keyed by the network bits, and a lookup probes the lengths present
+    from longest to shortest. That is at most 33 (IPv4) or 129 (IPv6)
+    dict lookups, and in practice only as many as there are distinct
+    lengths in the table
+    '''
+
+    def __init__(self):
+        # (vrf, family) -> [lengths longest first, {plen: {key: route}},
+        #                   RouteTable or None]
+        self.slots = {}
+
+    def slot(self, vrf, family):
+        slot = self.slots.get((vrf, family))
+        if slot is None:
+            slot = self.slots[(vrf, family)] = [[], {}, None]
+        return slot
+
+    def insert(self, slot, family, net, plen, route):
+        bits = 32 if family == socket.AF_INET else 128
+        nets = slot[1].get(plen)
+        if nets is None:
+            nets = slot[1][plen] = {}
+            slot[0] = sorted(slot[1], reverse=True)
+        nets[net >> (bits - plen)] = route
+
+    def add_table(self, table, vrf='default'):
+        '''Index every prefix of a RouteTable. Hits are returned as
+           Prefix objects built from the table on demand'''
+        slot = self.slot(vrf, table.family)
+        slot[2] = table
+        w = table.width
+        nets = table.nets
+        for i in xrange(len(table)):
+            net = addr_to_int(table.family, bytes(nets[i * w:(i + 1) * w]))
+            self.insert(slot, table.family, net, table.lens[i], i)
+
+    def add_prefix(self, prefix_obj, vrf='default'):
+        '''Index a single Prefix object'''
+        (net, plen) = prefix_obj.ipprefix.split('/')
+        family = ip_family(net)
+        self.insert(self.slot(vrf, family), family,
+                    addr_to_int(family, socket.inet_pton(family, net)),
+                    int(plen), prefix_obj)
+
+    def lookup(self, ip, vrf='default'):
+        '''Return the Prefix that ip is routed by, or None'''
+        return self.lookup_many([ip], vrf)[0]
+
+    def lookup_many(self, ips, vrf='default'):
+        '''Return the matching Prefix (or None) for each address in ips'''
+        results = []
+        # Hosts often share a route; build each Prefix only once per call
+        built = {}
+        for ip in ips:
+            family = ip_family(ip)
+            slot = self.slots.get((vrf, family))
+            if slot is None:
+                results.append(None)
+                continue
+            bits = 32 if family == socket.AF_INET else 128
+            addr = addr_to_int(family, socket.inet_pton(family, ip))
+            (lengths, nets, table) = slot
+            route = None
+            for plen in lengths:
+                route = nets[plen].get(addr >> (bits - plen))
+                if route is not None:
+                    break
+            if isinstance(route, (int, long)):
+                key = (family, route)
+                if key not in built:
+                    built[key] = table[route]
+                route = built[key]
+            results.append(route)
+        return results
+
+
+FAMILIES = {
+    'ipv4': (socket.AF_INET, 'show ip route vrf {0}'),
+    'ipv6': (socket.AF_INET6, 'show ipv6 route vrf {0}'),
+}
+
+
+class RouteCollection(object):
+    '''
+    Routes gathered from one switch: a RouteTable per (vrf, addrf) pair
+    plus the time spent collecting each VRF, in seconds
     '''
 
+    def __init__(self):
+        self.tables = {}
+        self.timings = {}
+
+    def table(self, vrf, addrf):
+        table = self.tables.get((vrf, addrf))
+        if table is None:
+            table = RouteTable(FAMILIES[addrf][0])
+            self.tables[(vrf, addrf)] = table
+        return table
+
+    def add_timing(self, vrf, seconds):
+        self.timings[vrf] = self.timings.get(vrf, 0.0) + seconds
+
+    def index(self):
+        '''Build a RouteIndex over every table'''
+        route_index = RouteIndex()
+        for (vrf, addrf), table in self.tables.iteritems():
+            route_index.add_table(table, vrf)
+        return route_index
+
+
+def make_nxapi(url, username, password, cmd):
+    # Imported here so the parsing and lookup code above can be used
+    # without the HTTP stack, e.g. by benchmark.py
+    from nxapi_utils import NXAPI
     thisnxapi = NXAPI()
     thisnxapi.set_target_url(url)
     thisnxapi.set_username(username)
     thisnxapi.set_password(password)
     thisnxapi.set_msg_type('cli_show')
-    thisnxapi.set_cmd('show ip route')
-    returndata = thisnxapi.send_req()
-    #print returnData[1]  #Uncomment to print the entire XML return
-
-    doc = xmltodict.parse(returndata[1])
+    thisnxapi.set_cmd(cmd)
+    return thisnxapi
 
-    #TODO: need to make more dynamic, for VRFs and IPv6 address families
-    prefixtable = doc['ins_api']['outputs']['output']['body']['TABLE_vrf'] \
-        ['ROW_vrf']['TABLE_addrf']['ROW_addrf']['TABLE_prefix']
 
+def get_vrfs(url='', username='', password=''):
+    '''Returns the names of the VRFs configured on the switch'''
+    thisnxapi = make_nxapi(url, username, password, 'show vrf')
+    return [row['vrf_name'] for row in
+            thisnxapi.iter_rows('TABLE_vrf/ROW_vrf', dict_constructor=dict)]
 
-    for key in prefixtable:
-        docsub = prefixtable[key]
 
-    routes = []
+def collect_routes(url='', username='', password='', vrfs=None,
+                   addrfs=('ipv4', 'ipv6'), max_workers=8):
+    '''
+        Retrieves every prefix, with all of its ECMP paths, for each VRF
+        and address family of an NXAPI-enabled switch.
+
+        With max_workers > 1 the VRFs are listed first and each
+        (vrf, addrf) table is fetched as its own streamed request, up
+        to max_workers at a time; timings are then the wall time of each
+        VRF's requests. With max_workers=1 all VRFs of an address family
+        come back in one streamed 'vrf all' request and a VRF's timing is
+        the time spent receiving its rows
+    '''
 
-    for prefix_row in docsub:           #executes once for every prefix
+    collection = RouteCollection()
+
+    if max_workers <= 1:
+        for addrf in addrfs:
+            cmd = FAMILIES[addrf][1].format('all')
+            thisnxapi = make_nxapi(url, username, password, cmd)
+            rows = thisnxapi.iter_rows('TABLE_prefix/ROW_prefix',
+                                       context=['vrf-name-out'],
+                                       dict_constructor=dict)
+            last = time.time()
+            for ctx, prefix_row in rows:
+                vrf = ctx.get('vrf-name-out', 'default')
+                collection.table(vrf, addrf).add_row(prefix_row)
+                now = time.time()
+                collection.add_timing(vrf, now - last)
+                last = now
+        return collection
+
+    if vrfs is None:
+        vrfs = get_vrfs(url, username, password)
+
+    jobs = Queue.Queue()
+    for vrf in vrfs:
+        for addrf in addrfs:
+            jobs.put((vrf, addrf))
+    # Tables are created up front so worker threads only fill them in
+    for vrf in vrfs:
+        for addrf in addrfs:
+            collection.table(vrf, addrf)
+    lock = threading.Lock()
+    errors = []
+
+    def worker():
+        while True:
+            try:
+                (vrf, addrf) = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            start = time.time()
+            try:
+                cmd = FAMILIES[addrf][1].format(vrf)
+                thisnxapi = make_nxapi(url, username, password, cmd)
+                table = collection.tables[(vrf, addrf)]
+                for prefix_row in thisnxapi.iter_rows(
+                        'TABLE_prefix/ROW_prefix', dict_constructor=dict):
+                    table.add_row(prefix_row)
+            except Exception:
+                # Kept whole so the caller sees where in the worker it failed
+                errors.append(sys.exc_info())
+            with lock:
+                collection.add_timing(vrf, time.time() - start)
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(max_workers, jobs.qsize()))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return collection
 
-        this_prefix = process_prefix(prefix_row)
 
-        routes.append(this_prefix)
+def get_routes(url='', username='', password=''):
+    '''
+        Retrieves a collection of route entries from the FIB
+        of an NXAPI-enabled switch, for every VRF and address family
+    '''
 
+    collection = collect_routes(url, username, password)
 
     # Print out routes
-    for route in routes:
-        print "The route to ", route.ipprefix, " has ", \
-            len(route.nexthops), " next-hop solutions"
-
-        for nexthop in route.nexthops:
-            print "via ", nexthop.ipnexthop, "out of", nexthop.ifname
+    for (vrf, addrf), routes in sorted(collection.tables.items()):
+        for route in routes:
+            print "The route to ", route.ipprefix, "in vrf", vrf, " has ", \
+                len(route.nexthops), " next-hop solutions"
+
+            for nexthop in route.nexthops:
+                print "via ", nexthop.ipnexthop, "out of", nexthop.ifname
+        if routes.skipped_nexthops:
+            print "Skipped", routes.skipped_nexthops, "next hops in vrf", \
+                vrf, "that are not", addrf
+
+    # Slowest VRFs first
+    for vrf, seconds in sorted(collection.timings.items(),
+                               key=lambda item: -item[1]):
+        print "Collected vrf", vrf, "in %.3f seconds" % seconds
+
+    return collection
 
 if __name__ == '__main__':
     get_routes('http://10.2.1.8/ins', 'admin', 'Cisco.com')
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2014 Cisco Systems Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Times the parse and join stages of the scripts in this directory on
+# synthetic tables, without a switch. Commands are served by
+# clibackend.ReplayBackend from generated outputs, optionally with an
+# injected latency. Each stage runs in its own forked process, so the peak
+# memory reported is that stage's alone.
+#
+#   python benchmark.py
+#   python benchmark.py --sizes 1000,10000,100000,1000000 --stages routes
+#
+# Prints, per stage and table size, the wall time, rows per second, the
+# peak resident memory of the process and how much of it the stage added.
+#
+
+import gc
+import json
+import os
+import resource
+import sys
+import time
+from argparse import ArgumentParser
+from cStringIO import StringIO
+
+import clibackend
+import xmltodict
+
+XML_HEAD = '<?xml version="1.0" encoding="ISO-8859-1"?>\n<nf:rpc-reply ' \
+    'xmlns:nf="urn:ietf:params:xml:ns:netconf:base:1.0" ' \
+    'xmlns="http://www.cisco.com/nxos:1.0:{0}"><nf:data>'
+XML_TAIL = '</nf:data></nf:rpc-reply>\n'
+XML_CMD = '{0} | xml'
+
+
+def xml_reply(namespace, body):
+    return XML_HEAD.format(namespace) + body + XML_TAIL
+
+
+def element(tag, value):
+    return '<{0}>{1}</{0}>'.format(tag, value)
+
+
+def mac(i):
+    return '0000.%04x.%04x' % (i >> 16, i & 0xffff)
+
+
+def ip(i):
+    return '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255)
+
+
+def arp_xml(n):
+    rows = ''.join(
+        '<ROW_adj>' + element('ip-addr-out', ip(i)) +
+        element('time-stamp', '00:05:12') + element('mac', mac(i)) +
+        element('intf-out', 'Vlan%d' % (i % 100 + 1)) + '</ROW_adj>'
+        for i in xrange(n))
+    return xml_reply('arp', '<show><ip><arp><__readonly__><TABLE_vrf>'
+                     '<ROW_vrf><vrf-name-out>default</vrf-name-out>'
+                     '<TABLE_adj>' + rows + '</TABLE_adj></ROW_vrf>'
+                     '</TABLE_vrf></__readonly__></arp></ip></show>')
+
+
+def mac_port(i):
+    return 'Po%d' % (i % 16 + 1) if i % 4 == 0 else 'Eth1/%d' % (i % 48 + 1)
+
+
+def mac_xml(n):
+    rows = ''.join(
+        '<ROW_mac_address>' + element('disp_mac_addr', mac(i)) +
+        element('disp_type', '*') + element('disp_vlan', i % 100 + 1) +
+        element('disp_is_static', 'disabled') + element('disp_age', '0') +
+        element('disp_is_secure', 'disabled') +
+        element('disp_is_ntfy', 'disabled') +
+        element('disp_port', mac_port(i)) + '</ROW_mac_address>'
+        for i in xrange(n))
+    return xml_reply('l2fm', '<show><mac><address-table><__readonly__>'
+                     '<TABLE_mac_address>' + rows + '</TABLE_mac_address>'
+                     '</__readonly__></address-table></mac></show>')
+
+
+def portchannel_xml():
+    rows = ''.join(
+        '<ROW_channel>' + element('port-channel', 'port-channel%d' % po) +
+        '<TABLE_member>' + ''.join(
+            '<ROW_member>' + element('port', 'Ethernet2/%d' % (po * 2 + k)) +
+            '</ROW_member>' for k in range(2)) + '</TABLE_member>'
+        '</ROW_channel>' for po in range(1, 17))
+    return xml_reply('eth_pcm_dc3', '<show><port-channel><summary>'
+                     '<__readonly__><TABLE_channel>' + rows +
+                     '</TABLE_channel></__readonly__></summary>'
+                     '</port-channel></show>')
+
+
+def cdp_xml():
+    rows = ''.join(
+        '<ROW_cdp_neighbor_brief_info>' +
+        element('intf_id', 'Ethernet1/%d' % port) +
+        element('device_id', 'server%d' % port) +
+        element('platform_id', 'N2K-C2248TP') +
+        element('port_id', 'Ethernet0/%d' % port) +
+        '</ROW_cdp_neighbor_brief_info>' for port in range(1, 49))
+    return xml_reply('cdpd', '<show><cdp><neighbors><__readonly__>'
+                     '<TABLE_cdp_neighbor_brief_info>' + rows +
+                     '</TABLE_cdp_neighbor_brief_info></__readonly__>'
+                     '</neighbors></cdp></show>')
+
+
+def route_rows(n):
+    rows = []
+    for i in xrange(n):
+        paths = [{'ipnexthop': '192.168.%d.%d' % (k, i % 250 + 1),
+                  'ifname': 'Eth1/%d' % (k + 1), 'uptime': 'P1DT2H',
+                  'pref': '110', 'metric': '41', 'clientname': 'ospf-1',
+                  'ubest': 'true'} for k in range(1 + i % 2)]
+        rows.append({'ipprefix': '%s/32' % ip(i), 'ucast-nhops': '1',
+                     'mcast-nhops': '0', 'attached': 'false',
+                     'TABLE_path': {'ROW_path': paths}})
+    return rows
+
+
+def interface_xml(n):
+    rows = ''.join(
+        '<ROW_interface>' + element('interface', 'Ethernet%d/%d' % divmod(i, 48)) +
+        element('state', 'up') + element('eth_bw', '10000000') +
+        element('eth_load_interval1_rx', '30') +
+        element('eth_inrate1_bits', str(i * 1000 % 10000000000)) +
+        element('eth_inrate1_pkts', str(i % 100000)) +
+        element('eth_load_interval1_tx', '30') +
+        element('eth_outrate1_bits', str(i * 700 % 10000000000)) +
+        element('eth_outrate1_pkts', str(i % 70000)) + '</ROW_interface>'
+        for i in xrange(n))
+    return xml_reply('if_manager', '<show><interface><__readonly__>'
+                     '<TABLE_interface>' + rows + '</TABLE_interface>'
+                     '</__readonly__></interface></show>')
+
+
+#
+# Stages. Each has a setup(n, latency) that builds its input, which is not
+# timed, and returns the function to time
+#
+
+def stage_xmltodict_parse(n, latency):
+    doc = arp_xml(n)
+    return lambda: xmltodict.parse(doc)
+
+
+def stage_xmltodict_iterparse(n, latency):
+    doc = arp_xml(n)
+
+    def run():
+        # From a file object, as it would come off an HTTP response, so
+        # rows are handed out chunk by chunk
+        for row in xmltodict.iterparse(StringIO(doc), 'TABLE_adj/ROW_adj'):
+            pass
+    return run
+
+
+def stage_findkey(n, latency):
+    import dictquery
+    doc = json.loads(json.dumps(xmltodict.parse(arp_xml(n))))
+    return lambda: dictquery.findkey(doc, 'ROW_adj')
+
+
+def stage_routes(n, latency):
+    import RoutingTable
+    rows = route_rows(n)
+    return lambda: [RoutingTable.process_prefix(row) for row in rows]
+
+
+def stage_routetable(n, latency):
+    import RoutingTable
+    rows = route_rows(n)
+    return lambda: RoutingTable.RouteTable.from_rows(rows)
+
+
+def stage_route_lookup(n, latency):
+    import RoutingTable
+    index = RoutingTable.RouteIndex()
+    index.add_table(RoutingTable.RouteTable.from_rows(route_rows(n)))
+    ips = [ip(i) for i in xrange(n)]
+    return lambda: index.lookup_many(ips)
+
+
+def supercommand_fixtures(n):
+    return {'cli': {
+        XML_CMD.format('show ip arp vrf all'): arp_xml(n),
+        XML_CMD.format('show mac address-table'): mac_xml(n),
+        XML_CMD.format('show port-channel summary'): portchannel_xml(),
+        XML_CMD.format('show cdp neighbors'): cdp_xml(),
+    }}
+
+
+def stage_supercommand_tables(n, latency):
+    clibackend.use(clibackend.ReplayBackend(supercommand_fixtures(n),
+                                            latency))
+    import supercommand
+    return supercommand.BulkTables
+
+
+def stage_supercommand_join(n, latency):
+    clibackend.use(clibackend.ReplayBackend(supercommand_fixtures(n),
+                                            latency))
+    import supercommand
+    tables = supercommand.BulkTables()
+    null = open(os.devnull, 'w')
+
+    def run():
+        writer = supercommand.RecordWriter('json', null)
+        for records in supercommand.resolvehosts(
+                tables.arp, tables.getmacentry, tables.getcdpentry, 1):
+            writer.write(records)
+    return run
+
+
+def stage_interface_rate(n, latency):
+    clibackend.use(clibackend.ReplayBackend({'cli': {
+        'show interface | xml | exclude "]]>]]>"': interface_xml(n)}},
+        latency))
+    import runpy
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'interface_rate.py')
+
+    def run():
+        stdout, argv = sys.stdout, sys.argv
+        sys.stdout = open(os.devnull, 'w')
+        sys.argv = [path]
+        try:
+            runpy.run_path(path, run_name='interface_rate')
+        finally:
+            sys.stdout, sys.argv = stdout, argv
+    return run
+
+
+STAGES = [
+    ('xmltodict.parse', stage_xmltodict_parse),
+    ('xmltodict.iterparse', stage_xmltodict_iterparse),
+    ('findkey', stage_findkey),
+    ('process_prefix', stage_routes),
+    ('RouteTable.from_rows', stage_routetable),
+    ('RouteIndex.lookup_many', stage_route_lookup),
+    ('supercommand tables', stage_supercommand_tables),
+    ('supercommand join', stage_supercommand_join),
+    ('interface_rate', stage_interface_rate),
+]
+
+
+def peak_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def measure(setup, n, latency):
+    '''Runs one stage in a child process and returns
+       (seconds, peak MB, MB added by the stage) or an error string'''
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        try:
+            run = setup(n, latency)
+            gc.collect()
+            before = peak_mb()
+            started = time.time()
+            run()
+            result = (time.time() - started, peak_mb(), peak_mb() - before)
+        except Exception, e:
+            result = '%s: %s' % (e.__class__.__name__, e)
+        os.write(write_end, json.dumps(result))
+        os._exit(0)
+    os.close(write_end)
+    output = ''
+    while True:
+        chunk = os.read(read_end, 4096)
+        if not chunk:
+            break
+        output += chunk
+    os.close(read_end)
+    os.waitpid(pid, 0)
+    return json.loads(output) if output else 'no result'
+
+
+def main():
+    parser = ArgumentParser('benchmark')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='Comma separated row counts, up to 1000000 '
+                             '(default 1000,10000,100000)')
+    parser.add_argument('--stages',
+                        help='Comma separated substrings of stage names '
+                             'to run (default all)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Milliseconds added to every replayed command')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    wanted = args.stages.split(',') if args.stages else None
+
+    table = '{0:26}{1:>9}{2:>10}{3:>13}{4:>10}{5:>10}'
+    print table.format('Stage', 'Rows', 'Seconds', 'Rows/s', 'Peak MB',
+                       'Added MB')
+    for name, setup in STAGES:
+        if wanted and not any(part in name for part in wanted):
+            continue
+        for n in sizes:
+            result = measure(setup, n, args.latency / 1000.0)
+            if isinstance(result, basestring):
+                print table.format(name, n, '', '', '', '') + '  ' + result
+            else:
+                seconds, peak, added = result
+                rate = n / seconds if seconds else 0
+                print table.format(name, n, '%.3f' % seconds, '%.0f' % rate,
+                                   '%.1f' % peak, '%.1f' % added)
+            sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+#
+# Copyright (C) 2014 Cisco Systems Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# One way for scripts to run commands, whether they run on the switch, off
+# box through NX-API, or against recorded outputs. Every backend has the
+# same methods with the same return types:
+#
+#   cli(cmd)       show output as text
+#   clid(cmd)      structured output as a JSON string
+#   clidict(cmd)   structured output as Python objects
+#   clic(cmd)      run configuration commands
+#   batch(cmds, method)   one [output, status, msg] per command
+#   submit(cmd, method)   run in the background, returns a Pending
+#
+# and raises CommandError when a command fails. The module level functions
+# use the backend chosen with use(), the on-box one by default:
+#
+#   from clibackend import cli, clidict
+#   use(NXAPIBackend('http://10.1.1.1/ins', 'admin', 'pass'))
+#
+# RecordingBackend saves what another backend returns to a fixtures file,
+# which ReplayBackend serves back, with an optional latency per command.
+#
+# Scripts with an ArgumentParser can call add_backend_arguments() and
+# backend_from_args() to offer --switch, --username, --password,
+# --session-cache, --replay, --replay-latency and --record.
+#
+
+import atexit
+import json
+import threading
+import time
+import Queue
+
+import nxplatform
+
+
+class CommandError(Exception):
+    pass
+
+
+class UnstructuredOutput(CommandError):
+    pass
+
+
+class Pending:
+    '''Result of a command submitted to run in the background'''
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.output = None
+        self.error = None
+
+    def done(self):
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        '''Waits for the command, then returns its output or raises its
+           error'''
+        if not self.event.wait(timeout):
+            raise CommandError('Timed out waiting for command')
+        if self.error is not None:
+            raise self.error
+        return self.output
+
+
+class Backend:
+    '''Runs commands somewhere. Subclasses implement cli, clidict and
+       clic; the rest is built on them'''
+
+    max_workers = 4
+
+    def __init__(self):
+        self.tasks = None
+        self.lock = threading.Lock()
+
+    def clid(self, cmd):
+        return json.dumps(self.clidict(cmd))
+
+    def xmldict(self, cmd):
+        '''The structured output of cmd, converted from its XML output with
+           xmltodict, for boxes without clid'''
+        try:
+            import xmltodict
+        except ImportError:
+            print 'Script is unsupported on this platform: requires xmltodict'
+            raise
+        tag = '__readonly__'
+        starttag, endtag = '<' + tag + '>', '</' + tag + '>'
+        output = self.cli('{0} | xml'.format(cmd))
+        start_index, end_index = output.find(starttag), output.find(endtag)
+        if start_index == -1 or end_index == -1:
+            raise UnstructuredOutput(
+                'Command {0} does not support structured output: {1}'.format(
+                    cmd, output))
+        output = xmltodict.parse(
+            output[start_index:end_index + len(endtag)])
+        return output[tag]
+
+    def run(self, cmd, method='clidict'):
+        return getattr(self, method)(cmd)
+
+    def batch(self, cmds, method='clidict'):
+        '''Runs several commands. Returns [output, status, msg] per
+           command; output is None and status non zero when it failed'''
+        results = []
+        for cmd in cmds:
+            try:
+                results.append([self.run(cmd, method), 0, 'Success'])
+            except CommandError, e:
+                results.append([None, 1, str(e)])
+        return results
+
+    def submit(self, cmd, method='clidict'):
+        '''Runs a command on one of max_workers background threads'''
+        with self.lock:
+            if self.tasks is None:
+                self.tasks = Queue.Queue()
+                for _ in range(self.max_workers):
+                    thread = threading.Thread(target=self.worker)
+                    thread.daemon = True
+                    thread.start()
+        pending = Pending()
+        self.tasks.put((pending, cmd, method))
+        return pending
+
+    def worker(self):
+        while True:
+            (pending, cmd, method) = self.tasks.get()
+            try:
+                pending.output = self.run(cmd, method)
+            except Exception, e:
+                pending.error = e
+            pending.event.set()
+
+
+class OnBoxBackend(Backend):
+    '''cli()/clid() of the switch the script runs on. Where there is no
+       clid (Nexus 5000 and others), structured output is converted from
+       the XML output with xmltodict'''
+
+    def __init__(self, platform=None):
+        Backend.__init__(self)
+        self.platform = platform or nxplatform.platform
+
+    def cli(self, cmd):
+        self.platform.load()
+        try:
+            return self.platform.cli(cmd)
+        except Exception, e:
+            raise CommandError(str(e))
+
+    def clidict(self, cmd):
+        return json.loads(self.clid(cmd))
+
+    def clid(self, cmd):
+        if not self.platform.has_clid():
+            return json.dumps(self.xmldict(cmd))
+        try:
+            return self.platform.clid(cmd)
+        except Exception, e:
+            raise CommandError(str(e))
+
+    def clic(self, cmd):
+        return self.cli(cmd)
+
+
+class NXAPIBackend(Backend):
+    '''A switch reached through NX-API. Keyword arguments are passed to
+       nxapi_utils.NXAPISession; batch() sends the commands in one
+       request. A switch that cannot be reached or answers with an HTTP
+       error raises CommandError, like a failed command'''
+
+    def __init__(self, target_url, username, password, **kwargs):
+        Backend.__init__(self)
+        # Imported here so on-box scripts do not load the HTTP stack
+        import httplib
+        import socket
+        import urllib2
+        import nxapi_utils
+        self.nxapi_utils = nxapi_utils
+        self.transport_errors = (urllib2.URLError, httplib.HTTPException,
+                                 socket.error)
+        if '://' not in target_url:
+            target_url = 'http://%s/ins' % target_url
+        self.session = nxapi_utils.NXAPISession(target_url, username,
+                                                password, **kwargs)
+
+    def call(self, function, *args):
+        try:
+            return function(*args)
+        except (self.nxapi_utils.cmd_exec_error,
+                self.nxapi_utils.unexpected_error), e:
+            raise CommandError(str(e))
+        except self.transport_errors, e:
+            raise CommandError('{0}: {1}'.format(self.session.target_url,
+                                                 e))
+
+    def cli(self, cmd):
+        return self.call(self.session.cli, cmd)
+
+    def clidict(self, cmd):
+        return self.call(self.session.clidict, cmd)
+
+    def clid(self, cmd):
+        return self.call(self.session.clid, cmd)
+
+    def clic(self, cmd):
+        return self.call(self.session.clic, cmd)
+
+    def batch(self, cmds, method='clidict'):
+        if method == 'clidict':
+            return self.call(self.session.clidict_batch, cmds)
+        if method == 'clid':
+            return self.call(self.session.clid_batch, cmds)
+        if method == 'cli':
+            return self.call(self.session.send_cmd_batch, cmds,
+                             'cli_show_ascii')
+        return Backend.batch(self, cmds, method)
+
+
+class ReplayBackend(Backend):
+    '''Serves outputs recorded earlier. fixtures is a dict, or the path of
+       a JSON file, of {method: {cmd: output}} where method is cli,
+       clidict or clic. clid is served from the clidict outputs; commands
+       with only a recorded 'cmd | xml' cli output, as on a box without
+       clid, are converted from it. Each
+       command takes latency seconds, to stand in for a real switch'''
+
+    def __init__(self, fixtures, latency=0.0):
+        Backend.__init__(self)
+        if isinstance(fixtures, basestring):
+            with open(fixtures) as f:
+                fixtures = json.load(f)
+        self.fixtures = fixtures
+        self.latency = latency
+
+    def lookup(self, method, cmd):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            return self.fixtures[method][cmd]
+        except KeyError:
+            raise CommandError('No recorded {0} output for {1}'.format(
+                method, cmd))
+
+    def cli(self, cmd):
+        return self.lookup('cli', cmd)
+
+    def clidict(self, cmd):
+        if cmd not in self.fixtures.get('clidict', {}) and \
+                '{0} | xml'.format(cmd) in self.fixtures.get('cli', {}):
+            # Recorded on a box without clid, so convert as it did
+            return self.xmldict(cmd)
+        return self.lookup('clidict', cmd)
+
+    def clic(self, cmd):
+        return self.lookup('clic', cmd)
+
+
+class RecordingBackend(Backend):
+    '''Passes commands to another backend and keeps their outputs, so
+       that save() writes a fixtures file for ReplayBackend'''
+
+    def __init__(self, backend, path=None):
+        Backend.__init__(self)
+        self.backend = backend
+        self.path = path
+        self.fixtures = {'cli': {}, 'clidict': {}, 'clic': {}}
+
+    def record(self, method, cmd, output):
+        with self.lock:
+            self.fixtures[method][cmd] = output
+        return output
+
+    def cli(self, cmd):
+        return self.record('cli', cmd, self.backend.cli(cmd))
+
+    def clidict(self, cmd):
+        return self.record('clidict', cmd, self.backend.clidict(cmd))
+
+    def clid(self, cmd):
+        output = self.backend.clid(cmd)
+        self.record('clidict', cmd, json.loads(output))
+        return output
+
+    def clic(self, cmd):
+        return self.record('clic', cmd, self.backend.clic(cmd))
+
+    def save(self, path=None):
+        with self.lock:
+            with open(path or self.path, 'w') as f:
+                json.dump(self.fixtures, f)
+
+
+backend = None
+
+
+def use(new_backend):
+    '''Sends the module level functions to new_backend'''
+    global backend
+    backend = new_backend
+    return new_backend
+
+
+def current():
+    if backend is None:
+        use(OnBoxBackend())
+    return backend
+
+
+def cli(cmd):
+    return current().cli(cmd)
+
+
+def clid(cmd):
+    return current().clid(cmd)
+
+
+def clidict(cmd):
+    return current().clidict(cmd)
+
+
+def clic(cmd):
+    return current().clic(cmd)
+
+
+def batch(cmds, method='clidict'):
+    return current().batch(cmds, method)
+
+
+def submit(cmd, method='clidict'):
+    return current().submit(cmd, method)
+
+
+def add_backend_arguments(parser):
+    group = parser.add_argument_group('where to run commands')
+    group.add_argument('--switch',
+                       help='Run off box against this NX-API switch '
+                            '(address or URL)')
+    group.add_argument('--username', default='admin')
+    group.add_argument('--password', default='')
+    group.add_argument('--session-cache',
+                       help='File that keeps NX-API login cookies between '
+                            'runs')
+    group.add_argument('--replay',
+                       help='Serve commands from a recorded fixtures file')
+    group.add_argument('--replay-latency', type=float, default=0.0,
+                       help='Milliseconds each replayed command takes')
+    group.add_argument('--record',
+                       help='Save every command output to this fixtures '
+                            'file on exit')
+
+
+def backend_from_args(args):
+    '''Returns and selects the backend asked for on the command line'''
+    if args.replay:
+        selected = ReplayBackend(args.replay, args.replay_latency / 1000.0)
+    elif args.switch:
+        if args.session_cache:
+            import nxapi_utils
+            nxapi_utils.use_session_file(args.session_cache)
+        selected = NXAPIBackend(args.switch, args.username, args.password)
+    else:
+        selected = current()
+    if args.record:
+        selected = RecordingBackend(selected, args.record)
+        atexit.register(selected.save)
+    return use(selected)
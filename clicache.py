@@ -0,0 +1,141 @@
+#
+# Copyright (C) 2014 Cisco Systems Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# A small cache for command outputs, so that scripts asking the same
+# question of a switch several times in a few seconds only run the command
+# once. Wrap a cli, clid or clidict function with CliCache.cached():
+#
+#   cache = CliCache(maxsize=256, ttl=5, ttls={'ping': 1})
+#   clidict = cache.cached(clidict)
+#
+# Outputs are shared between callers and must be treated as read only.
+#
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class CliCache:
+    '''Least recently used cache of command outputs. Entries expire ttl
+       seconds after they were stored; ttls maps command prefixes to their
+       own ttl, the longest matching prefix wins. Concurrent fetches of
+       the same key share one call'''
+
+    def __init__(self, maxsize=256, ttl=5.0, ttls=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = sorted((ttls or {}).items(),
+                           key=lambda item: len(item[0]), reverse=True)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # key -> [done event, output, succeeded, exc_info] for fetches in
+        # progress
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def ttl_for(self, cmd):
+        for prefix, ttl in self.ttls:
+            if cmd.startswith(prefix):
+                return ttl
+        return self.ttl
+
+    def get(self, key):
+        '''Returns (True, value) for a live entry, (False, None) otherwise'''
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] <= time.time():
+                self.misses += 1
+                return False, None
+            # Reinsert so the entry moves to the most recently used end
+            self.entries[key] = entry
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, value, cmd=''):
+        ttl = self.ttl_for(cmd)
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + ttl, value)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        '''Drops one entry, or every entry when key is None'''
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def fetch(self, key, cmd, function, *args):
+        '''Returns the cached value of key, or calls function(*args) and
+           caches its result. While one thread is calling function for a
+           key, others asking for the same key wait for its result. A
+           call that raises is not cached; the threads that waited on it
+           get the same exception, so a failing command still runs once'''
+        found, value = self.get(key)
+        if found:
+            return value
+        with self.lock:
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = [threading.Event(), None, False,
+                                               None]
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight[0].wait()
+            if flight[2]:
+                return flight[1]
+            raise flight[3][0], flight[3][1], flight[3][2]
+        try:
+            value = function(*args)
+            flight[1], flight[2] = value, True
+            self.put(key, value, cmd)
+            return value
+        except:
+            flight[3] = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            flight[0].set()
+
+    def cached(self, function, name=None):
+        '''Wraps function(cmd, ...) so its result is served from the cache
+           while fresh'''
+        name = name or function.__name__
+
+        def wrapper(cmd, *args):
+            return self.fetch((name, cmd) + args, cmd, function, cmd, *args)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'coalesced': self.coalesced}
@@ -0,0 +1,161 @@
+#
+# Copyright (C) 2014 Cisco Systems Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Lookups in the decoded output of clid/clidict. A selector is a key name,
+# e.g. 'ROW_adj', or a path of key names, e.g. 'TABLE_adj/ROW_adj'. The
+# first name is searched for at any depth and the rest are followed from
+# there; lists along the way are looked through, as xmltodict turns
+# repeated elements into lists.
+#
+#   rows = findkey(output, 'ROW_adj')            # every match, or None
+#   row = findfirst(output, 'ROW_cdp_neighbor_brief_info')
+#   found = query(['ROW_adj', 'ROW_vrf']).extract(output)
+#
+# Selectors are compiled once and cached. The document is walked with an
+# explicit stack, so deep documents do not hit the recursion limit, and
+# keys are matched with one dict lookup rather than comparing strings.
+#
+
+_queries = {}
+
+# Container kind by class, filled in as classes are seen, so the walk
+# does one dict lookup per value instead of isinstance() calls
+SCALAR, DICT, LIST = 0, 1, 2
+_kinds = {}
+
+
+def kind(node):
+    cls = node.__class__
+    found = _kinds.get(cls)
+    if found is None:
+        if isinstance(node, dict):
+            found = DICT
+        elif isinstance(node, list):
+            found = LIST
+        else:
+            found = SCALAR
+        _kinds[cls] = found
+    return found
+
+
+def follow(node, path):
+    '''Returns the values reached from node by following path, looking
+       through lists at every step'''
+    nodes = [node]
+    for name in path:
+        found = []
+        for node in nodes:
+            if isinstance(node, list):
+                for item in node:
+                    if isinstance(item, dict) and name in item:
+                        found.append(item[name])
+            elif isinstance(node, dict) and name in node:
+                found.append(node[name])
+        nodes = found
+    return nodes
+
+
+class Query:
+    '''A compiled set of selectors. When value is given, only matches
+       whose text equals it are returned'''
+
+    def __init__(self, selectors, value=None):
+        if isinstance(selectors, basestring):
+            selectors = [selectors]
+        self.selectors = list(selectors)
+        self.value = None if value is None else unicode(value)
+        # first key name -> [(selector, rest of path)]
+        self.heads = {}
+        for selector in self.selectors:
+            names = selector.split('/')
+            self.heads.setdefault(names[0], []).append((selector, names[1:]))
+
+    def iterfind(self, doc):
+        '''Yields (selector, match) in document order, parents before
+           their children'''
+        heads = self.heads
+        value = self.value
+        kinds = _kinds
+        if kind(doc) == SCALAR:
+            return
+        stack = [doc]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node = pop()
+            if kinds[node.__class__] == LIST:
+                for item in reversed(node):
+                    found = kinds.get(item.__class__)
+                    if found is None:
+                        found = kind(item)
+                    if found:
+                        push(item)
+                continue
+            children = []
+            for k, v in node.iteritems():
+                targets = heads.get(k)
+                if targets:
+                    for selector, rest in targets:
+                        for match in (follow(v, rest) if rest else [v]):
+                            if value is None or (kind(match) == SCALAR and
+                                                 unicode(match) == value):
+                                yield selector, match
+                found = kinds.get(v.__class__)
+                if found is None:
+                    found = kind(v)
+                if found:
+                    children.append(v)
+            while children:
+                push(children.pop())
+
+    def findall(self, doc):
+        return [match for selector, match in self.iterfind(doc)]
+
+    def first(self, doc, default=None):
+        '''Returns the first match, without walking the rest of doc'''
+        for selector, match in self.iterfind(doc):
+            return match
+        return default
+
+    def extract(self, doc):
+        '''Returns {selector: [matches]} for all selectors, in one walk'''
+        found = dict((selector, []) for selector in self.selectors)
+        for selector, match in self.iterfind(doc):
+            found[selector].append(match)
+        return found
+
+
+def query(selectors, value=None):
+    '''Returns the compiled Query for selectors, compiling it once'''
+    if not isinstance(selectors, basestring):
+        selectors = tuple(selectors)
+    key = (selectors, value)
+    compiled = _queries.get(key)
+    if compiled is None:
+        compiled = _queries[key] = Query(selectors, value)
+    return compiled
+
+
+def findkey(dct, key, value=None):
+    '''Returns a list of the values of key (or selector) anywhere in dct,
+       optionally only those equal to value, or None when there are none'''
+    found = query(key, value or None).findall(dct)
+    return found if len(found) > 0 else None
+
+
+def findfirst(dct, key, value=None, default=None):
+    '''Returns the first value of key (or selector) in dct'''
+    return query(key, value or None).first(dct, default)
@@ -27,30 +27,22 @@
 # Additional help is available using the --help option.
 #
 
-import argparse
 import os
 import re
 import socket
 import sys
 import time
 
-import cisco
+# clibackend handles cisco.cli() type inconsistencies, and only imports
+# the cli module when the first command runs
+from clibackend import cli
+from nxplatform import timing
 
 supported = [
     "Nexus3016", "Nexus3064", "Nexus3048", "Nexus3132", "Nexus5548", 
     "Nexus5596", "Nexus 6001", "Nexus 6004"
     ]
 
-# Handle cisco.cli() type inconsistencies
-def make_cli_wrapper(f):
-    if type(f("show clock")) is tuple:
-        def cli_wrapper(*args, **kwargs):
-            return f(*args, **kwargs)[1]
-        return cli_wrapper
-    return f
-
-cli = make_cli_wrapper(cisco.cli)
-
 # Prevent print() buffering when connected via tty
 sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
 
@@ -108,16 +100,26 @@ def af_check(ip):
         return True
     
 def main():
+    # argparse is only needed here, so it is not paid for at import time
+    import argparse
+    timing.mark('imports')
     parser = argparse.ArgumentParser()
     parser.add_argument("package", help = 
                         "OpenFlow Plug-in OVA package to install")
     parser.add_argument("-m", "--maxflows", help = 
                         "Tune switch TCAM to support maximum number of flows",
                         required = False, action = "store_true")
+    parser.add_argument("--timing", help =
+                        "Print how long startup and platform detection took",
+                        required = False, action = "store_true")
     args = parser.parse_args()
+    timing.mark('arguments')
 
     ver = cli("show version")
     platform = re.search(r"(Hardware\s*cisco\s)(.*)(?=\sC)", ver).group(2)
+    timing.mark('show version')
+    if args.timing:
+        timing.report()
     if platform not in supported:
         print "ERROR: Unsupported hardware platform. Exiting ..."
         sys.exit(1)
@@ -21,11 +21,37 @@
 # This sample displays the route that is used to reach the device contacting
 # the web server, and also displays the ping latency to the host
 #
+# With --store DIR every latency measured is also kept, in microseconds, in
+# a tsstore.TimeSeriesStore there, one series per client: latency/<ip>
+#
+# Requests are served on a thread each, so a slow ping for one browser
+# does not hold up the others. The page itself is built once, and sent
+# gzip compressed with an ETag so a reload costs a 304.
+#
 
-import cli
+import clibackend
+import gzip
+import hashlib
 import json
 import re
+import time
 import BaseHTTPServer
+import SocketServer
+from argparse import ArgumentParser
+from cStringIO import StringIO
+from clicache import CliCache
+
+clid = clibackend.clid
+runcli = clibackend.cli
+
+# Each open page polls every second. Answers are kept per path and client
+# for a short while, and a request arriving while the same answer is being
+# worked out waits for it rather than running the command again, so ten
+# dashboards cost the switch no more than one per client
+pages = CliCache(maxsize=1024, ttl=5, ttls={'/latency': 1})
+
+# Where measured latencies are kept, when --store is given
+store = None
 
 class Route():
 
@@ -49,7 +75,7 @@ class Route():
     def data(self, **kwargs):
         s = kwargs['s']
         ip = s.client_address[0]
-        r = json.loads(cli.clid('show ip route %s vrf management' % ip))
+        r = json.loads(clid('show ip route %s vrf management' % ip))
         return self.printroute(r)
 
 class Latency():
@@ -60,9 +86,13 @@ class Latency():
     def data(self, **kwargs):
         s = kwargs['s']
         ip = s.client_address[0]
-        a = ''.join(cli.cli('ping %s vrf management count 1' % ip).split('\n'))
+        a = ''.join(runcli('ping %s vrf management count 1' % ip).split('\n'))
         m = re.match('.*time=([0-9\.]+).*', a)
-        return float(m.group(1))
+        latency = float(m.group(1))
+        if store is not None:
+            store.append('latency/' + ip, time.time(),
+                         (int(round(latency * 1000)),))
+        return latency
 
 def HTMLBuilder():
     return '''
@@ -136,23 +166,86 @@ def HTMLBuilder():
    </body>
  <html>
 '''    
+
+
+# The page never changes, so its body, compressed form and ETag are
+# worked out once
+PAGE = HTMLBuilder()
+PAGE_ETAG = '"%s"' % hashlib.md5(PAGE).hexdigest()
+
+
+def compress(body):
+    out = StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0)
+    f.write(body)
+    f.close()
+    return out.getvalue()
+
+PAGE_GZIP = compress(PAGE)
+
+PROVIDERS = {'/latency': Latency, '/route': Route}
+
+
+def render(provider, s):
+    return json.dumps(provider().data(s=s))
+
+
 class httphandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
-    def do_GET(s):
-        s.send_response(200)
-        s.send_header('Content-type', 'text/html')
+    # Keep-alive, so a page polling every second reuses its connection
+    protocol_version = 'HTTP/1.1'
+
+    def respond(s, status, body, headers):
+        s.send_response(status)
+        for name, value in headers:
+            s.send_header(name, value)
+        s.send_header('Content-Length', str(len(body)))
         s.end_headers()
-        if s.path == '/':
-            s.wfile.write(HTMLBuilder())
-        elif s.path == '/latency':
-            lat = Latency().data(s=s)
-            s.wfile.write(json.dumps(lat))
-        elif s.path == '/route':
-            rout = Route().data(s=s)
-            s.wfile.write(json.dumps(rout))
+        s.wfile.write(body)
+
+    def do_GET(s):
+        path = s.path.split('?')[0]
+        if path == '/':
+            headers = [('Content-type', 'text/html'), ('ETag', PAGE_ETAG),
+                       ('Cache-Control', 'no-cache'),
+                       ('Vary', 'Accept-Encoding')]
+            if s.headers.get('If-None-Match') == PAGE_ETAG:
+                s.respond(304, '', headers[1:])
+            elif 'gzip' in s.headers.get('Accept-Encoding', ''):
+                s.respond(200, PAGE_GZIP,
+                          headers + [('Content-Encoding', 'gzip')])
+            else:
+                s.respond(200, PAGE, headers)
+        elif path in PROVIDERS:
+            try:
+                body = pages.fetch((path, s.client_address[0]), path,
+                                   render, PROVIDERS[path], s)
+            except Exception:
+                s.send_error(500)
+                return
+            s.respond(200, body, [('Content-type', 'application/json'),
+                                  ('Cache-Control', 'no-store')])
+        else:
+            s.send_error(404)
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
 
 if __name__ == '__main__':
-    httpserver = BaseHTTPServer.HTTPServer
+    parser = ArgumentParser('httpserver')
+    parser.add_argument('--store',
+                        help='Keep measured latencies in the time-series '
+                             'store in this directory')
+    args = parser.parse_args()
+    if args.store:
+        # Only loaded when asked for, so tsstore need not be on bootflash
+        from tsstore import TimeSeriesStore
+        store = TimeSeriesStore(args.store)
+
+    httpserver = ThreadingHTTPServer
 
     httpd = httpserver(('0.0.0.0', 8081), httphandler)
 
@@ -161,3 +254,5 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         pass
     httpd.server_close()
+    if store is not None:
+        store.close()
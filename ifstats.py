@@ -0,0 +1,607 @@
+#
+# Copyright (C) 2014 Cisco Systems Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Interface statistics from the XML output of show interface.
+#
+# The eth_inrate1/eth_outrate1 values the switch reports are averaged
+# over the load interval, 30 seconds or more. Sampler instead reads the
+# raw byte and packet counters every few seconds and computes exact rates
+# from the difference between two reads:
+#
+#   sampler = Sampler(lambda: cli('show interface | xml | exclude "]]>]]>"'))
+#   for now, rates in sampler.run(interval=5):
+#       for name, rate in rates:
+#           print name, rate.rx_bps, rate.tx_pct
+#
+# Counters that went backwards wrapped or were cleared; wraps are counted
+# through, clears are skipped. Each interface keeps its recent rates in a
+# ring buffer of bounded size, sampler.rings[name]. Given a
+# tsstore.TimeSeriesStore, the sampler also appends every read to it, one
+# series per interface with the STORED_FIELDS, for history past the ring.
+#
+# Selection picks interfaces by name, range or list, and/or by a regular
+# expression, and builds show interface commands for those alone, so the
+# switch only renders and sends what was asked for:
+#
+#   Selection('Eth1/1-48,Po10').commands()
+#   ['show interface Ethernet1/1-48,port-channel10 | xml | exclude "]]>]]>"']
+#
+# InterfaceTable holds the rates of many interfaces column by column, as
+# numpy arrays, or array.array columns where numpy is not installed (as on
+# most switches). Mbps and utilisation are computed for whole columns at
+# once, and a table can be filtered, ranked and totalled per module or
+# port-channel without sorting or printing every interface:
+#
+#   table = readrates(cli('show interface | xml'))
+#   hottest = table.query(sort='pct', top=10, above=[('rx_mbps', 100)])
+#   modules = table.totals(module)
+#
+
+from __future__ import division
+
+import heapq
+import re
+import time
+import xml.etree.cElementTree as ET
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from cStringIO import StringIO
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+IF_MANAGER = '{http://www.cisco.com/nxos:1.0:if_manager}'
+
+XML_PIPE = ' | xml | exclude "]]>]]>"'
+
+# Lists interface names only, to resolve a pattern
+SHOW_BRIEF = 'show interface brief'
+
+# Longest interface list put in one command; longer selections are split
+# over several commands, sent as one batch
+MAX_LIST = 400
+
+# Abbreviations, longest first so eth is not taken for e.g. ethernet
+LONG_NAMES = (('ethernet', 'Ethernet'), ('eth', 'Ethernet'),
+              ('port-channel', 'port-channel'), ('po', 'port-channel'),
+              ('loopback', 'loopback'), ('lo', 'loopback'),
+              ('vlan', 'Vlan'), ('tunnel', 'Tunnel'), ('mgmt', 'mgmt'))
+
+# Load interval rates the switch computes, read for a snapshot
+RATE_FIELDS = ('interface', 'eth_bw', 'eth_load_interval1_rx',
+               'eth_inrate1_bits', 'eth_inrate1_pkts',
+               'eth_load_interval1_tx', 'eth_outrate1_bits',
+               'eth_outrate1_pkts')
+
+# Columns of an InterfaceTable that can be sorted and filtered on. pct is
+# the busier direction's utilisation
+COLUMNS = ('rx_mbps', 'rx_pct', 'rx_pps', 'tx_mbps', 'tx_pct', 'tx_pps',
+           'pct', 'rx_bps', 'tx_bps', 'bw')
+
+# Raw counters read on every poll, in order
+COUNTERS = ('eth_inbytes', 'eth_outbytes', 'eth_inpkts', 'eth_outpkts')
+
+# Values of each read a Sampler keeps in its store
+STORED_FIELDS = ('eth_bw',) + COUNTERS
+
+# Shortest time between polls; each poll is a show interface, which the
+# switch CPU has to build
+MIN_INTERVAL = 1.0
+
+# Rates of one interface over one poll interval. bps and pps are per
+# second, pct is utilisation of the interface bandwidth
+Rate = namedtuple('Rate', ('time', 'seconds', 'rx_bps', 'tx_bps', 'rx_pps',
+                           'tx_pps', 'rx_pct', 'tx_pct'))
+
+
+def longname(name):
+    '''Ethernet1/1 for eth1/1 or Eth1/1, port-channel10 for Po10'''
+    lower = name.strip().lower()
+    for prefix, full in LONG_NAMES:
+        if lower.startswith(prefix):
+            return full + lower[len(prefix):]
+    return name.strip()
+
+
+def expand(spec):
+    '''Returns the full names in a comma separated list of interfaces and
+       ranges, e.g. Eth1/1-48,Po10 or eth1/1/1-4, in the order given.
+       Raises ValueError for a range that runs backwards'''
+    names = []
+    seen = set()
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        match = re.match(r'(.*?)(\d+)-(\d+)$', item)
+        if match:
+            prefix, first, last = match.groups()
+            if int(last) < int(first):
+                raise ValueError('Bad interface range ' + item)
+            items = [prefix + str(number)
+                     for number in range(int(first), int(last) + 1)]
+        else:
+            items = [item]
+        for name in items:
+            name = longname(name)
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+    return names
+
+
+def compress(names):
+    '''Returns names as ranges of consecutive ports, the inverse of
+       expand: [Ethernet1/1, Ethernet1/2, Ethernet1/3] -> [Ethernet1/1-3]'''
+    runs = []
+    for name in names:
+        match = re.match(r'(.*?)(\d+)$', name)
+        if not match:
+            runs.append([name, None, None])
+            continue
+        prefix, number = match.group(1), int(match.group(2))
+        if runs and runs[-1][0] == prefix and runs[-1][2] == number - 1:
+            runs[-1][2] = number
+        else:
+            runs.append([prefix, number, number])
+    items = []
+    for prefix, first, last in runs:
+        if first is None:
+            items.append(prefix)
+        elif first == last:
+            items.append(prefix + str(first))
+        else:
+            items.append('%s%d-%d' % (prefix, first, last))
+    return items
+
+
+def lists(items, limit=MAX_LIST):
+    '''Joins items into comma separated lists of at most limit characters'''
+    current = ''
+    for item in items:
+        if current and len(current) + 1 + len(item) > limit:
+            yield current
+            current = ''
+        current = current + ',' + item if current else item
+    if current:
+        yield current
+
+
+class Selection:
+    '''Interfaces chosen by spec, a list of names and ranges such as
+       Eth1/1-48,Po10, and/or by pattern, a regular expression searched
+       for in the full name. Without either every interface is chosen'''
+
+    def __init__(self, spec=None, pattern=None):
+        self.names = expand(spec) if spec else None
+        self.regex = re.compile(pattern) if pattern else None
+
+    def everything(self):
+        return self.names is None and self.regex is None
+
+    def commands(self, cli=None):
+        '''Returns the show interface commands, with XML output, that
+           fetch the chosen interfaces; none when nothing matches. A
+           pattern without a spec runs show interface brief with cli() to
+           find the names'''
+        if self.everything():
+            return ['show interface' + XML_PIPE]
+        names = self.names
+        if self.regex is not None:
+            if names is None:
+                names = [row['interface'] for row in
+                         iterrows(cli(SHOW_BRIEF + XML_PIPE), ('interface',))
+                         if 'interface' in row]
+            names = [name for name in names if self.regex.search(name)]
+        return ['show interface ' + items + XML_PIPE
+                for items in lists(compress(names))]
+
+
+def iterrows(raw, fields):
+    '''Yields {field: text} for each ROW_interface of show interface XML
+       output, with only the fields asked for. Every element is dropped
+       as soon as it has been read, so memory stays flat however many
+       interfaces the output has'''
+    wanted = dict((IF_MANAGER + field, field) for field in fields)
+    row_tag = IF_MANAGER + 'ROW_interface'
+    row = {}
+    parents = []
+    events = ET.iterparse(StringIO(raw), events=('start', 'end'))
+    for event, element in events:
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        tag = element.tag
+        if tag in wanted:
+            row[wanted[tag]] = element.text
+        elif tag == row_tag:
+            yield row
+            row = {}
+        if parents:
+            # The element just closed is its parent's last child
+            del parents[-1][-1]
+
+
+def readcounters(raws):
+    '''Returns {interface: (bandwidth in kbit/s, counters)} with the
+       COUNTERS of every interface that has them, in device order. raws
+       is one show interface XML output or a list of them'''
+    if isinstance(raws, basestring):
+        raws = [raws]
+    fields = ('interface', 'eth_bw') + COUNTERS
+    found = OrderedDict()
+    for raw in raws:
+        for row in iterrows(raw, fields):
+            try:
+                bw = int(row['eth_bw'])
+                counters = tuple(int(row[counter]) for counter in COUNTERS)
+                found[row['interface']] = (bw, counters)
+            except (KeyError, TypeError, ValueError):
+                continue
+    return found
+
+
+def counter_delta(previous, current, limit=None):
+    '''Returns how much a counter grew between two reads. A counter that
+       went backwards either wrapped at 32 or 64 bits or was cleared.
+       It is taken to have wrapped when the growth through the wrap is
+       no more than limit, the most the interval allows, or without a
+       limit when the previous read was in the top quarter of the range.
+       Returns None for a cleared counter'''
+    if current >= previous:
+        return current - previous
+    for width in (32, 64):
+        top = 2 ** width
+        if previous >= top:
+            continue
+        delta = current + top - previous
+        if limit is not None:
+            if delta <= limit:
+                return delta
+        elif previous >= top - top // 4:
+            return delta
+    return None
+
+
+class Sampler:
+    '''Polls interface counters with fetch(), which returns show interface
+       XML output or a list of them, and computes each interface's rates
+       from the change since the previous poll. Reads are appended to
+       store, when given'''
+
+    def __init__(self, fetch, history=360, store=None):
+        self.fetch = fetch
+        self.history = history
+        self.store = store
+        # interface -> (time, bandwidth, counters) of the last poll
+        self.last = {}
+        # interface -> deque of its last history Rates
+        self.rings = {}
+        self.polls = 0
+        self.wraps = 0
+        self.resets = 0
+
+    def poll(self):
+        '''Reads the counters once. Returns (time, [(interface, Rate)]);
+           the list is empty on the first poll'''
+        started = time.time()
+        raws = self.fetch()
+        # The counters were read some time during the command
+        now = (started + time.time()) / 2
+        self.polls += 1
+        found = readcounters(raws)
+        if self.store is not None:
+            self.store.extend(now, [(name, (bw,) + counters) for name,
+                                    (bw, counters) in found.iteritems()])
+        rates = []
+        for name, (bw, counters) in found.iteritems():
+            rate = self.update(name, now, bw, counters)
+            if rate is not None:
+                rates.append((name, rate))
+        return now, rates
+
+    def update(self, name, now, bw, counters):
+        '''Records one read of an interface. Returns its Rate since the
+           previous read, or None'''
+        last = self.last.get(name)
+        self.last[name] = (now, bw, counters)
+        if last is None or now <= last[0]:
+            return None
+        seconds = now - last[0]
+        # Most bytes and packets the interface can carry in the interval,
+        # with some slack for timing; packets are at least 64 bytes
+        limit = bw * 1000 / 8 * seconds * 1.5 if bw else None
+        limits = (limit, limit, limit and limit / 64, limit and limit / 64)
+        deltas = []
+        for previous, current, most in zip(last[2], counters, limits):
+            delta = counter_delta(previous, current, most)
+            if delta is None:
+                # Cleared, e.g. clear counters: start again from this read
+                self.resets += 1
+                return None
+            if current < previous:
+                self.wraps += 1
+            deltas.append(delta)
+        (inbytes, outbytes, inpkts, outpkts) = deltas
+        rx_bps = inbytes * 8 / seconds
+        tx_bps = outbytes * 8 / seconds
+        speed = bw * 1000
+        rate = Rate(now, seconds, rx_bps, tx_bps, inpkts / seconds,
+                    outpkts / seconds,
+                    rx_bps * 100 / speed if speed else 0.0,
+                    tx_bps * 100 / speed if speed else 0.0)
+        ring = self.rings.get(name)
+        if ring is None:
+            ring = self.rings[name] = deque(maxlen=self.history)
+        ring.append(rate)
+        return rate
+
+    def run(self, interval, count=None):
+        '''Polls every interval seconds, yielding (time, rates) after each
+           poll but the first. Polls never overlap: one that takes longer
+           than interval is followed straight away by the next'''
+        interval = max(interval, MIN_INTERVAL)
+        polls = 0
+        due = time.time()
+        while True:
+            now, rates = self.poll()
+            if self.polls > 1:
+                polls += 1
+                yield now, rates
+                if count is not None and polls >= count:
+                    return
+            due += interval
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                due = time.time()
+
+
+def module(name):
+    '''Ethernet1 for Ethernet1/5 or Ethernet1/1/2, None for interfaces
+       that are not on a module'''
+    match = re.match(r'(Ethernet\d+)/', name)
+    return match.group(1) if match else None
+
+
+def portchannels(raw):
+    '''Returns {member interface: port-channel} from show port-channel
+       summary XML output'''
+    members = {}
+    channel = None
+    for event, element in ET.iterparse(StringIO(raw)):
+        tag = element.tag.rsplit('}', 1)[-1]
+        # The command's own <port-channel> element holds no text
+        text = element.text and element.text.strip()
+        if not text:
+            pass
+        elif tag == 'port-channel':
+            channel = longname(text)
+        elif tag == 'port' and channel is not None:
+            members[longname(text)] = channel
+        element.clear()
+    return members
+
+
+def readrates(raws):
+    '''Returns an InterfaceTable of the load interval rates in show
+       interface XML output, or a list of outputs. Each row is labelled
+       with its rx/tx intervals in seconds'''
+    if isinstance(raws, basestring):
+        raws = [raws]
+    names, labels = [], []
+    bw, rx_bps, tx_bps, rx_pps, tx_pps = [array('d') for _ in range(5)]
+    for raw in raws:
+        for row in iterrows(raw, RATE_FIELDS):
+            try:
+                values = (float(row['eth_bw']),
+                          float(row['eth_inrate1_bits']),
+                          float(row['eth_outrate1_bits']),
+                          float(row['eth_inrate1_pkts']),
+                          float(row['eth_outrate1_pkts']))
+                label = (row['eth_load_interval1_rx'] + '/' +
+                         row['eth_load_interval1_tx'])
+                name = row['interface']
+            except (KeyError, TypeError, ValueError):
+                continue
+            for column, value in zip((bw, rx_bps, tx_bps, rx_pps, tx_pps),
+                                     values):
+                column.append(value)
+            names.append(name)
+            labels.append(label)
+    return InterfaceTable(names, bw, rx_bps, tx_bps, rx_pps, tx_pps, labels)
+
+
+def column(values):
+    '''Returns values as a column of floats'''
+    if numpy is not None:
+        if isinstance(values, array) and values.typecode == 'd':
+            return numpy.frombuffer(values, dtype=float)
+        return numpy.array(values, dtype=float)
+    if isinstance(values, array) and values.typecode == 'd':
+        return values
+    return array('d', values)
+
+
+def utilisation(bps, bw):
+    '''Percent of bandwidth bw, in kbit/s, that bps bit/s uses; 0 where
+       the bandwidth is unknown'''
+    if numpy is not None:
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            pct = (bps / 1000) * 100 / bw
+        pct[bw == 0] = 0
+        return pct
+    return array('d', [(rate / 1000) * 100 / speed if speed else 0.0
+                       for rate, speed in zip(bps, bw)])
+
+
+class InterfaceTable:
+    '''Rates of a set of interfaces, one column per quantity. names and
+       labels, a short text shown with each row, are lists; bw (kbit/s),
+       rx_bps, tx_bps, rx_pps and tx_pps are columns of floats, from
+       which the other COLUMNS are derived'''
+
+    def __init__(self, names, bw, rx_bps, tx_bps, rx_pps, tx_pps,
+                 labels=None):
+        self.names = names
+        self.labels = labels if labels is not None else [''] * len(names)
+        self.columns = {'bw': column(bw), 'rx_bps': column(rx_bps),
+                        'tx_bps': column(tx_bps), 'rx_pps': column(rx_pps),
+                        'tx_pps': column(tx_pps)}
+        self.derive()
+
+    def derive(self):
+        columns = self.columns
+        bw = columns['bw']
+        for side in ('rx', 'tx'):
+            bps = columns[side + '_bps']
+            if numpy is not None:
+                columns[side + '_mbps'] = bps / 1000000
+            else:
+                columns[side + '_mbps'] = array('d', [rate / 1000000
+                                                      for rate in bps])
+            columns[side + '_pct'] = utilisation(bps, bw)
+        if numpy is not None:
+            columns['pct'] = numpy.maximum(columns['rx_pct'],
+                                           columns['tx_pct'])
+        else:
+            columns['pct'] = array('d', map(max, columns['rx_pct'],
+                                            columns['tx_pct']))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def from_rates(cls, rates, bandwidths, labels=None):
+        '''Builds a table from Sampler (interface, Rate) pairs; bandwidths
+           is {interface: kbit/s}'''
+        names = [name for name, rate in rates]
+        return cls(names, [bandwidths.get(name, 0) for name in names],
+                   [rate.rx_bps for name, rate in rates],
+                   [rate.tx_bps for name, rate in rates],
+                   [rate.rx_pps for name, rate in rates],
+                   [rate.tx_pps for name, rate in rates], labels)
+
+    def take(self, indices):
+        '''Returns a table of the rows at indices, in that order'''
+        indices = list(indices)
+        if numpy is not None:
+            picked = numpy.array(indices, dtype=int)
+            values = [self.columns[name][picked] for name in
+                      ('bw', 'rx_bps', 'tx_bps', 'rx_pps', 'tx_pps')]
+        else:
+            values = [array('d', [self.columns[name][i] for i in indices])
+                      for name in ('bw', 'rx_bps', 'tx_bps', 'rx_pps',
+                                   'tx_pps')]
+        return InterfaceTable([self.names[i] for i in indices],
+                              *values,
+                              labels=[self.labels[i] for i in indices])
+
+    def where(self, above):
+        '''Returns the indices of rows where every (column, minimum) in
+           above is at least its minimum'''
+        if numpy is not None:
+            keep = numpy.ones(len(self), dtype=bool)
+            for name, minimum in above:
+                keep &= self.columns[name] >= minimum
+            return numpy.flatnonzero(keep)
+        keep = range(len(self))
+        for name, minimum in above:
+            values = self.columns[name]
+            keep = [i for i in keep if values[i] >= minimum]
+        return keep
+
+    def query(self, sort=None, top=None, above=(), ascending=False):
+        '''Returns a table of the rows matching above, sorted by the sort
+           column, highest first unless ascending, and cut to the top
+           rows. Only the top rows are ordered; the rest are never
+           sorted. Without sort the device order is kept'''
+        indices = self.where(above) if above else None
+        if sort is None:
+            if indices is None:
+                indices = range(len(self))
+            return self.take(list(indices)[:top] if top else indices)
+        values = self.columns[sort]
+        if numpy is not None:
+            if indices is None:
+                indices = numpy.arange(len(self))
+            keys = values[indices] if ascending else -values[indices]
+            if top and top < len(indices):
+                # Finds the top rows without sorting the rest, then
+                # orders just those
+                chosen = numpy.argpartition(keys, top - 1)[:top]
+                chosen = chosen[numpy.argsort(keys[chosen], kind='mergesort')]
+            else:
+                chosen = numpy.argsort(keys, kind='mergesort')
+            return self.take(indices[chosen])
+        if indices is None:
+            indices = range(len(self))
+        if top:
+            pick = heapq.nsmallest if ascending else heapq.nlargest
+            return self.take(pick(top, indices, key=values.__getitem__))
+        return self.take(sorted(indices, key=values.__getitem__,
+                                reverse=not ascending))
+
+    def totals(self, group):
+        '''Returns a table with one row per group, group(name) being the
+           group of each interface or None to leave it out, holding the
+           group's summed bandwidth and rates. Each row's label is how many
+           interfaces it adds up'''
+        codes = OrderedDict()
+        members = []
+        for name in self.names:
+            key = group(name)
+            members.append(codes.setdefault(key, len(codes))
+                           if key is not None else -1)
+        count = len(codes)
+        if numpy is not None:
+            members = numpy.array(members, dtype=int)
+            inside = members >= 0
+            members = members[inside]
+            sums = [numpy.bincount(members, self.columns[name][inside],
+                                   minlength=count)
+                    for name in ('bw', 'rx_bps', 'tx_bps', 'rx_pps',
+                                 'tx_pps')]
+            sizes = numpy.bincount(members, minlength=count)
+        else:
+            sums = []
+            for name in ('bw', 'rx_bps', 'tx_bps', 'rx_pps', 'tx_pps'):
+                total = array('d', [0.0]) * count
+                for code, value in zip(members, self.columns[name]):
+                    if code >= 0:
+                        total[code] += value
+                sums.append(total)
+            sizes = [0] * count
+            for code in members:
+                if code >= 0:
+                    sizes[code] += 1
+        return InterfaceTable(list(codes), *sums,
+                              labels=[str(size) for size in sizes])
+
+    def rows(self):
+        '''Yields (name, label, rx_mbps, rx_pct, rx_pps, tx_mbps, tx_pct,
+           tx_pps) per interface'''
+        columns = [self.columns[name] for name in COLUMNS[:6]]
+        if numpy is not None:
+            columns = [values.tolist() for values in columns]
+        for values in zip(self.names, self.labels, *columns):
+            yield values
@@ -23,59 +23,211 @@
 #                                                       - or -
 # python bootflash:interface_rate.py
 #
+# Add --timing to print how long startup, collection and parsing took.
+#
+# The rates above are the switch's own load interval averages, 30 seconds
+# or more, which hide short bursts. For exact rates over a few seconds,
+# sampled from the interface counters:
+#
+# python bootflash:interface_rate.py --interval 5 [--count 12]
+#
+# Either way, --interfaces Eth1/1-48,Po10 and/or --match REGEX limit the
+# output to those interfaces, and only they are fetched from the switch.
+# --sort COLUMN orders the interfaces, busiest first, --top N keeps the
+# first N, --above COLUMN=VALUE drops quieter ones and --totals adds
+# totals per module and port-channel. For the ten busiest ports:
+#
+# python bootflash:interface_rate.py --top 10
+#
+# With --interval, --store DIR also keeps every counter read in a
+# tsstore.TimeSeriesStore there, for history past the run; see tsstore.py
+# to query it.
+#
 
 from __future__ import division
-try:
-    from cli import cli
-except ImportError:
-    from cisco import cli
+# clibackend handles cli() type inconsistencies without running a command
+# up front to find out which kind this box has
+from clibackend import cli, batch, CommandError
+from nxplatform import timing
+import re
 import sys
-import xml.etree.cElementTree as ET
+import time
+from argparse import ArgumentParser
+from ifstats import COLUMNS, XML_PIPE, InterfaceTable, Sampler, Selection, \
+    module, portchannels, readrates
 
+timing.mark('imports')
 
-# Handle cli() type inconsistencies
-def make_cli_wrapper(f):
-    if type(f("show clock")) is tuple:
-        def cli_wrapper(*args, **kwargs):
-            return f(*args, **kwargs)[1]
-        return cli_wrapper
-    return f
+parser = ArgumentParser('interface_rate')
+parser.add_argument('--interval', type=float,
+                    help='Sample the counters every this many seconds '
+                         '(at least 1) and print exact rates')
+parser.add_argument('--count', type=int,
+                    help='With --interval, stop after this many samples')
+parser.add_argument('--history', type=int, default=360,
+                    help='Samples kept per interface (default 360)')
+parser.add_argument('--store',
+                    help='With --interval, append every counter read to '
+                         'the time-series store in this directory')
+parser.add_argument('--retention', type=float,
+                    help='With --store, delete samples older than this '
+                         'many hours')
+parser.add_argument('--interfaces',
+                    help='Only these interfaces, e.g. Eth1/1-48,Po10')
+parser.add_argument('--match',
+                    help='Only interfaces whose full name matches this '
+                         'regular expression, e.g. "^Ethernet1/"')
+parser.add_argument('--sort', choices=COLUMNS,
+                    help='Order interfaces by this column, highest first '
+                         '(pct is the busier direction)')
+parser.add_argument('--top', type=int,
+                    help='Only the first this many interfaces, by --sort or '
+                         'else by pct')
+parser.add_argument('--above', action='append', default=[],
+                    metavar='COLUMN=VALUE',
+                    help='Only interfaces where COLUMN is at least VALUE, '
+                         'e.g. rx_pct=50; may be repeated')
+parser.add_argument('--totals', action='store_true',
+                    help='Also print totals per module and port-channel')
+parser.add_argument('--timing', action='store_true',
+                    help='Print how long startup and each stage took')
+args = parser.parse_args()
 
-cli = make_cli_wrapper(cli)
+above = []
+for condition in args.above:
+    name, _, value = condition.partition('=')
+    try:
+        if name not in COLUMNS:
+            raise ValueError
+        above.append((name, float(value)))
+    except ValueError:
+        parser.error('--above wants COLUMN=VALUE with COLUMN one of ' +
+                     ', '.join(COLUMNS))
+sort = args.sort or ('pct' if args.top else None)
+if args.store and not args.interval:
+    parser.error('--store needs --interval')
 
-# Get interface information in XML format
-print
-print 'Collecting and processing interface statistics ...'
-print
-sys.stdout.flush()
-raw = cli('show interface | xml | exclude "]]>]]>"')
+table = "{0:16}{1:9}{2:9}{3:9}{4:9}{5:9}{6:9}{7:9}"
+rule = '---------------------------------------------------------------------------'
 
-# Load and parse XML
-tree = ET.ElementTree(ET.fromstring(raw))
-data = tree.getroot()
 
-# Find and display interface rate information
-if_manager = '{http://www.cisco.com/nxos:1.0:if_manager}'
-table = "{0:16}{1:9}{2:9}{3:9}{4:9}{5:9}{6:9}{7:9}"
-print '---------------------------------------------------------------------------'
-print table.format("Port", "Intvl", "Rx Mbps", "Rx %", "Rx pps", "Tx Mbps", "Tx %", "Tx pps")
-print '---------------------------------------------------------------------------'
-for i in data.iter(if_manager + 'ROW_interface'):
+def fetch(commands):
+    '''Runs the show interface commands, several of them in one batch,
+       and returns their outputs'''
+    if len(commands) == 1:
+        return [cli(commands[0])]
+    outputs = []
+    for output, status, msg in batch(commands, 'cli'):
+        if status:
+            raise CommandError(msg)
+        outputs.append(output)
+    return outputs
+
+
+def report(rates, port, label):
+    '''Prints an InterfaceTable, in one write'''
+    lines = [rule, table.format(port, label, "Rx Mbps", "Rx %", "Rx pps", "Tx Mbps", "Tx %", "Tx pps"), rule]
+    for interface, intvl, rx_mbps, rx_pct, rx_pps, tx_mbps, tx_pct, tx_pps in rates.rows():
+        lines.append(table.format(interface, intvl,
+                                  str(round(rx_mbps, 1)),
+                                  str(round(rx_pct, 1)) + '%',
+                                  str(int(round(rx_pps))),
+                                  str(round(tx_mbps, 1)),
+                                  str(round(tx_pct, 1)) + '%',
+                                  str(int(round(tx_pps)))))
+    print '\n'.join(lines)
+    sys.stdout.flush()
+
+
+def show(rates, label):
+    '''Prints the interfaces asked for and, with --totals, their totals'''
+    report(rates.query(sort, args.top, above), "Port", label)
+    if args.totals:
+        members = portchannels(cli('show port-channel summary' + XML_PIPE))
+        for group, title in ((module, "Module"), (members.get, "Port-channel")):
+            print
+            report(rates.totals(group).query(sort), title, "Ports")
+
+
+def snapshot(commands):
+    # Get interface information in XML format
+    print
+    print 'Collecting and processing interface statistics ...'
+    print
+    sys.stdout.flush()
+    raws = fetch(commands)
+    timing.mark('show interface')
+
+    # Only the fields printed are read, into columns, and the rates of
+    # all interfaces are computed at once
+    rates = readrates(raws)
+    timing.mark('parse')
+    show(rates, "Intvl")
+    timing.mark('print')
+
+
+def sample(commands, interval, count, history, store):
+    sampler = Sampler(lambda: fetch(commands), history, store)
+    print
+    print 'Sampling interface counters every %g seconds, Ctrl-C to stop ...' % (
+        max(interval, 1))
+    sys.stdout.flush()
     try:
-        interface = i.find(if_manager + 'interface').text
-        bw = int(i.find(if_manager + 'eth_bw').text)
-        rx_intvl = i.find(if_manager + 'eth_load_interval1_rx').text
-        rx_bps = int(i.find(if_manager + 'eth_inrate1_bits').text)
-        rx_mbps = round((rx_bps / 1000000), 1)
-        rx_pcnt = round((rx_bps / 1000) * 100 / bw, 1)
-        rx_pps = i.find(if_manager + 'eth_inrate1_pkts').text
-        tx_intvl = i.find(if_manager + 'eth_load_interval1_tx').text
-        tx_bps = int(i.find(if_manager + 'eth_outrate1_bits').text)
-        tx_mbps = round((tx_bps / 1000000), 1)
-        tx_pcnt = round((tx_bps / 1000) * 100 / bw, 1)
-        tx_pps = i.find(if_manager + 'eth_outrate1_pkts').text
-        print table.format(interface, rx_intvl + '/' + tx_intvl, str(rx_mbps), str(rx_pcnt) + '%', rx_pps, str(tx_mbps), str(tx_pcnt) + '%', tx_pps)
-        sys.stdout.flush()
-    except AttributeError:
+        for now, rates in sampler.run(interval, count):
+            print
+            print time.strftime('%H:%M:%S', time.localtime(now))
+            show(InterfaceTable.from_rates(
+                rates, bandwidths(sampler),
+                ['%.1f' % rate.seconds for interface, rate in rates]),
+                "Secs")
+    except KeyboardInterrupt:
         pass
+    timing.mark('sampling')
 
+    # Busiest interval of each interface over the samples kept
+    print
+    print 'Peak rates over the last %d samples' % history
+    peaks = []
+    for interface in sorted(sampler.rings):
+        ring = sampler.rings[interface]
+        peaks.append((interface,
+                      ring[0]._make(max(values) for values in zip(*ring))))
+    peaks = InterfaceTable.from_rates(
+        peaks, bandwidths(sampler),
+        [str(len(sampler.rings[interface])) for interface, peak in peaks])
+    report(peaks.query(sort, args.top, above), "Port", "Samples")
+    if sampler.wraps or sampler.resets:
+        print
+        print '%d counter wraps, %d counter resets' % (sampler.wraps,
+                                                      sampler.resets)
+
+
+def bandwidths(sampler):
+    return dict((interface, last[1])
+                for interface, last in sampler.last.iteritems())
+
+
+try:
+    selection = Selection(args.interfaces, args.match)
+except (ValueError, re.error), e:
+    parser.error(str(e))
+commands = selection.commands(cli)
+if not commands:
+    sys.stderr.write('No interfaces match\n')
+    sys.exit(1)
+if args.interval:
+    store = None
+    if args.store:
+        # Only loaded when asked for, so tsstore need not be on bootflash
+        from tsstore import TimeSeriesStore
+        store = TimeSeriesStore(args.store, retention=(
+            args.retention * 3600 if args.retention else None))
+    try:
+        sample(commands, args.interval, args.count, args.history, store)
+    finally:
+        if store is not None:
+            store.close()
+else:
+    snapshot(commands)
+if args.timing:
+    timing.report()
@@ -1,9 +1,16 @@
 # Copyright (C) 2013 Cisco Systems Inc.
 # All rights reserved
 import urllib2
+import urlparse
+import Queue
 
-import contextlib
+import atexit
 import base64
+import os
+import re
+import select
+import threading
+import time
 
 import socket
 
@@ -15,10 +22,32 @@ from xml import etree
 import xml.etree.ElementTree as ET
 import json
 import xmltodict
-from cisco import *
-from errors import *
-
-set_global_vrf("management")
+# The switch SDK provides cisco and errors. Off the switch neither exists:
+# the same exceptions come from error.py here, and there is no VRF to pick
+try:
+    import cisco
+except ImportError:
+    cisco = None
+try:
+    from errors import *
+except ImportError:
+    from error import *
+
+vrf_lock = threading.Lock()
+vrf_selected = False
+
+
+def use_management_vrf():
+    '''On the switch, sends NX-API connections out of the management VRF.
+       Done on the first request rather than on import, so importing this
+       module has no side effects'''
+    global vrf_selected
+    if vrf_selected or cisco is None:
+        return
+    with vrf_lock:
+        if not vrf_selected:
+            cisco.set_global_vrf("management")
+            vrf_selected = True
 
 class HTTPSConnection(HTTPConnection):
 
@@ -108,6 +137,324 @@ class RequestMsg:
         return req_msg
 
 
+class ConnectionPool:
+    '''Pool of HTTP/1.1 keep-alive connections to a single host'''
+
+    def __init__(
+        self,
+        scheme='http',
+        host='localhost',
+        port=None,
+        maxsize=4,
+        idle_timeout=60.0,
+        ):
+
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def new_conn(self, timeout):
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.host, self.port,
+                    timeout=timeout)
+        return httplib.HTTPConnection(self.host, self.port,
+                timeout=timeout)
+
+    def is_healthy(self, conn, last_used):
+        '''An idle connection is reusable if it has not sat longer than
+           idle_timeout and the peer has not closed it. A socket that
+           polls readable while idle has either hit EOF or holds stray
+           data, so it is discarded either way'''
+        if conn.sock is None:
+            return False
+        if time.time() - last_used > self.idle_timeout:
+            return False
+        try:
+            readable = select.select([conn.sock], [], [], 0)[0]
+        except (select.error, socket.error, ValueError):
+            return False
+        return not readable
+
+    def get(self, timeout):
+        '''Return a healthy idle connection, or a new one'''
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                (conn, last_used) = self.idle.pop()
+            if self.is_healthy(conn, last_used):
+                conn.sock.settimeout(timeout)
+                conn.timeout = timeout
+                return conn
+            conn.close()
+        return self.new_conn(timeout)
+
+    def put(self, conn):
+        '''Return a connection to the pool once its response is read'''
+        with self.lock:
+            if len(self.idle) < self.maxsize:
+                self.idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for (conn, last_used) in idle:
+            conn.close()
+
+
+class PoolManager:
+    '''Keeps one ConnectionPool per (scheme, host, port)'''
+
+    def __init__(self, maxsize=4, idle_timeout=60.0):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def get_pool(self, url):
+        parsed = urlparse.urlsplit(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(parsed.scheme, parsed.hostname,
+                        parsed.port, self.maxsize, self.idle_timeout)
+                self.pools[key] = pool
+            return pool
+
+    def urlopen(
+        self,
+        url,
+        body,
+        headers,
+        timeout,
+        stream=False,
+        ):
+        '''POST body to url over a pooled connection. Returns
+           (resp_headers, resp_str), or (resp_headers, PooledResponse)
+           when stream is set so the caller can parse the body as it
+           arrives. A reused connection the switch has already dropped is
+           retried once on a fresh one'''
+        pool = self.get_pool(url)
+        path = urlparse.urlsplit(url).path or '/'
+        for attempt in (0, 1):
+            conn = pool.get(timeout)
+            reused = conn.sock is not None
+            try:
+                conn.request('POST', path, body, headers)
+                resp = conn.getresponse()
+                if not stream or resp.status >= 400:
+                    resp_str = resp.read()
+            except socket.timeout:
+                conn.close()
+                raise
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            if stream and resp.status < 400:
+                return (resp.msg, PooledResponse(pool, conn, resp))
+            if resp.will_close:
+                conn.close()
+            else:
+                pool.put(conn)
+            if resp.status >= 400:
+                raise urllib2.HTTPError(url, resp.status, resp.reason,
+                        resp.msg, None)
+            return (resp.msg, resp_str)
+
+    def close(self):
+        with self.lock:
+            pools = self.pools.values()
+            self.pools = {}
+        for pool in pools:
+            pool.close()
+
+
+default_pool_manager = PoolManager()
+
+
+# Basic authorization strings by (username, password)
+auth_strings = {}
+
+
+def basic_auth(username, password):
+    '''Return the base64 credentials for an Authorization header,
+       encoding them once per username and password'''
+    key = (username, password)
+    encoded = auth_strings.get(key)
+    if encoded is None:
+        encoded = auth_strings[key] = base64.b64encode('%s:%s' % key)
+    return encoded
+
+
+def parse_set_cookie(header, lifetime):
+    '''Return (cookie, expiry time) for the nxapi_auth cookie of a
+       Set-Cookie header, or for its first cookie when there is none.
+       Without a Max-Age the cookie is assumed to last lifetime seconds'''
+    match = re.search(r'(nxapi_auth=[^;,\s]*)', header) or \
+        re.match(r'\s*([^=;,\s]+=[^;,\s]*)', header)
+    if match is None:
+        return (None, None)
+    max_age = re.search(r'max-age=(\d+)', header, re.I)
+    if max_age is not None:
+        lifetime = int(max_age.group(1))
+    return (match.group(1), time.time() + lifetime)
+
+
+class SessionStore:
+    '''nxapi_auth cookies by switch and username, shared by every
+       session and NXAPI object, so a switch is logged into once rather
+       than on every new session. NX-OS checks the password, possibly
+       through TACACS, only when no valid cookie is sent.
+
+       A cookie is given up refresh seconds, or half its lifetime if
+       that is shorter, before it expires, and the next request logs in
+       again with the password. With a path, the
+       cookies are read from that file and written back by save(), which
+       runs at exit, so later runs reuse them too'''
+
+    def __init__(self, path=None, lifetime=600.0, refresh=60.0):
+        self.path = path
+        self.lifetime = lifetime
+        self.refresh = refresh
+        # key -> (cookie, time it stops being used)
+        self.cookies = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.logins = 0
+        self.reused = 0
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    def key(self, target_url, username):
+        return '%s@%s' % (username, target_url)
+
+    def get(self, target_url, username):
+        '''Return the cookie to send, or None to log in'''
+        key = self.key(target_url, username)
+        with self.lock:
+            entry = self.cookies.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self.cookies[key]
+                self.dirty = True
+                return None
+            self.reused += 1
+            return entry[0]
+
+    def update(self, target_url, username, set_cookie):
+        '''Keep the cookie of a response's Set-Cookie header'''
+        (cookie, expires) = parse_set_cookie(set_cookie, self.lifetime)
+        if cookie is None:
+            return
+        now = time.time()
+        until = expires - min(self.refresh, (expires - now) / 2)
+        key = self.key(target_url, username)
+        with self.lock:
+            entry = self.cookies.get(key)
+            # A switch may repeat the cookie it was sent; that does not
+            # extend its life
+            if entry is not None and entry[0] == cookie:
+                return
+            self.cookies[key] = (cookie, until)
+            self.logins += 1
+            self.dirty = True
+
+    def invalidate(self, target_url, username):
+        with self.lock:
+            if self.cookies.pop(self.key(target_url, username), None):
+                self.dirty = True
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        now = time.time()
+        with self.lock:
+            for key, (cookie, until) in saved.items():
+                if until > now:
+                    self.cookies[str(key)] = (str(cookie), until)
+
+    def save(self):
+        '''Write the live cookies to path, readable by the owner only'''
+        if not self.path:
+            return
+        now = time.time()
+        with self.lock:
+            if not self.dirty:
+                return
+            live = dict((key, entry) for key, entry in self.cookies.items()
+                        if entry[1] > now)
+            self.dirty = False
+        temp = '%s.%d' % (self.path, os.getpid())
+        try:
+            fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(live, f)
+            os.rename(temp, self.path)
+        except (IOError, OSError):
+            pass
+
+
+default_session_store = SessionStore()
+
+
+def use_session_file(path):
+    '''Make sessions created from now on keep their cookies in path, so
+       that later runs of a script skip the login too'''
+    global default_session_store
+    default_session_store = SessionStore(path)
+    return default_session_store
+
+
+class PooledResponse:
+    '''File-like response body. The connection goes back to its pool
+       once the body has been read to the end; closing it early drops
+       the connection instead'''
+
+    def __init__(self, pool, conn, resp):
+        self.pool = pool
+        self.conn = conn
+        self.resp = resp
+
+    def read(self, size=-1):
+        if self.resp is None:
+            return ''
+        try:
+            if size < 0:
+                data = self.resp.read()
+            else:
+                data = self.resp.read(size)
+        except:
+            self.close()
+            raise
+        if self.resp.isclosed():
+            if self.resp.will_close:
+                self.conn.close()
+            else:
+                self.pool.put(self.conn)
+            self.resp = None
+        return data
+
+    def close(self):
+        if self.resp is not None:
+            self.conn.close()
+            self.resp = None
+
+
 class RespFetcher:
 
     def __init__(
@@ -115,13 +462,15 @@ class RespFetcher:
         username='admin',
         password='insieme',
         url='http://172.21.128.227/ins',
+        pool_manager=None,
         ):
 
         self.username = username
         self.password = password
         self.url = url
-        self.base64_str = base64.encodestring('%s:%s' % (username,
-                password)).replace('\n', '')
+        self.base64_str = basic_auth(username, password)
+        self.pool_manager = pool_manager or default_pool_manager
+        use_management_vrf()
 
     def get_resp(
         self,
@@ -129,20 +478,30 @@ class RespFetcher:
         cookie,
         timeout,
         ):
-        print "URLURLURL : ", self.url
-        req = urllib2.Request(self.url, req_str)
-        req.add_header('Authorization', 'Basic %s' % self.base64_str)
-        req.add_header('Cookie', '%s' % cookie)
+        headers = {'Authorization': 'Basic %s' % self.base64_str,
+                   'Cookie': '%s' % cookie,
+                   'Content-Type': 'application/x-www-form-urlencoded'}
         try:
-            with contextlib.closing(urllib2.urlopen(req,
-                                    timeout=timeout)) as resp:
-                resp_str = resp.read()
-                resp_headers = resp.info()
-                return (resp_headers, resp_str)
+            return self.pool_manager.urlopen(self.url, req_str, headers,
+                    timeout)
         except socket.timeout, e:
             print 'Req timeout'
             raise
 
+    def get_resp_stream(
+        self,
+        req_str,
+        cookie,
+        timeout,
+        ):
+        '''Like get_resp, but returns the body as a file-like object that
+           is read straight off the socket'''
+        headers = {'Authorization': 'Basic %s' % self.base64_str,
+                   'Cookie': '%s' % cookie,
+                   'Content-Type': 'application/x-www-form-urlencoded'}
+        return self.pool_manager.urlopen(self.url, req_str, headers,
+                timeout, stream=True)
+
 
 class RespFetcherHttps:
 
@@ -151,13 +510,15 @@ class RespFetcherHttps:
         username='admin',
         password='insieme',
         url='https://172.21.128.227/ins',
+        pool_manager=None,
         ):
 
         self.username = username
         self.password = password
         self.url = url
-        self.base64_str = base64.encodestring('%s:%s' % (username,
-                password)).replace('\n', '')
+        self.base64_str = basic_auth(username, password)
+        self.pool_manager = pool_manager or default_pool_manager
+        use_management_vrf()
 
     def get_resp(
         self,
@@ -166,62 +527,145 @@ class RespFetcherHttps:
         timeout,
         ):
 
-        req = urllib2.Request(self.url, req_str)
-        req.add_header('Authorization', 'Basic %s' % self.base64_str)
-        req.add_header('Cookie', '%s' % cookie)
+        headers = {'Authorization': 'Basic %s' % self.base64_str,
+                   'Cookie': '%s' % cookie,
+                   'Content-Type': 'application/x-www-form-urlencoded'}
         try:
-            with contextlib.closing(urllib2.urlopen(req,
-                                    timeout=timeout)) as resp:
-                resp_str = resp.read()
-                resp_headers = resp.info()
-                return (resp_headers, resp_str)
+            return self.pool_manager.urlopen(self.url, req_str, headers,
+                    timeout)
         except socket.timeout, e:
             print 'Req timeout'
             raise
 
 
-class NXAPITransport:
-    '''N9000 Python objects off-the-box transport utilizing NX-API'''
-    target_url = ''
-    username = ''
-    password = ''
+def send_request(owner, fetcher, target_url, username, req_msg_str,
+                 timeout, stream=False):
+    '''Send req_msg_str with owner's cookie for target_url and store the
+       cookie the switch sets. A 401 for a request that carried a cookie
+       drops the cookie and retries once with the password alone'''
+    store = owner.session_store
+    for attempt in (0, 1):
+        cookie = owner.get_cookie()
+        try:
+            if stream:
+                (resp_headers, resp) = fetcher.get_resp_stream(req_msg_str,
+                        cookie, timeout)
+            else:
+                (resp_headers, resp) = fetcher.get_resp(req_msg_str,
+                        cookie, timeout)
+        except urllib2.HTTPError, e:
+            if e.code != 401 or cookie == 'no-cookie' or attempt:
+                raise
+            store.invalidate(target_url, username)
+            if getattr(owner, 'cookie', None) == cookie:
+                owner.cookie = 'no-cookie'
+            continue
+        if 'Set-Cookie' in resp_headers:
+            store.update(target_url, username, resp_headers['Set-Cookie'])
+        return (resp_headers, resp)
 
-    timeout = 10.0
 
-    out_format = 'xml'
-    do_chunk = '0'
+def fetch_chunks(owner, cmd, timeout):
+    '''Run a show command in NX-API chunk mode and yield the XML output a
+       chunk at a time. Each request carries the sid returned by the
+       previous one until the switch answers with sid "eoc". owner is the
+       session or NXAPI object whose request() sends them'''
+    req_obj = RequestMsg()
     sid = 'sid'
-    cookie = 'no-cookie'
+    while True:
+        req_msg_str = req_obj.get_req_msg_str(msg_type='cli_show',
+                input_cmd=cmd, out_format='xml', do_chunk='1', sid=sid)
+        (resp_headers, resp_str) = owner.request(req_msg_str, timeout)
+        root = ET.fromstring(resp_str)
+        code = root.findtext('.//code')
+        if code != "200":
+            raise cmd_exec_error("Command execution error: {0}".format(
+                root.findtext('.//msg')))
+        body = root.find('.//body')
+        if body is not None and body.text:
+            chunk = body.text
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            yield chunk
+        sid = root.findtext('.//sid')
+        if not sid or sid == 'eoc':
+            return
+
+
+def iter_rows(source, row, **kwargs):
+    '''Yield every record at row (an element name such as ROW_prefix, or
+       a path such as TABLE_prefix/ROW_prefix) in source as a dict as soon
+       as its end tag is parsed. source is a file-like object, such as a
+       streamed response, or an iterator of XML strings such as
+       fetch_chunks(). Only the record being built is held in memory.
+       Other keyword arguments go to xmltodict.iterparse'''
+    return xmltodict.iterparse(source, row, **kwargs)
+
+
+class NXAPISession:
+    '''N9000 Python objects off-the-box transport utilizing NX-API. Each
+       instance talks to one switch, so several sessions can be used side
+       by side. Login cookies are kept in a SessionStore by switch and
+       username, so new sessions with a switch reuse them. With a
+       clicache.CliCache, cli() and clidict() outputs are reused while
+       fresh; the cache may be shared between sessions'''
 
     req_obj = RequestMsg()
 
-    @classmethod
-    def init(cls, target_url, username, password,timeout=timeout):
-        cls.target_url = target_url
-        cls.username = username
-        cls.password = password
-        cls.req_fetcher = RespFetcher(username=username,
-                password=password, url=target_url)
+    # Largest number of commands sent in one batched request
+    max_batch = 10
 
-    @classmethod
-    def send_cmd_int(cls, cmd, msg_type):
+    def __init__(
+        self,
+        target_url,
+        username,
+        password,
+        timeout=10.0,
+        pool_manager=None,
+        cache=None,
+        session_store=None,
+        ):
+
+        self.target_url = target_url
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.cache = cache
+        self.session_store = session_store or default_session_store
+
+        self.out_format = 'xml'
+        self.do_chunk = '0'
+        self.sid = 'sid'
+
+        self.req_fetcher = RespFetcher(username=username,
+                password=password, url=target_url,
+                pool_manager=pool_manager)
+
+    def get_cookie(self):
+        return self.session_store.get(self.target_url, self.username) \
+            or 'no-cookie'
+
+    def request(self, req_msg_str, timeout=None, stream=False):
+        '''Send a request with the stored cookie and keep the one the
+           switch sets. A cookie the switch no longer accepts is dropped
+           and the request sent again with the password only'''
+        return send_request(self, self.req_fetcher, self.target_url,
+                self.username, req_msg_str, timeout or self.timeout,
+                stream)
+
+    def send_cmd_int(self, cmd, msg_type, timeout=None):
         '''Construct NX-API message. Send commands through NX-API. Only single
            command for show commands. Internal usage'''
         if msg_type == "cli_show" or msg_type == "cli_show_ascii":
             if " ;" in cmd:
                 raise cmd_exec_error("Only single show command supported in internal api")
 
-        req_msg_str = cls.req_obj.get_req_msg_str(msg_type=msg_type,
-                input_cmd=cmd, out_format=cls.out_format,
-                do_chunk=cls.do_chunk, sid=cls.sid)
-        (resp_headers, resp_str) = \
-            cls.req_fetcher.get_resp(req_msg_str, cls.cookie,
-                cls.timeout)
-
-        if 'Set-Cookie' in resp_headers:
-            cls.cookie = resp_headers['Set-Cookie']
+        req_msg_str = self.req_obj.get_req_msg_str(msg_type=msg_type,
+                input_cmd=cmd, out_format=self.out_format,
+                do_chunk=self.do_chunk, sid=self.sid)
+        (resp_headers, resp_str) = self.request(req_msg_str, timeout)
         content_type = resp_headers['Content-Type']
-        root = etree.fromstring(resp_str)
+        root = ET.fromstring(resp_str)
         body = root.findall('.//body')
         code = root.findall('.//code')
         msg = root.findall('.//msg')
@@ -230,7 +674,7 @@ class NXAPITransport:
         status = 0
         if len(body) != 0:
             if msg_type == 'cli_show':
-                output = etree.tostring(body[0])
+                output = ET.tostring(body[0])
             else:
                 output = body[0].text
 
@@ -242,21 +686,13 @@ class NXAPITransport:
             status = int(code[0].text)
         return [output, status, msg[0].text]
 
-    @classmethod
-    def send_cmd(cls, cmd, msg_type):
+    def send_cmd(self, cmd, msg_type, timeout=None):
         '''Construct NX-API message. Send commands through NX-API. Multiple
            commands okay'''
-        req_msg_str = cls.req_obj.get_req_msg_str(msg_type=msg_type,
-                input_cmd=cmd, out_format=cls.out_format,
-                do_chunk=cls.do_chunk, sid=cls.sid)
-        print "TITU : %s : %s : %d" % (req_msg_str, cls.cookie, cls.timeout)
-
-
-        (resp_headers, resp_str) = \
-            cls.req_fetcher.get_resp(req_msg_str, cls.cookie,
-                cls.timeout)
-        if 'Set-Cookie' in resp_headers:
-            cls.cookie = resp_headers['Set-Cookie']
+        req_msg_str = self.req_obj.get_req_msg_str(msg_type=msg_type,
+                input_cmd=cmd, out_format=self.out_format,
+                do_chunk=self.do_chunk, sid=self.sid)
+        (resp_headers, resp_str) = self.request(req_msg_str, timeout)
         content_type = resp_headers['Content-Type']
         #root = etree.fromstring(resp_str)
         root = ET.fromstring(resp_str)
@@ -287,46 +723,458 @@ class NXAPITransport:
 
         return output
 
+    def send_cmd_batch(self, cmds, msg_type, timeout=None):
+        '''Send several show commands in as few NX-API requests as
+           possible. Returns one [output, status, msg] per command, in
+           order, like send_cmd_int. A failing command does not affect
+           the others'''
+        results = []
+        for start in range(0, len(cmds), self.max_batch):
+            chunk = cmds[start:start + self.max_batch]
+            for cmd in chunk:
+                if " ;" in cmd:
+                    raise cmd_exec_error("Batched commands must not contain ' ;'")
+            req_msg_str = self.req_obj.get_req_msg_str(msg_type=msg_type,
+                    input_cmd=" ;".join(chunk), out_format=self.out_format,
+                    do_chunk=self.do_chunk, sid=self.sid)
+            (resp_headers, resp_str) = self.request(req_msg_str, timeout)
+            root = ET.fromstring(resp_str)
+
+            # Walk the <output> elements of ins_api/outputs rather than
+            # all bodies and codes in the document, so neither a failed
+            # command without a <body> nor an <output> element inside a
+            # command's body shifts the later results
+            outputs = root.findall('outputs/output')
+            if len(outputs) != len(chunk):
+                raise unexpected_error("Expected {0} outputs, got {1}".format(
+                    len(chunk), len(outputs)))
+            for out in outputs:
+                body = out.find('body')
+                code = out.findtext('code')
+                if code is None:
+                    raise unexpected_error("Unexpected error")
+                output = ""
+                if body is not None:
+                    if msg_type == 'cli_show':
+                        output = ET.tostring(body)
+                    else:
+                        output = body.text or ""
+                if code == "200":
+                    status = 0
+                else:
+                    status = int(code)
+                results.append([output, status, out.findtext('msg')])
+        return results
+
+    def iter_chunks(self, cmd, timeout=None):
+        '''Run a show command in chunk mode. Yields the XML output in
+           pieces as they are fetched'''
+        return fetch_chunks(self, cmd, timeout or self.timeout)
+
+    def iter_rows(self, cmd, row, timeout=None, chunked=True, **kwargs):
+        '''Run a show command and yield each <row> record (e.g.
+           ROW_prefix) as a dict while the rest of the output is still
+           being fetched. chunked selects NX-API chunk mode; otherwise
+           the single response is parsed as it is read off the socket'''
+        if chunked:
+            return iter_rows(self.iter_chunks(cmd, timeout), row, **kwargs)
+        req_msg_str = self.req_obj.get_req_msg_str(msg_type='cli_show',
+                input_cmd=cmd, out_format='xml', do_chunk='0', sid=self.sid)
+        (resp_headers, resp) = self.request(req_msg_str, timeout,
+                stream=True)
+        return iter_rows(resp, row, **kwargs)
+
+    def from_cache(self, kind, cmd, fetch):
+        '''Return the cached output of cmd on this switch, or call fetch()
+           and cache its result'''
+        return self.cache.fetch((self.target_url, kind, cmd), cmd, fetch)
+
+    def cli(self, cmd, timeout=None):
+        '''Run cli show command. Return show output'''
+        if self.cache is not None and cmd.lstrip().startswith('show'):
+            return self.from_cache('cli', cmd,
+                lambda: self.send_cmd(cmd, "cli_show_ascii", timeout))
+        return self.send_cmd(cmd, "cli_show_ascii", timeout)
+
+    def clip(self, cmd, timeout=None):
+        '''Run cli show command. Print show output'''
+        print self.send_cmd(cmd, "cli_show_ascii", timeout)
+
+    def clic(self, cmd, timeout=None):
+        '''Run cli configure command. Return configure output'''
+        return self.send_cmd(cmd, "cli_conf", timeout)
+
+    def send_cmd_json(self, cmds, timeout=None):
+        '''Send show commands asking NX-API for JSON output. Returns the
+           decoded <output> objects, one per command, without going
+           through XML'''
+        outputs = []
+        for start in range(0, len(cmds), self.max_batch):
+            chunk = cmds[start:start + self.max_batch]
+            for cmd in chunk:
+                if " ;" in cmd:
+                    raise cmd_exec_error("Batched commands must not contain ' ;'")
+            req_msg_str = self.req_obj.get_req_msg_str(msg_type='cli_show',
+                    input_cmd=" ;".join(chunk), out_format='json',
+                    do_chunk=self.do_chunk, sid=self.sid)
+            (resp_headers, resp_str) = self.request(req_msg_str, timeout)
+            try:
+                output = json.loads(resp_str)['ins_api']['outputs']['output']
+            except (ValueError, KeyError, TypeError):
+                raise unexpected_error("Unexpected error")
+            # A single command comes back as an object, not a list
+            if isinstance(output, dict):
+                output = [output]
+            if len(output) != len(chunk):
+                raise unexpected_error("Expected {0} outputs, got {1}".format(
+                    len(chunk), len(output)))
+            outputs.extend(output)
+        return outputs
+
+    def clidict(self, cmd, timeout=None):
+        '''Run cli show command. Return the output as Python objects,
+           decoded straight from NX-API JSON output'''
+        if " ;" in cmd:
+            raise cmd_exec_error("Only single command is allowed in clidict()")
+        if self.cache is not None:
+            return self.from_cache('clidict', cmd,
+                lambda: self.fetch_dict(cmd, timeout))
+        return self.fetch_dict(cmd, timeout)
+
+    def fetch_dict(self, cmd, timeout=None):
+        output = self.send_cmd_json([cmd], timeout)[0]
+        if str(output.get('code')) != "200":
+            raise cmd_exec_error("Command execution error: {0}".format(
+                output.get('msg')))
+        return output.get('body') or {}
+
+    def clidict_batch(self, cmds, timeout=None):
+        '''Run several cli show commands in one round trip. Returns a
+           [body, status, msg] per command; body is None for a command
+           that failed'''
+        results = []
+        for output in self.send_cmd_json(cmds, timeout):
+            if str(output.get('code')) == "200":
+                results.append([output.get('body') or {}, 0,
+                                output.get('msg')])
+            else:
+                results.append([None, int(output.get('code') or 0),
+                                output.get('msg')])
+        return results
+
+    def clid(self, cmd, timeout=None):
+        '''Run cli show command. Return JSON output. Kept for callers that
+           expect a JSON string; new code should use clidict()'''
+        if " ;" in cmd:
+            raise cmd_exec_error("Only single command is allowed in clid()")
+        return json.dumps(self.clidict(cmd, timeout))
+
+    def clid_batch(self, cmds, timeout=None):
+        '''Run several cli show commands in one round trip. Returns a
+           [json_output, status, msg] per command; json_output is None
+           for a command that failed'''
+        results = []
+        for (body, status, msg) in self.clidict_batch(cmds, timeout):
+            if body is not None:
+                body = json.dumps(body)
+            results.append([body, status, msg])
+        return results
+
+
+class NXAPITransport:
+    '''N9000 Python objects off-the-box transport utilizing NX-API. Class
+       level wrapper around a single NXAPISession, kept for scripts that
+       talk to one switch at a time'''
+    target_url = ''
+    username = ''
+    password = ''
+
+    timeout = 10.0
+
+    session = None
+
+    @classmethod
+    def init(cls, target_url, username, password, timeout=timeout,
+             pool_manager=None, cache=None, session_store=None):
+        cls.target_url = target_url
+        cls.username = username
+        cls.password = password
+        cls.timeout = timeout
+        # The login cookie lives in the session store, not the class, so
+        # pointing init() back at a switch reuses its cookie
+        cls.session = NXAPISession(target_url, username, password,
+                timeout=timeout, pool_manager=pool_manager, cache=cache,
+                session_store=session_store)
+
+    @classmethod
+    def send_cmd_int(cls, cmd, msg_type):
+        '''Construct NX-API message. Send commands through NX-API. Only single
+           command for show commands. Internal usage'''
+        return cls.session.send_cmd_int(cmd, msg_type)
+
+    @classmethod
+    def send_cmd(cls, cmd, msg_type):
+        '''Construct NX-API message. Send commands through NX-API. Multiple
+           commands okay'''
+        return cls.session.send_cmd(cmd, msg_type)
+
+    @classmethod
+    def send_cmd_batch(cls, cmds, msg_type):
+        '''Send several show commands in one NX-API round trip. Returns
+           one [output, status, msg] per command'''
+        return cls.session.send_cmd_batch(cmds, msg_type)
+
+    @classmethod
+    def iter_rows(cls, cmd, row, chunked=True, **kwargs):
+        '''Run a show command. Yields each <row> record as a dict'''
+        return cls.session.iter_rows(cmd, row, chunked=chunked, **kwargs)
+
     @classmethod
     def cli(cls, cmd):
         '''Run cli show command. Return show output'''
-        try:
-            output = cls.send_cmd(cmd, "cli_show_ascii")
-            return output
-        except:
-            raise
+        return cls.session.cli(cmd)
 
     @classmethod
     def clip(cls, cmd):
         '''Run cli show command. Print show output'''
-        try:
-            output = cls.send_cmd(cmd, "cli_show_ascii")
-            print output
-        except:
-            raise
+        cls.session.clip(cmd)
 
     @classmethod
     def clic(cls, cmd):
         '''Run cli configure command. Return configure output'''
-        try:
-            output = cls.send_cmd(cmd, "cli_conf")
-            return output
-        except:
-            raise
+        return cls.session.clic(cmd)
 
     @classmethod
     def clid(cls, cmd):
         '''Run cli show command. Return JSON output. Only XMLized commands
            have outputs'''
-        if " ;" in cmd:
-            raise cmd_exec_error("Only single command is allowed in clid()")
+        return cls.session.clid(cmd)
+
+    @classmethod
+    def clidict(cls, cmd):
+        '''Run cli show command. Return the output as Python objects'''
+        return cls.session.clidict(cmd)
+
+    @classmethod
+    def clid_batch(cls, cmds):
+        '''Run several cli show commands in one round trip. Returns a
+           [json_output, status, msg] per command'''
+        return cls.session.clid_batch(cmds)
+
+    @classmethod
+    def clidict_batch(cls, cmds):
+        '''Run several cli show commands in one round trip. Returns a
+           [body, status, msg] per command'''
+        return cls.session.clidict_batch(cmds)
+
+
+class SwitchResult:
+    '''Outcome of running a list of commands on one switch. outputs and
+       errors are indexed like the command list and index is the
+       position of the switch in the inventory; a command that failed or
+       never ran because of the deadline has output None and an error'''
+
+    def __init__(self, index, switch, cmds):
+        self.index = index
+        self.switch = switch
+        self.cmds = cmds
+        self.outputs = [None] * len(cmds)
+        self.errors = [None] * len(cmds)
+        self.started = None
+        self.elapsed = 0.0
+
+    def ok(self):
+        return not any(self.errors)
+
+
+class NXAPIExecutor:
+    '''Runs the same commands on many switches concurrently.
+
+       An inventory entry is [ip_or_url, username, password], as used by
+       the scripts in this directory. At most max_workers requests are in
+       flight overall and at most per_switch against any one switch.
+       deadline bounds the wall time of the whole of run(), in seconds:
+       no command is sent after it, and commands still running when it
+       passes are given up on. Either way they fail with 'Deadline
+       exceeded'. run() yields a SwitchResult per switch as soon as all of
+       its commands are done, so results arrive in completion order.
+       A clicache.CliCache passed as cache is shared by all sessions, as
+       is session_store, which defaults to default_session_store'''
+
+    def __init__(
+        self,
+        max_workers=32,
+        per_switch=1,
+        deadline=None,
+        method='clid',
+        timeout=10.0,
+        pool_manager=None,
+        cache=None,
+        session_store=None,
+        ):
+
+        if per_switch < 1:
+            raise ValueError('per_switch must be at least 1, got {0}'.format(
+                per_switch))
+        self.max_workers = max_workers
+        self.per_switch = per_switch
+        self.deadline = deadline
+        self.method = method
+        self.timeout = timeout
+        self.pool_manager = pool_manager
+        self.cache = cache
+        self.session_store = session_store
+
+    def make_session(self, switch):
+        (target, username, password) = switch[:3]
+        if '://' in target:
+            target_url = target
+        else:
+            target_url = 'http://%s/ins' % target
+        return NXAPISession(target_url, username, password,
+                timeout=self.timeout, pool_manager=self.pool_manager,
+                cache=self.cache, session_store=self.session_store)
+
+    def worker(self, tasks, done):
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            (index, cmd_index, session, cmd, timeout) = task
+            try:
+                output = getattr(session, self.method)(cmd, timeout=timeout)
+                done.put((index, cmd_index, output, None))
+            except Exception, e:
+                done.put((index, cmd_index, None, e))
+
+    def run(self, inventory, cmds):
+        if not cmds:
+            for index, switch in enumerate(inventory):
+                yield SwitchResult(index, switch, cmds)
+            return
+
+        tasks = Queue.Queue()
+        done = Queue.Queue()
+        nworkers = max(1, min(self.max_workers,
+                       len(inventory) * min(self.per_switch, len(cmds))))
+        threads = []
+        for i in range(nworkers):
+            t = threading.Thread(target=self.worker, args=(tasks, done))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        results = [SwitchResult(index, switch, cmds)
+                   for index, switch in enumerate(inventory)]
+        sessions = [None] * len(inventory)
+        pending = [range(len(cmds)) for switch in inventory]
+        # The command indexes running on each switch
+        inflight = [set() for switch in inventory]
+        remaining = [len(cmds)] * len(inventory)
+        total_inflight = 0
+        finished = 0
+        ends = None
+        if self.deadline is not None:
+            ends = time.time() + self.deadline
+        abandoned = False
+
         try:
-            output = cls.send_cmd(cmd, "cli_show")
-            o = xmltodict.parse(output)
-            json_output = json.dumps(o["body"])
-            return json_output
-        except:
-            raise
+            while finished < len(inventory):
+                # Hand out work, one command per switch per pass, so a
+                # long command list on one switch does not starve others
+                dispatched = True
+                while dispatched and total_inflight < nworkers:
+                    dispatched = False
+                    for index, result in enumerate(results):
+                        if total_inflight >= nworkers:
+                            break
+                        if not pending[index] \
+                            or len(inflight[index]) >= self.per_switch:
+                            continue
+                        cmd_index = pending[index].pop(0)
+                        now = time.time()
+                        if result.started is None:
+                            result.started = now
+                        timeout = self.timeout
+                        if ends is not None:
+                            left = ends - now
+                            if left <= 0:
+                                result.errors[cmd_index] = \
+                                    cmd_exec_error('Deadline exceeded')
+                                remaining[index] -= 1
+                                if remaining[index] == 0:
+                                    result.elapsed = now - result.started
+                                    finished += 1
+                                    yield result
+                                continue
+                            timeout = min(timeout, left)
+                        if sessions[index] is None:
+                            try:
+                                sessions[index] = \
+                                    self.make_session(result.switch)
+                            except Exception, e:
+                                result.errors[cmd_index] = e
+                                remaining[index] -= 1
+                                if remaining[index] == 0:
+                                    result.elapsed = now - result.started
+                                    finished += 1
+                                    yield result
+                                continue
+                        tasks.put((index, cmd_index, sessions[index],
+                                   cmds[cmd_index], timeout))
+                        inflight[index].add(cmd_index)
+                        total_inflight += 1
+                        dispatched = True
+
+                if total_inflight == 0:
+                    continue
+                try:
+                    if ends is None:
+                        answer = done.get()
+                    else:
+                        answer = done.get(timeout=max(0, ends - time.time()))
+                except Queue.Empty:
+                    # The deadline passed with commands still running, on
+                    # a switch that answers slowly but steadily. Give up on
+                    # them; the loop above fails whatever is left unsent
+                    abandoned = True
+                    now = time.time()
+                    for index, result in enumerate(results):
+                        if not inflight[index]:
+                            continue
+                        for cmd_index in inflight[index]:
+                            result.errors[cmd_index] = \
+                                cmd_exec_error('Deadline exceeded')
+                        remaining[index] -= len(inflight[index])
+                        total_inflight -= len(inflight[index])
+                        inflight[index] = set()
+                        if remaining[index] == 0:
+                            result.elapsed = now - result.started
+                            finished += 1
+                            yield result
+                    continue
+                (index, cmd_index, output, error) = answer
+                if cmd_index not in inflight[index]:
+                    # Answered after it was given up on
+                    continue
+                inflight[index].remove(cmd_index)
+                total_inflight -= 1
+                remaining[index] -= 1
+                result = results[index]
+                result.outputs[cmd_index] = output
+                result.errors[cmd_index] = error
+                if remaining[index] == 0:
+                    result.elapsed = time.time() - result.started
+                    finished += 1
+                    yield result
+        finally:
+            for t in threads:
+                tasks.put(None)
+        # Let the workers see their stop marker before the interpreter
+        # exits, unless some are still busy with commands given up on
+        if not abandoned:
+            for t in threads:
+                t.join()
 
 
 class NXAPI:
@@ -345,6 +1193,10 @@ class NXAPI:
         self.sid = 'sid'
         self.cookie = 'no-cookie'
 
+        self.pool_manager = default_pool_manager
+        self.session_store = default_session_store
+        self.req_fetcher = None
+
     def set_target_url(self, target_url='http://localhost/ins'):
         self.target_url = target_url
 
@@ -368,9 +1220,9 @@ class NXAPI:
         self.out_format = out_format
 
     def set_do_chunk(self, do_chunk='0'):
-        if do_chunk != 0 and do_chunk != 1:
+        if str(do_chunk) != '0' and str(do_chunk) != '1':
             raise data_type_error('do_chunk 0 or 1')
-        self.do_chunk = do_chunk
+        self.do_chunk = str(do_chunk)
 
     def set_sid(self, sid='sid'):
         self.sid = sid
@@ -378,6 +1230,12 @@ class NXAPI:
     def set_cookie(self, cookie='no-cookie'):
         self.cookie = cookie
 
+    def set_pool_manager(self, pool_manager=None):
+        self.pool_manager = pool_manager or default_pool_manager
+
+    def set_session_store(self, session_store=None):
+        self.session_store = session_store or default_session_store
+
     def set_ver(self, ver='0.1'):
         if ver != '0.1':
             raise data_type_error('Only ver 0.1 supported')
@@ -414,7 +1272,10 @@ class NXAPI:
         return self.sid
 
     def get_cookie(self):
-        return self.cookie
+        '''The stored login cookie of the target, else the one set with
+           set_cookie()'''
+        return self.session_store.get(self.target_url, self.username) \
+            or self.cookie
 
     def req_to_string(self):
         req_msg = '<?xml version="1.0" encoding="ISO-8859-1"?>\n'
@@ -428,7 +1289,39 @@ class NXAPI:
         req_msg += '</ins_api>\n'
         return req_msg
 
-    def send_req(self):
-         req = RespFetcher(self.username, self.password, self.target_url)
-         return req.get_resp(self.req_to_string(), self.cookie, self.timeout)
+    def get_req_fetcher(self):
+        '''Reuse the fetcher across calls; rebuild only when the target,
+           credentials or pool change'''
+        fetcher = self.req_fetcher
+        if fetcher is None or fetcher.url != self.target_url \
+            or fetcher.username != self.username \
+            or fetcher.password != self.password \
+            or fetcher.pool_manager is not self.pool_manager:
+            fetcher = RespFetcher(self.username, self.password,
+                    self.target_url, self.pool_manager)
+            self.req_fetcher = fetcher
+        return fetcher
+
+    def request(self, req_msg_str, timeout=None, stream=False):
+        '''Send a request with the target's stored cookie and keep the
+           one the switch sets'''
+        return send_request(self, self.get_req_fetcher(), self.target_url,
+                self.username, req_msg_str, timeout or self.timeout,
+                stream)
 
+    def send_req(self):
+        return self.request(self.req_to_string())
+
+    def send_req_stream(self):
+        '''Like send_req, but returns the body as a file-like object'''
+        return self.request(self.req_to_string(), stream=True)
+
+    def iter_rows(self, row, **kwargs):
+        '''Run the current show command and yield each <row> record (e.g.
+           ROW_prefix) as a dict while the rest of the output is still
+           being fetched. Uses NX-API chunk mode when do_chunk is 1,
+           otherwise parses the response as it is read off the socket'''
+        if self.do_chunk == '1':
+            return iter_rows(fetch_chunks(self, self.cmd, self.timeout),
+                    row, **kwargs)
+        return iter_rows(self.send_req_stream()[1], row, **kwargs)
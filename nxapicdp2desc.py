@@ -31,72 +31,39 @@ switches = [
 ]
 
 
+# Set to True to run against the switch this script runs on, instead of
+# the switches listed above
+onbox = False
+
+
 import sys
-import pprint
-import json
 sys.path.append("./cisco")
 sys.path.append("./utils")
 
-onbox = False
-try:
-    from cli import clid, cli
-except ImportError:
-    try:
-        from nxapi_utils import NXAPITransport
-        from cisco.interface import Interface
-        onbox = False
-    except ImportError:
-        print 'Script is unsupported on this platform'
-        raise
+from clibackend import NXAPIBackend, OnBoxBackend
+from clicache import CliCache
+from dictquery import findfirst
 
-from nxapi_utils import NXAPITransport
-from cisco.interface import Interface
-def findkey(dct, key, value=None):
-    """This method recursively searches through a JSON dict for a key name
-    and returns a list of the matching results
-    """
-    found = []
-    if isinstance(dct, list):
-        for item in dct:
-            f = findkey(item, key, value)
-            if f:
-                found.extend(f)
-    if isinstance(dct, dict):
-        for k, v in dct.items():
-            if isinstance(v, list) or isinstance(v, dict):
-                f = findkey(v, key, value)
-                if f:
-                    found.extend(f)
-            if str(k) == str(key):
-                if (value and str(v) == str(value)) or not value:
-                    found.append(v)
-    return found if len(found) > 0 else None
+# Shared by every session, so a switch listed twice is only asked once
+clicache = CliCache(ttl=60)
 
-for switch in switches:
-    cdp_dict = {}
-    if not onbox:
-        target_url = "http://%s/ins" % switch[0]
-        username = switch[1]
-        password = switch[2]
-        NXAPITransport.init(
-            target_url=target_url, username=username, password=password)
 
-        def smartcli(*args):
-            """This wrapper function provides a less intrusive way to call the
-            appropriate msg_type for configuration based commands
-            """
-            cmd = args[0]
-            if cmd[:4] == 'conf':
-                NXAPITransport.send_cmd(cmd, msg_type='cli_conf')
-            else:
-                NXAPITransport.cli(cmd)
-        cli = smartcli
-        clid = NXAPITransport.clid
+for switch in switches:
+    # The same calls work on box and through NX-API; clic() sends
+    # configuration commands the way each backend needs
+    if onbox:
+        backend = OnBoxBackend()
+    else:
+        backend = NXAPIBackend(switch[0], switch[1], switch[2],
+                               cache=clicache)
+    clidict = backend.clidict
 
     cdp_dict = {}
 
-    cdp = json.loads(clid('show cdp neighbor'))
-    cdp = findkey(cdp, 'ROW_cdp_neighbor_brief_info')[0]
+    cdp = clidict('show cdp neighbor')
+    cdp = findfirst(cdp, 'ROW_cdp_neighbor_brief_info', default=[])
+    if isinstance(cdp, dict):
+        cdp = [cdp]
     for entry in cdp:
         intf_id = entry['intf_id']
         if intf_id not in cdp_dict:
@@ -116,5 +83,5 @@ for switch in switches:
             cmd = 'conf t ; interface {interface} ; description {device_id} {port_id}'.format(
                 **fields)
             print(cmd)
-            cli(cmd)
+            backend.clic(cmd)
 
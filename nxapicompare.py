@@ -36,22 +36,28 @@ import json
 sys.path.append("./cisco")
 sys.path.append("./utils")
 
-from nxapi_utils import NXAPITransport
-from cisco import *
+from nxapi_utils import NXAPIExecutor
 
 # Replace the list of switch details in below list
 # Example : [IP, USERNAME, PASSWORD]
 switches = [ ['172.31.216.130', 'admin', 'cisco123'],
                         ['172.31.216.131', 'admin', 'cisco123']]
 
-set_global_vrf("management")
-results = []
-for switch in switches:
-        target_url = "http://%s/ins" % switch[0]
-        username = switch[1]
-        password = switch[2]
-        NXAPITransport.init(target_url=target_url, username=username, password=password)
-        results.append(json.loads(NXAPITransport.clid("show version")))
+# nxapi_utils picks the management VRF itself, when run on a switch
+
+# Query every switch at once; results come back as each switch answers,
+# so keep them keyed by position to compare against the first switch
+executor = NXAPIExecutor(max_workers=64, deadline=60, method="clidict")
+byindex = {}
+for result in executor.run(switches, ["show version"]):
+        if not result.ok():
+                print "%s: %s" % (result.switch[0], result.errors[0])
+                continue
+        byindex[result.index] = result.outputs[0]
+results = [byindex[i] for i in sorted(byindex)]
+if not results:
+        sys.stderr.write("No switch answered, nothing to compare\n")
+        sys.exit(1)
 
 switchlist = [r['host_name'] for r in results]
 
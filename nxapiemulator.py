@@ -0,0 +1,804 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2014 Cisco Systems Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# A stand-in for the NX-API /ins endpoint of many switches, to load test
+# the NX-API scripts and nxapi_utils without any hardware. It answers the
+# ins_api requests built by nxapi_utils (XML, or the JSON form of the same
+# request) with generated outputs for:
+#
+#   show version, show vrf, show ip route, show ipv6 route, show ip arp,
+#   show mac address-table, show port-channel summary, show cdp neighbors,
+#   show interface [brief | <list and ranges of interfaces>]
+#
+# in xml, json and ascii (cli_show_ascii, including '| xml') output, in
+# chunk mode, and accepts configuration commands. Each local address is a
+# different switch with its own tables: on Linux every 127.x.y.z address
+# reaches a listener on 0.0.0.0, so
+#
+#   python nxapiemulator.py --port 8080 --switches 2000 --latency 20
+#
+# serves 2000 switches at http://127.1.0.1:8080/ins, 127.1.0.2 and so on.
+# Logins set an nxapi_auth cookie that later requests may send instead of
+# the password. Latency, chunk size, keep-alive limits and injected
+# command, HTTP and connection errors are configurable; GET /stats returns
+# the request counters as JSON. From Python:
+#
+#   server = start(port=0, latency=0.02)
+#   url = 'http://127.1.0.1:%d/ins' % server.server_address[1]
+#
+
+import BaseHTTPServer
+import SocketServer
+import base64
+import json
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from xml.sax.saxutils import escape, unescape
+
+from clicache import CliCache
+from ifstats import expand, longname as longifname
+
+XML_HEAD = '<?xml version="1.0" encoding="ISO-8859-1"?>\n<nf:rpc-reply ' \
+    'xmlns:nf="urn:ietf:params:xml:ns:netconf:base:1.0" ' \
+    'xmlns="http://www.cisco.com/nxos:1.0:{0}">\n <nf:data>\n'
+XML_TAIL = ' </nf:data>\n</nf:rpc-reply>\n'
+
+FIRST_ADDRESS = '127.1.0.1'
+
+# Table sizes of every simulated switch
+DEFAULT_SIZES = {'routes': 1000, 'arp': 200, 'macs': 400, 'cdp': 48,
+                 'interfaces': 52, 'vrfs': 2}
+
+# Outputs that change between requests are never cached
+DYNAMIC = ('show interface',)
+
+
+def switch_addresses(count, first=FIRST_ADDRESS):
+    '''Returns the local addresses of count simulated switches'''
+    (start,) = struct.unpack('!I', socket.inet_aton(first))
+    return [socket.inet_ntoa(struct.pack('!I', start + i))
+            for i in range(count)]
+
+
+def rows(*fields):
+    return OrderedDict(fields)
+
+
+def table(name, items):
+    '''Returns {TABLE_name: {ROW_name: items}}, with a single row as a dict
+       the way NX-API returns it'''
+    if len(items) == 1:
+        items = items[0]
+    return OrderedDict([('TABLE_' + name, {'ROW_' + name: items})])
+
+
+class Switch:
+    '''The tables of one simulated switch, generated from its address so
+       that every run serves the same outputs'''
+
+    def __init__(self, address, sizes=None):
+        self.address = address
+        self.sizes = dict(DEFAULT_SIZES, **(sizes or {}))
+        (self.index,) = struct.unpack('!I', socket.inet_aton(address))
+        self.hostname = 'sim-' + address.replace('.', '-')
+        self.booted = time.time() - 86400 - self.index % 86400
+        self.random = random.Random(self.index)
+        self.vrfs = ['default', 'management'] + \
+            ['vrf%d' % i for i in range(1, self.sizes['vrfs'] - 1)]
+        self.interfaces = ['Ethernet1/%d' % (i + 1)
+                           for i in range(self.sizes['interfaces'])]
+        # The last eight ports are bundled in pairs
+        last = len(self.interfaces)
+        self.portchannels = OrderedDict(
+            ('port-channel%d' % (po + 10),
+             self.interfaces[last - 2 * po - 2:last - 2 * po])
+            for po in range(min(4, last // 2)))
+        # Bits per second of each interface, in and out
+        self.rates = [(self.random.randint(0, 10 ** 9),
+                       self.random.randint(0, 10 ** 9))
+                      for name in self.interfaces]
+
+    def mac(self, i):
+        return '00%02x.%04x.%04x' % (self.index & 255, self.index >> 8 & 0xffff,
+                                     i & 0xffff)
+
+    def host(self, i):
+        return '10.%d.%d.%d' % (self.index & 255, i >> 8 & 255, i & 255 or 1)
+
+    def port(self, i):
+        '''Port a host is learnt on: mostly access ports, some behind the
+           port-channels'''
+        if self.portchannels and i % 5 == 0:
+            names = self.portchannels.keys()
+            return 'Po' + names[i // 5 % len(names)][len('port-channel'):]
+        access = len(self.interfaces) - 2 * len(self.portchannels)
+        return 'Eth1/%d' % (i % max(access, 1) + 1)
+
+    def show_version(self, args):
+        return rows(
+            ('header_str', 'Cisco Nexus Operating System (NX-OS) Software'),
+            ('bios_ver_str', '07.15'),
+            ('kickstart_ver_str', '6.1(2)I2(1)'),
+            ('sys_ver_str', '6.1(2)I2(1)'),
+            ('chassis_id', 'Nexus9000 C9396PX Chassis'),
+            ('cpu_name', 'Intel(R) Core(TM) i3-3227U C'),
+            ('memory', 16402540), ('mem_type', 'kB'),
+            ('proc_board_id', 'SAL%08d' % (self.index % 10 ** 8)),
+            ('host_name', self.hostname),
+            ('kern_uptm_days', int(time.time() - self.booted) // 86400),
+            ('kern_uptm_hrs', int(time.time() - self.booted) // 3600 % 24),
+            ('manufacturer', 'Cisco Systems, Inc.'))
+
+    def show_vrf(self, args):
+        return table('vrf', [rows(('vrf_name', name), ('vrf_id', i + 1),
+                                  ('vrf_state', 'Up'), ('vrf_reason', '--'))
+                             for i, name in enumerate(self.vrfs)])
+
+    def route_rows(self, vrf, addrf):
+        count = self.sizes['routes'] if vrf == 'default' else \
+            max(1, self.sizes['routes'] // 10)
+        offset = self.vrfs.index(vrf) << 16
+        result = []
+        for i in range(count):
+            n = offset + i
+            if addrf == 'ipv4':
+                prefix = '%d.%d.%d.0/24' % (20 + (n >> 16) % 200, n >> 8 & 255,
+                                            n & 255)
+                hops = ['192.168.%d.%d' % (k, self.index & 255 or 1)
+                        for k in range(1 + i % 2)]
+            else:
+                prefix = '2001:db8:%x:%x::/64' % (n >> 16, n & 0xffff)
+                hops = ['fe80::%x' % (k + 1) for k in range(1 + i % 2)]
+            paths = [rows(('ipnexthop', hop), ('ifname', 'Eth1/%d' % (k + 1)),
+                          ('uptime', 'P1DT2H3M'), ('pref', 110),
+                          ('metric', 41), ('clientname', 'ospf-1'),
+                          ('type', 'intra'), ('ubest', 'true'))
+                     for k, hop in enumerate(hops)]
+            result.append(rows(
+                ('ipprefix', prefix), ('ucast-nhops', len(paths)),
+                ('mcast-nhops', 0), ('attached', 'false'),
+                ('TABLE_path', {'ROW_path': paths[0] if len(paths) == 1
+                                else paths})))
+        return result
+
+    def show_route(self, args, addrf):
+        vrfs = self.selected_vrfs(args)
+        return table('vrf', [rows(
+            ('vrf-name-out', vrf),
+            ('TABLE_addrf', {'ROW_addrf': rows(
+                ('addrf', addrf),
+                ('TABLE_prefix', {'ROW_prefix':
+                                  self.route_rows(vrf, addrf)}))}))
+            for vrf in vrfs])
+
+    def show_ip_route(self, args):
+        return self.show_route(args, 'ipv4')
+
+    def show_ipv6_route(self, args):
+        return self.show_route(args, 'ipv6')
+
+    def selected_vrfs(self, args):
+        if 'vrf' in args:
+            name = args[args.index('vrf') + 1:][:1]
+            if name == ['all']:
+                return self.vrfs
+            return [vrf for vrf in self.vrfs if [vrf] == name]
+        return ['default']
+
+    def show_ip_arp(self, args):
+        wanted = [arg for arg in args if re.match(r'\d+\.\d+\.\d+\.\d+$', arg)]
+        vrfs = []
+        for vrf in self.selected_vrfs(args):
+            if vrf != 'default':
+                continue
+            adj = [rows(('intf-out', 'Vlan%d' % (i % 10 + 10)),
+                        ('ip-addr-out', self.host(i + 1)),
+                        ('time-stamp', '00:0%d:%02d' % (i % 10, i % 60)),
+                        ('mac', self.mac(i)))
+                   for i in range(self.sizes['arp'])]
+            if wanted:
+                adj = [row for row in adj if row['ip-addr-out'] in wanted]
+            if adj:
+                vrfs.append(OrderedDict(
+                    [('vrf-name-out', vrf), ('cnt-total', len(adj))] +
+                    table('adj', adj).items()))
+        return table('vrf', vrfs) if vrfs else {}
+
+    def show_mac_address_table(self, args):
+        wanted = args[args.index('address') + 1] \
+            if 'address' in args[:-1] else None
+        entries = [rows(('disp_mac_addr', self.mac(i)), ('disp_type', '*'),
+                        ('disp_vlan', str(i % 10 + 10)),
+                        ('disp_is_static', 'disabled'), ('disp_age', '0'),
+                        ('disp_is_secure', 'disabled'),
+                        ('disp_is_ntfy', 'disabled'),
+                        ('disp_port', self.port(i)))
+                   for i in range(self.sizes['macs'])]
+        if wanted:
+            entries = [row for row in entries
+                       if row['disp_mac_addr'] == wanted.lower()]
+        return table('mac_address', entries) if entries else {}
+
+    def show_port_channel_summary(self, args):
+        wanted = None
+        if 'int' in args[:-1] or 'interface' in args[:-1]:
+            wanted = longifname(args[-1]).lower()
+        channels = []
+        for i, (name, members) in enumerate(self.portchannels.items()):
+            if wanted and wanted != name:
+                continue
+            channels.append(rows(
+                ('group', i + 10), ('port-channel', name), ('layer', 'S'),
+                ('status', 'SU'), ('type', 'Eth'), ('prtcl', 'LACP'),
+                ('TABLE_member', {'ROW_member': [
+                    rows(('port', member), ('port-status', 'P'))
+                    for member in members]})))
+        return table('channel', channels) if channels else {}
+
+    def show_cdp_neighbors(self, args):
+        wanted = None
+        if 'interface' in args[:-1]:
+            wanted = longifname(args[-1])
+        neighbors = []
+        for name in self.interfaces[:self.sizes['cdp']]:
+            if wanted and wanted != name:
+                continue
+            number = name.split('/')[-1]
+            neighbors.append(rows(
+                ('ifindex', 436207616 + int(number)),
+                ('device_id', 'server%s.%s' % (number, self.hostname)),
+                ('intf_id', name), ('ttl', 150),
+                ('capability', ['host']), ('platform_id', 'N2K-C2248TP'),
+                ('port_id', 'Ethernet0/%s' % number)))
+        return OrderedDict([('neigh_count', len(neighbors))] +
+                           table('cdp_neighbor_brief_info', neighbors).items()) \
+            if neighbors else {}
+
+    def show_interface(self, args):
+        if args and args[0].lower() == 'brief':
+            return table('interface', [rows(
+                ('interface', name), ('vlan', '--'), ('type', 'eth'),
+                ('portmode', 'routed'), ('state', 'up'),
+                ('state_rsn_desc', 'none'), ('speed', '10G'),
+                ('ratemode', 'D')) for name in self.interfaces])
+        try:
+            wanted = set(expand(''.join(args))) if args else None
+        except ValueError:
+            raise CommandFailed(400, 'Invalid range')
+        now = time.time()
+        up = now - self.booted
+        interfaces = []
+        for name, (inrate, outrate) in zip(self.interfaces, self.rates):
+            if wanted and name not in wanted:
+                continue
+            # Rates wander around their base, counters follow the base
+            jitter = 1 + 0.1 * ((int(now) + self.index) % 7 - 3) / 3.0
+            interfaces.append(rows(
+                ('interface', name), ('state', 'up'),
+                ('admin_state', 'up'), ('eth_mtu', '1500'),
+                ('eth_bw', 10000000), ('eth_speed', '10 Gb/s'),
+                ('eth_load_interval1_rx', 30),
+                ('eth_inrate1_bits', int(inrate * jitter)),
+                ('eth_inrate1_pkts', int(inrate * jitter / 8000)),
+                ('eth_load_interval1_tx', 30),
+                ('eth_outrate1_bits', int(outrate * jitter)),
+                ('eth_outrate1_pkts', int(outrate * jitter / 8000)),
+                ('eth_inpkts', int(up * inrate / 8000)),
+                ('eth_inbytes', int(up * inrate / 8)),
+                ('eth_outpkts', int(up * outrate / 8000)),
+                ('eth_outbytes', int(up * outrate / 8)),
+                ('eth_inerr', 0), ('eth_outerr', 0)))
+        return table('interface', interfaces) if interfaces else {}
+
+
+# (pattern, namespace of the XML output, Switch method); the pattern is
+# matched against the command without its arguments and pipes
+COMMANDS = [
+    (r'sh\w* ver\w*', 'sysmgrcli', 'show_version'),
+    (r'sh\w* vrf', 'l3vm', 'show_vrf'),
+    (r'sh\w* ip route', 'urib', 'show_ip_route'),
+    (r'sh\w* ipv6 route', 'ipv6', 'show_ipv6_route'),
+    (r'sh\w* ip arp', 'arp', 'show_ip_arp'),
+    (r'sh\w* mac address-table', 'l2fm', 'show_mac_address_table'),
+    (r'sh\w* port-channel sum\w*', 'eth_pcm_dc3', 'show_port_channel_summary'),
+    (r'sh\w* cdp nei\w*', 'cdpd', 'show_cdp_neighbors'),
+    (r'sh\w* int\w*', 'if_manager', 'show_interface'),
+]
+COMMANDS = [(re.compile(pattern + r'(\s|$)'), namespace, method)
+            for pattern, namespace, method in COMMANDS]
+
+
+class CommandFailed(Exception):
+
+    def __init__(self, code, msg):
+        Exception.__init__(self, msg)
+        self.code = code
+        self.msg = msg
+
+
+def toxml(value, tag=None, indent=''):
+    '''Renders decoded output back into the elements NX-API sends'''
+    if isinstance(value, list):
+        return ''.join(toxml(item, tag, indent) for item in value)
+    if isinstance(value, dict):
+        inner = ''.join(toxml(v, k, indent + ' ') for k, v in value.items())
+        if tag is None:
+            return inner
+        return '%s<%s>\n%s%s</%s>\n' % (indent, tag, inner, indent, tag)
+    return '%s<%s>%s</%s>\n' % (indent, tag, escape(unicode(value)), tag)
+
+
+def totext(value, indent=''):
+    '''A plain rendering for cli_show_ascii: one line per row'''
+    lines = []
+    if isinstance(value, list):
+        for item in value:
+            lines.append(totext(item, indent))
+        return ''.join(lines)
+    scalars = [unicode(v) for k, v in value.items()
+               if not isinstance(v, (dict, list)) or k == 'capability']
+    if scalars and not any(k.startswith('ROW_') for k in value):
+        lines.append(indent + '  '.join(scalars) + '\n')
+    for k, v in value.items():
+        if isinstance(v, dict) or (isinstance(v, list) and k != 'capability'):
+            lines.append(totext(v, indent + ('  ' if k.startswith('TABLE_')
+                                             else '')))
+    return ''.join(lines)
+
+
+def splitpipes(cmd):
+    '''Returns the command, whether '| xml' was asked for, and the other
+       filters as (kind, pattern)'''
+    parts = cmd.split('|')
+    xml = False
+    filters = []
+    for part in parts[1:]:
+        words = part.split(None, 1)
+        if not words:
+            continue
+        if words[0] == 'xml':
+            xml = True
+        elif words[0] in ('include', 'exclude', 'grep') and len(words) > 1:
+            filters.append((words[0], words[1].strip().strip('"\'')))
+    return parts[0].strip(), xml, filters
+
+
+class Emulator:
+    '''Everything the request handlers share: the switches, sessions,
+       chunked outputs in progress, settings and counters'''
+
+    def __init__(self, username='admin', password='admin', latency=0.0,
+                 jitter=0.0, auth_latency=0.0, chunk_size=16384,
+                 session_ttl=600.0, error_rate=0.0, http_error_rate=0.0,
+                 drop_rate=0.0, fail=None, requests_per_connection=0,
+                 sizes=None, cache_size=4096, seed=None):
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.auth_latency = auth_latency
+        self.chunk_size = chunk_size
+        self.session_ttl = session_ttl
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.drop_rate = drop_rate
+        self.fail = re.compile(fail) if fail else None
+        self.requests_per_connection = requests_per_connection
+        self.sizes = sizes
+        self.random = random.Random(seed)
+        self.credentials = base64.b64encode('%s:%s' % (username, password))
+        # Generated outputs are kept per (switch, kind, command)
+        self.outputs = CliCache(maxsize=cache_size, ttl=3600,
+                                ttls=dict((cmd, 0) for cmd in DYNAMIC))
+        self.switches = {}
+        self.sessions = {}
+        self.chunks = {}
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ('connections', 'requests', 'commands', 'logins', 'cookie_hits',
+             'unauthorized', 'command_errors', 'http_errors', 'drops',
+             'chunks', 'bytes_out'), 0)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['switches'] = len(self.switches)
+            stats['sessions'] = len(self.sessions)
+        stats['cache'] = self.outputs.stats()
+        return stats
+
+    def switch(self, address):
+        with self.lock:
+            switch = self.switches.get(address)
+            if switch is None:
+                switch = self.switches[address] = Switch(address, self.sizes)
+            return switch
+
+    def chance(self, rate):
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def delay(self):
+        seconds = self.latency
+        if self.jitter:
+            with self.lock:
+                seconds += self.random.uniform(0, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def authenticate(self, address, headers):
+        '''Returns the nxapi_auth cookie to set when the request logged in
+           with a password, None when it carried a live session cookie.
+           Raises CommandFailed(401) otherwise'''
+        now = time.time()
+        for part in (headers.get('Cookie') or '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == 'nxapi_auth':
+                with self.lock:
+                    expires = self.sessions.get((address, value))
+                    if expires is not None and expires > now:
+                        self.counters['cookie_hits'] += 1
+                        return None
+                    self.sessions.pop((address, value), None)
+        scheme, _, credentials = (headers.get('Authorization') or
+                                  '').partition(' ')
+        if scheme.lower() != 'basic' or credentials.strip() != \
+                self.credentials:
+            self.count('unauthorized')
+            raise CommandFailed(401, 'Authorization failed')
+        # The switch checks passwords through PAM, much slower than a
+        # cookie lookup
+        if self.auth_latency > 0:
+            time.sleep(self.auth_latency)
+        token = '%s:%d:%s' % (self.username, now * 1000, uuid.uuid4().hex)
+        with self.lock:
+            self.counters['logins'] += 1
+            if len(self.sessions) > 100000:
+                for key, expires in self.sessions.items():
+                    if expires <= now:
+                        del self.sessions[key]
+            self.sessions[(address, token)] = now + self.session_ttl
+        return 'nxapi_auth=%s; Path=/; Max-Age=%d; HttpOnly' % (
+            token, self.session_ttl)
+
+    def generate(self, switch, cmd):
+        '''Returns (namespace, decoded output) of a show command'''
+        for pattern, namespace, method in COMMANDS:
+            match = pattern.match(cmd)
+            if match:
+                args = cmd[match.end():].split()
+                return namespace, getattr(switch, method)(args)
+        raise CommandFailed(400, 'Input CLI command error')
+
+    def render(self, switch, cmd, kind):
+        '''Returns the output of cmd as kind: dict, xml (elements of the
+           body), document (the whole '| xml' output) or text'''
+        base, xml, filters = splitpipes(cmd)
+        if kind == 'text' and xml:
+            kind = 'document'
+
+        def build():
+            namespace, output = self.generate(switch, base)
+            if kind == 'dict':
+                return output
+            if kind == 'xml':
+                return toxml(output)
+            if kind == 'document':
+                words = [word for word in base.split()
+                         if re.match(r'[a-z][a-z0-9-]*$', word)][:3]
+                opening = ''.join('<%s>' % word for word in words)
+                closing = ''.join('</%s>' % word for word in reversed(words))
+                return XML_HEAD.format(namespace) + '  ' + opening + \
+                    '\n   <__readonly__>\n' + toxml(output, None, '    ') + \
+                    '   </__readonly__>\n  ' + closing + '\n' + XML_TAIL
+            return totext(output)
+        output = self.outputs.fetch((switch.address, kind, base), base, build)
+        if kind in ('text', 'document') and filters:
+            lines = output.splitlines(True)
+            for how, pattern in filters:
+                keep = how != 'exclude'
+                lines = [line for line in lines if (pattern in line) == keep]
+            output = ''.join(lines)
+        return output
+
+    def execute(self, switch, msg_type, cmd, out_format):
+        '''Returns the <output> of one command as a dict'''
+        result = OrderedDict([('input', cmd)])
+        try:
+            if self.fail and self.fail.search(cmd):
+                raise CommandFailed(400, 'Input CLI command error')
+            if self.chance(self.error_rate):
+                self.count('command_errors')
+                raise CommandFailed(500, 'Internal error')
+            if msg_type == 'cli_conf':
+                body = None
+            elif msg_type == 'cli_show_ascii':
+                body = self.render(switch, cmd, 'text')
+            elif msg_type == 'cli_show':
+                body = self.render(switch, cmd,
+                                   'dict' if out_format == 'json' else 'xml')
+            else:
+                raise CommandFailed(400, 'Message type not supported')
+        except CommandFailed, e:
+            result['msg'] = e.msg
+            result['code'] = str(e.code)
+            return result
+        if body is not None:
+            result['body'] = body
+        result['msg'] = 'Success'
+        result['code'] = '200'
+        return result
+
+    def chunk(self, switch, cmd, sid):
+        '''Returns (next sid, piece) of a command run in chunk mode. The
+           first request's sid is not known, and starts a new output'''
+        with self.lock:
+            state = self.chunks.pop(sid, None)
+        if state is None:
+            output = self.render(switch, cmd, 'document')
+            size = max(1, self.chunk_size)
+            state = [output[i:i + size] for i in range(0, len(output), size)]
+            state.reverse()
+        piece = state.pop() if state else ''
+        self.count('chunks')
+        if not state:
+            return 'eoc', piece
+        sid = uuid.uuid4().hex
+        with self.lock:
+            self.chunks[sid] = state
+        return sid, piece
+
+
+def parse_request(body):
+    '''Returns the fields of an ins_api request, sent as XML or JSON'''
+    if body.lstrip().startswith('{'):
+        fields = json.loads(body)['ins_api']
+        return dict((key, unicode(value)) for key, value in fields.items())
+    # The switch is lenient about what is inside <input>, e.g. the ']]>'
+    # of '| exclude "]]>]]>"', so the fields are picked out without an
+    # XML parser
+    fields = {}
+    for name in ('type', 'version', 'chunk', 'sid', 'input', 'output_format'):
+        match = re.search('<{0}>(.*?)</{0}>'.format(name), body, re.S)
+        if match:
+            fields[name] = unescape(match.group(1).strip())
+    return fields
+
+
+def xml_response(msg_type, sid, outputs, text=True):
+    '''text is False when the bodies are already XML elements'''
+    lines = ['<?xml version="1.0"?>\n<ins_api>\n',
+             '  <type>%s</type>\n  <version>0.1</version>\n' % msg_type,
+             '  <sid>%s</sid>\n  <outputs>\n' % escape(sid)]
+    for output in outputs:
+        lines.append('    <output>\n')
+        if 'body' in output:
+            body = output['body']
+            lines.append('      <body>%s</body>\n' % (
+                escape(body) if text else body))
+        for name in ('input', 'msg', 'code'):
+            lines.append('      <%s>%s</%s>\n' % (name, escape(output[name]),
+                                                  name))
+        lines.append('    </output>\n')
+    lines.append('  </outputs>\n</ins_api>\n')
+    return ''.join(lines)
+
+
+def json_response(msg_type, sid, outputs):
+    return json.dumps({'ins_api': OrderedDict([
+        ('type', msg_type), ('version', '0.1'), ('sid', sid),
+        ('outputs', {'output': outputs[0] if len(outputs) == 1
+                     else outputs})])})
+
+
+class NXAPIHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'nginx/1.7.10'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.emulator = self.server.emulator
+        self.served = 0
+        self.emulator.count('connections')
+
+    def local_address(self):
+        return self.connection.getsockname()[0]
+
+    def send(self, code, body, content_type='text/plain', headers=()):
+        self.served += 1
+        limit = self.emulator.requests_per_connection
+        if limit and self.served >= limit:
+            self.close_connection = 1
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        self.emulator.count('bytes_out', len(body))
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self.send(200, json.dumps(self.emulator.stats()),
+                      'application/json')
+        else:
+            self.send(404, 'Not found\n')
+
+    def do_POST(self):
+        emulator = self.emulator
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        emulator.count('requests')
+        if emulator.chance(emulator.drop_rate):
+            # Hang up without an answer, like a switch that restarted
+            emulator.count('drops')
+            self.close_connection = 1
+            return
+        emulator.delay()
+        if emulator.chance(emulator.http_error_rate):
+            emulator.count('http_errors')
+            self.send(500, 'Internal Server Error\n')
+            return
+        address = self.local_address()
+        try:
+            cookie = emulator.authenticate(address, self.headers)
+        except CommandFailed, e:
+            self.send(e.code, e.msg + '\n',
+                      headers=[('WWW-Authenticate', 'Basic realm="nxapi"')])
+            return
+        headers = [('Set-Cookie', cookie)] if cookie else []
+        try:
+            request = parse_request(body)
+        except (ValueError, KeyError, AttributeError, TypeError):
+            self.send(400, 'Bad request\n', headers=headers)
+            return
+
+        switch = emulator.switch(address)
+        msg_type = request.get('type', 'cli_show')
+        out_format = request.get('output_format', 'xml')
+        cmds = [cmd.strip() for cmd in request.get('input', '').split(' ;')]
+        emulator.count('commands', len(cmds))
+        sid = 'eoc'
+        if request.get('chunk') == '1' and msg_type == 'cli_show' \
+                and len(cmds) == 1:
+            try:
+                sid, piece = emulator.chunk(switch, cmds[0],
+                                            request.get('sid', ''))
+                outputs = [OrderedDict([('body', piece), ('input', cmds[0]),
+                                        ('msg', 'Success'), ('code', '200')])]
+            except CommandFailed, e:
+                outputs = [OrderedDict([('input', cmds[0]), ('msg', e.msg),
+                                        ('code', str(e.code))])]
+            # Chunks are text whatever the output format
+            out_format = 'xml'
+        else:
+            outputs = [emulator.execute(switch, msg_type, cmd, out_format)
+                       for cmd in cmds]
+        if out_format == 'json':
+            self.send(200, json_response(msg_type, sid, outputs),
+                      'application/json', headers)
+        else:
+            text = msg_type != 'cli_show' or request.get('chunk') == '1'
+            self.send(200, xml_response(msg_type, sid, outputs, text).encode(
+                'utf-8'), 'text/xml', headers)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+
+class NXAPIEmulatorServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 4096
+
+    def __init__(self, address, emulator, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, NXAPIHandler)
+        self.emulator = emulator
+        self.verbose = verbose
+
+
+def start(host='0.0.0.0', port=0, **options):
+    '''Serves an Emulator with options on a background thread. Returns the
+       server; server_address[1] is the port, shutdown() stops it'''
+    server = NXAPIEmulatorServer((host, port), Emulator(**options))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser('nxapiemulator')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--switches', type=int, default=1,
+                        help='Print the URLs of this many switches')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Milliseconds before each answer')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Up to this many more milliseconds, at random')
+    parser.add_argument('--auth-latency', type=float, default=0.0,
+                        help='Milliseconds a password login takes')
+    parser.add_argument('--session-ttl', type=float, default=600.0,
+                        help='Seconds an nxapi_auth cookie is valid')
+    parser.add_argument('--chunk-size', type=int, default=16384,
+                        help='Bytes per answer in chunk mode')
+    parser.add_argument('--requests-per-connection', type=int, default=0,
+                        help='Close keep-alive connections after this many '
+                             'requests (default never)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of commands that fail with code 500')
+    parser.add_argument('--http-error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with HTTP 500')
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help='Fraction of requests whose connection is '
+                             'closed without an answer')
+    parser.add_argument('--fail',
+                        help='Regular expression of commands that always '
+                             'fail')
+    parser.add_argument('--seed', type=int,
+                        help='Seed for latency jitter and injected errors')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log every request')
+    for name, size in sorted(DEFAULT_SIZES.items()):
+        parser.add_argument('--' + name, type=int, default=size,
+                            help='Table size per switch (default %d)' % size)
+    args = parser.parse_args()
+
+    emulator = Emulator(
+        args.username, args.password, args.latency / 1000.0,
+        args.jitter / 1000.0, args.auth_latency / 1000.0, args.chunk_size,
+        args.session_ttl, args.error_rate, args.http_error_rate,
+        args.drop_rate, args.fail, args.requests_per_connection,
+        dict((name, getattr(args, name)) for name in DEFAULT_SIZES),
+        seed=args.seed)
+    server = NXAPIEmulatorServer((args.host, args.port), emulator,
+                                 args.verbose)
+    addresses = switch_addresses(args.switches)
+    print 'Serving %d switches, http://%s:%d/ins to http://%s:%d/ins' % (
+        len(addresses), addresses[0], server.server_address[1],
+        addresses[-1], server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print json.dumps(emulator.stats(), indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#
+# Copyright (C) 2014 Cisco Systems Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# On-box cli()/clid() for scripts that run on several NX-OS platforms.
+#
+# Nexus 9000 provides cli() and clid() in the cli module; other platforms
+# only have cisco.cli(), which returns a (status, output) tuple. Scripts
+# used to find out by running 'show clock' or 'show version' at import
+# time. Here nothing is imported or run until the first command, the
+# tuple form is recognised from that command's own output, and the module
+# that worked and the form it returns are remembered in a small file on
+# bootflash so later runs import it directly and do not check again.
+#
+#   from nxplatform import cli, clid, has_clid, timing
+#
+
+import os
+import sys
+import time
+
+started = time.time()
+
+# Where the detected cli module is remembered, first writable one wins
+CACHE_PATHS = ('/bootflash/.nxplatform', os.path.expanduser('~/.nxplatform'))
+
+MODULES = ('cli', 'cisco')
+
+
+class Platform:
+    '''The cli module of this box, loaded on first use'''
+
+    def __init__(self, cache_paths=CACHE_PATHS):
+        self.cache_paths = cache_paths
+        self.module = None
+        self.rawcli = None
+        self.rawclid = None
+        self.tuple_output = None
+
+    def key(self):
+        # Changes when the switch is upgraded, so a stale answer is not used
+        return ' '.join(os.uname())
+
+    def read_cache(self):
+        for path in self.cache_paths:
+            try:
+                with open(path) as f:
+                    (key, module, tuple_output) = f.read().split('\n')[:3]
+            except (IOError, OSError, ValueError):
+                continue
+            if key == self.key() and module in MODULES:
+                return module, tuple_output == '1'
+        return None, None
+
+    def write_cache(self):
+        for path in self.cache_paths:
+            try:
+                with open(path, 'w') as f:
+                    f.write('%s\n%s\n%d\n' % (self.key(), self.module,
+                                              self.tuple_output))
+                return
+            except (IOError, OSError):
+                continue
+
+    def load(self):
+        if self.rawcli is not None:
+            return
+        (cached, self.tuple_output) = self.read_cache()
+        names = MODULES if cached is None else \
+            (cached,) + tuple(name for name in MODULES if name != cached)
+        for name in names:
+            try:
+                module = __import__(name)
+                self.rawcli = module.cli
+            except (ImportError, AttributeError):
+                continue
+            self.module = name
+            self.rawclid = getattr(module, 'clid', None)
+            break
+        else:
+            print 'Script is unsupported on this platform'
+            raise ImportError('No module named cli')
+        if name != cached:
+            self.tuple_output = None
+
+    def cli(self, cmd):
+        self.load()
+        output = self.rawcli(cmd)
+        if self.tuple_output is None:
+            # First command since the module was found, see which form
+            self.tuple_output = isinstance(output, tuple)
+            self.write_cache()
+        return output[1] if self.tuple_output else output
+
+    def has_clid(self):
+        self.load()
+        return self.rawclid is not None
+
+    def clid(self, cmd):
+        self.load()
+        return self.rawclid(cmd)
+
+
+class Timing:
+    '''Wall time of the stages of a script, from when this module was
+       imported'''
+
+    def __init__(self):
+        self.marks = []
+
+    def mark(self, stage):
+        self.marks.append((stage, time.time()))
+
+    def report(self, stream=None):
+        stream = stream or sys.stderr
+        previous = started
+        for stage, when in self.marks:
+            stream.write('%-24s %8.1f ms\n' % (stage, (when - previous) * 1000))
+            previous = when
+        stream.write('%-24s %8.1f ms\n' % ('total',
+                                         (time.time() - started) * 1000))
+
+
+platform = Platform()
+timing = Timing()
+
+
+def cli(cmd):
+    return platform.cli(cmd)
+
+
+def clid(cmd):
+    return platform.clid(cmd)
+
+
+def has_clid():
+    return platform.has_clid()
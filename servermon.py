@@ -20,6 +20,10 @@
 # a server. If the connection fails to be established, the commands specified
 # will be executed
 #
+# With --store DIR each check is also kept in a tsstore.TimeSeriesStore
+# there, as series server/<server>:<port> with values (1 if connected else
+# 0, connect time in microseconds), so that repeated runs build a history
+#
 
 import socket
 import time
@@ -30,9 +34,11 @@ import cli
 parser = ArgumentParser('Server health monitor')
 parser.add_argument('-s', '--server', help='IP address of server to monitor', required=True)
 parser.add_argument('-p', '--port', help='TCP port to poll', type=int, required=True)
+parser.add_argument('--store', help='Keep the result of each check in the time-series store in this directory')
 parser.add_argument('cmd', nargs='+', help='Commands to run if an interface fails, use , to separate multiple commands')
 args = parser.parse_args()
 connected = False
+started = time.time()
 try:
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.connect((socket.gethostbyname(args.server), int(args.port)))
@@ -40,7 +46,21 @@ try:
     connected = True
 except socket.error:
     connected = False
+elapsed = time.time() - started
 if connected == False:
     nxos.py_syslog(1, 'The server %s failed on port %s at time %s. Debug output below:' % (args.server, args.port, time.asctime()))
     for cmd in ' '.join(args.cmd).split(','):
         nxos.py_syslog(1, cli.cli(cmd))
+# Recorded last, so a busy or damaged store never gets in the way of the
+# alert and debug output above. tsstore is only loaded when asked for
+if args.store:
+    from tsstore import StoreError, TimeSeriesStore
+    try:
+        store = TimeSeriesStore(args.store)
+        try:
+            store.append('server/%s:%s' % (args.server, args.port), started,
+                         (int(connected), int(elapsed * 1000000)))
+        finally:
+            store.close()
+    except StoreError, e:
+        nxos.py_syslog(4, 'Could not record the check of %s port %s: %s' % (args.server, args.port, e))
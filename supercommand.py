@@ -25,6 +25,15 @@
 # host that appears in the CDP table differently from one that does not, and
 # collect a other command outputs in that case
 #
+# When run with 'all', the MAC address, port-channel and CDP tables are each
+# fetched once and joined in memory, rather than looked up per host. Use
+# --per-host to fall back to one lookup per host; hosts are then resolved
+# by --workers threads and each report is printed as soon as it is ready.
+#
+# --format json writes one JSON object per line and --format csv one row
+# per host and port, with the fields in FIELDS, for collectors to load
+# without scraping the text report.
+#
 # Tested and validated on Nexus 9000 6.1(2)I2(2a)
 #
 # A best effort was also made to try to run it on other platforms, but was only
@@ -34,105 +43,62 @@
 #   https://github.com/martinblech/xmltodict/blob/master/xmltodict.py
 #
 #
-import re
-import pprint
+import sys
+from clibackend import clidict, UnstructuredOutput, \
+    add_backend_arguments, backend_from_args
+from nxplatform import timing
 import json
-from argparse import ArgumentParser
+import threading
+import Queue
+from collections import OrderedDict
+from dictquery import findkey, findfirst
 
 #
-# This entire block of code is aimed at detecting of we have access to cli and
-# the clid command. If we do not have them, we attempt to import cli from the
-# cisco package (which is present on other NXOS platforms). If that fails, we
-# cannot proceed further. However, if it does succeed, then we need to create
-# an equivalent of clid(), so we introduce an external dependency on xmltodict
-# which is used to convert the XML output of the commands into a JSON dict.
+# cli(), clid() and clidict() come from clibackend. On the switch they use
+# the clid command where it exists (Nexus 9000), and elsewhere convert the
+# XML output of the commands with xmltodict, an external dependency.
+# clidict() returns a dict directly, so lookups below do not serialize the
+# output to JSON only to decode it again. With --switch or --replay the
+# same commands run through NX-API or against recorded outputs.
 #
-# Finally, after that we check to see if cli() returns a tuple, if so that means
-# we are on a 5K or similar, and we need to patch the output to return it as
-# just the command output, and not the two-tuple
-
-
-class UnstructuredOutput(Exception):
-    pass
 
+# Many hosts sit behind the same port-channel or interface, so the same
+# port-channel and CDP lookups repeat within a run. Serve repeats from a
+# cache when clicache is available
 try:
-    from cli import clid, cli
+    from clicache import CliCache
+    clicache = CliCache(maxsize=1024, ttl=60)
+    clidict = clicache.cached(clidict)
 except ImportError:
-    try:
-        from cisco import cli
-    except ImportError:
-        print 'Script is unsupported on this platform'
-        raise
+    clicache = None
 
-    def clid(cmd):
-        try:
-            import xmltodict
-        except ImportError:
-            print 'Script is unsupported on this platform: requires xmltodict'
-            raise
-        tag = '__readonly__'
-        starttag, endtag = '<' + tag + '>', '</' + tag + '>'
-        output = cli('{0} | xml'.format(cmd))
-        start_index, end_index = output.find(starttag), output.find(endtag)
-        if start_index == -1 or end_index == -1:
-            raise UnstructuredOutput(
-                'Command {0} does not support structured output: {1}'.format(
-                    cmd, output))
-        output = xmltodict.parse(
-            output[start_index:end_index + len(endtag)])
-        json_output = json.dumps(output[tag])
-        return json_output
-
-
-def cli_decorator(target_function):
-    def wrapper(cmd):
-        return target_function(cmd)[1]
-    return wrapper
-
-if isinstance(cli('show version'), tuple):
-    cli = cli_decorator(cli)
-
-
-def findkey(dct, key, value=None):
-    found = []
-    if isinstance(dct, list):
-        for item in dct:
-            f = findkey(item, key, value)
-            if f:
-                found.extend(f)
-    if isinstance(dct, dict):
-        for k, v in dct.items():
-            if isinstance(v, list) or isinstance(v, dict):
-                f = findkey(v, key, value)
-                if f:
-                    found.extend(f)
-            if str(k) == str(key):
-                if (value and str(v) == str(value)) or not value:
-                    found.append(v)
-    return found if len(found) > 0 else None
+
+def getrows(cmd, path):
+    # Return the rows at path (e.g. 'TABLE_adj/ROW_adj') in the output of
+    # cmd, through clid where the box has it
+    rowlist = findkey(clidict(cmd), path)
+    if not rowlist:
+        return []
+
+    # flatten out the rows into a list of dicts
+    rows = []
+    for row in rowlist:
+        if isinstance(row, dict):
+            rows.append(row)
+        elif isinstance(row, list):
+            rows.extend(row)
+    return rows
 
 
 def getarpentry(ip=None, vrf='all'):
     # Check the output of the ARP table for the IP address in question
     if ip:
-        arpoutput = json.loads(clid('show ip arp {0} vrf {1}'.format(ip, vrf)))
+        cmd = 'show ip arp {0} vrf {1}'.format(ip, vrf)
     else:
-        arpoutput = json.loads(clid('show ip arp vrf {0}'.format(vrf)))
-    rowadjlist = findkey(arpoutput, 'ROW_adj')
-    if not rowadjlist:
-        return None
-
-    # flatten out the data received from show ip arp into a list of dicts
-    arpentries = []
-    # print "TITU   :  ", arpoutput
-    for rowadj in rowadjlist:
-        if isinstance(rowadj, dict):
-            arpentries.append(rowadj)
-        elif isinstance(rowadj, list):
-            arpentries.extend(rowadj)
+        cmd = 'show ip arp vrf {0}'.format(vrf)
 
     arplist = []
-    for arp in arpentries:
+    for arp in getrows(cmd, 'TABLE_adj/ROW_adj'):
         try:
             # print "TITU Int : ", arp['intf-out']
             arplist.append(
@@ -144,8 +110,8 @@ def getarpentry(ip=None, vrf='all'):
 
 def getmacentry(mac, vlanfilter=None):
     try:
-        macaddroutput = json.loads(
-            clid('show mac address-table address {0}'.format(mac)))
+        macaddroutput = clidict(
+            'show mac address-table address {0}'.format(mac))
     except UnstructuredOutput:
         return None
 
@@ -160,9 +126,13 @@ def getmacentry(mac, vlanfilter=None):
         elif isinstance(macaddr, list):
             macentries.extend(macaddr)
 
+    return expandmacentries(macentries, vlanfilter, getportchannelmembers)
+
+
+def expandmacentries(macentries, vlanfilter, getmembers):
+    # Turn MAC table rows into entries, one per physical port. getmembers
+    # looks up the members of a port-channel
     entries = []
-    # print "TITU:mac,   ", mac
-    # print "TITU: ", macaddroutput
     # print "TITU", macentries
     for macaddr in macentries:
         vlan = macaddr['disp_vlan']
@@ -179,7 +149,7 @@ def getmacentry(mac, vlanfilter=None):
 
         # If a MAC is on a port channel, dereference it and use the first entry
         if 'po' in port.lower():
-            members = getportchannelmembers(port)
+            members = getmembers(port)
             if not members:
                 raise Exception(
                     'Unable to find any member interfaces in {0}'.format(port))
@@ -197,87 +167,282 @@ def getmacentry(mac, vlanfilter=None):
 
 
 def getportchannelmembers(port):
-    po = json.loads(
-        clid('show port-channel summary int {0}'.format(port)))
+    po = clidict('show port-channel summary int {0}'.format(port))
     members = findkey(po, 'port')
     return members
 
 
 def getcdpentry(port):
     # Next use the interface we found the device on from CAM and look it up in
-    # CDP
-    cdp = json.loads(clid('show cdp neighbor interface {0}'.format(port)))
-    cdp = findkey(cdp, 'ROW_cdp_neighbor_brief_info')
-    if not cdp:
-        raise Exception('Unable to find {0} in CDP output'.format(port))
-    if len(cdp) > 0:
-        cdp = cdp[0]
-    return cdp
+    # CDP. None when there is no neighbour, as in BulkTables
+    try:
+        cdp = clidict('show cdp neighbor interface {0}'.format(port))
+    except UnstructuredOutput:
+        return None
+    return findfirst(cdp, 'ROW_cdp_neighbor_brief_info') or None
+
+
+def shortifname(name):
+    # CDP and port-channel summary use long interface names, the MAC table
+    # short ones. Reduce both to one key, e.g. Ethernet1/1 -> eth1/1
+    name = name.lower()
+    for longname, shortname in (('ethernet', 'eth'), ('port-channel', 'po')):
+        if name.startswith(longname):
+            return shortname + name[len(longname):]
+    return name
+
+
+class BulkTables:
+    '''
+        Fetches the ARP, MAC address, port-channel and CDP tables once each
+        and indexes them, so that resolving every host in ARP costs four
+        commands instead of several per host. getmacentry,
+        getportchannelmembers and getcdpentry answer from the indexes
+    '''
+    def __init__(self, vrf='all'):
+        self.arp = getarpentry(vrf=vrf)
+
+        self.macs = {}
+        self.vlanmacs = {}
+        for row in getrows('show mac address-table',
+                           'TABLE_mac_address/ROW_mac_address'):
+            self.macs.setdefault(row['disp_mac_addr'], []).append(row)
+            self.vlanmacs.setdefault(
+                (row['disp_vlan'], row['disp_mac_addr']), []).append(row)
+
+        self.portchannels = {}
+        for row in getrows('show port-channel summary',
+                           'TABLE_channel/ROW_channel'):
+            members = (row.get('TABLE_member') or {}).get('ROW_member', [])
+            if isinstance(members, dict):
+                members = [members]
+            self.portchannels[shortifname(row['port-channel'])] = [
+                member['port'] for member in members]
+
+        self.cdp = {}
+        for row in getrows('show cdp neighbors',
+                           'TABLE_cdp_neighbor_brief_info/'
+                           'ROW_cdp_neighbor_brief_info'):
+            self.cdp.setdefault(shortifname(row['intf_id']), row)
+
+    def getmacentry(self, mac, vlanfilter=None):
+        if vlanfilter:
+            macentries = self.vlanmacs.get((vlanfilter, mac))
+        else:
+            macentries = self.macs.get(mac)
+        if not macentries:
+            return None
+        return expandmacentries(macentries, None, self.getportchannelmembers)
+
+    def getportchannelmembers(self, port):
+        return self.portchannels.get(shortifname(port))
+
+    def getcdpentry(self, port):
+        return self.cdp.get(shortifname(port))
+
+
+# Fields of the records written by --format json and csv, in order. A host
+# gets one record per physical port its MAC was learnt on, or a single
+# record without port fields when it is not in the MAC table
+FIELDS = ('ip', 'mac', 'vlan', 'l3_interface', 'port', 'parent_port',
+          'cdp_device_id', 'cdp_platform', 'cdp_port_id', 'error')
+
+
+def hostrecords(arp, lookupmac, lookupcdp):
+    # Resolve one ARP entry through the MAC, port-channel and CDP tables
+    ip, timer, mac, interface = arp
+    host = {'ip': ip, 'mac': mac, 'l3_interface': interface}
+    if 'Vlan' in interface:
+        vlanfilter = interface.split('Vlan')[1]
+    else:
+        vlanfilter = None
+    macentries = lookupmac(mac, vlanfilter=vlanfilter)
+    if not macentries:
+        return [host]
+
+    records = []
+    for macentry in macentries:
+        # print "TITU", macentry
+        vlan, _, entrytype, age, secure, ntfy, port, parentport = macentry
+        record = dict(host, vlan=vlan, port=port, parent_port=parentport)
+        if 'eth' in port.lower() or 'mgmt' in port.lower():
+            cdp = lookupcdp(port)
+        else:
+            cdp = None
+        if cdp:
+            record['cdp_platform'] = cdp['platform_id']
+            record['cdp_device_id'] = cdp['device_id']
+            record['cdp_port_id'] = cdp['port_id']
+        records.append(record)
+    return records
+
+
+def safehostrecords(arp, lookupmac, lookupcdp):
+    try:
+        return hostrecords(arp, lookupmac, lookupcdp)
+    except Exception as e:
+        ip, timer, mac, interface = arp
+        return [{'ip': ip, 'mac': mac, 'l3_interface': interface,
+                 'error': str(e)}]
+
+
+def textreport(records, many=False):
+    # Format the records of one host as indented text
+    host = records[0]
+    output = []
+    depth = 2
+    output += ['Here is some information on {0}:'.format(host['ip'])]
+    if many:
+        output += [' ' * depth +
+                   'ARP entry on {0}'.format(host['l3_interface'])]
+        depth = 4
+    if host.get('error'):
+        return output + [' ' * depth + 'Lookup failed: {0}'.format(
+            host['error'])]
+    output += [' ' * depth + 'MAC address: {0}'.format(host['mac'])]
+    output += [' ' * depth + 'L3 gateway: {0}'.format(host['l3_interface'])]
+    ports = [record for record in records if record.get('port')]
+    if not ports:
+        output += [' ' * depth +
+                   'Unable to find {0} in MAC table'.format(host['mac'])]
+
+    topdepth = depth
+    for record in ports:
+        depth = topdepth
+        if len(ports) > 1:
+            output += [' ' * depth + 'Port Channel {0} member {1}'.format(
+                record['parent_port'], record['port'])]
+            depth += 2
+        output += [' ' * depth + 'Local interface: {0}'.format(record['port'])]
+        output += [' ' * depth + 'VLAN: {0}'.format(record['vlan'])]
+        if record.get('cdp_device_id'):
+            output += [' ' * depth +
+                       'CDP Platform: {0}'.format(record['cdp_platform'])]
+            output += [' ' * depth +
+                       'CDP Device ID: {0}'.format(record['cdp_device_id'])]
+            output += [' ' * depth +
+                       'CDP Remote Port ID: {0}'.format(record['cdp_port_id'])]
+    return output
+
+
+class RecordWriter:
+    '''
+        Writes host records to a stream as they are resolved: text for
+        people, json for one JSON object per line, or csv with a header
+    '''
+    def __init__(self, fmt='text', stream=None, many=False):
+        self.fmt = fmt
+        self.stream = stream or sys.stdout
+        self.many = many
+        if fmt == 'csv':
+            import csv
+            self.csv = csv.writer(self.stream)
+            self.csv.writerow(FIELDS)
+
+    def write(self, records):
+        if self.fmt == 'text':
+            self.stream.write(chr(10).join(textreport(records, self.many)) +
+                              chr(10))
+        elif self.fmt == 'json':
+            for record in records:
+                self.stream.write(json.dumps(OrderedDict(
+                    (field, record.get(field)) for field in FIELDS)) + chr(10))
+        else:
+            for record in records:
+                self.csv.writerow([unicode(record.get(field) or '').encode(
+                    'utf-8') for field in FIELDS])
+        self.stream.flush()
+
+
+def resolvehosts(arpentries, lookupmac, lookupcdp, workers=8):
+    # Yield the records of each ARP entry as soon as its lookups are done.
+    # With more than one worker, hosts are resolved concurrently and
+    # arrive in completion order; identical lookups in flight at the same
+    # time are shared through the cache
+    if workers <= 1 or len(arpentries) < 2:
+        for arp in arpentries:
+            yield safehostrecords(arp, lookupmac, lookupcdp)
+        return
+
+    tasks = Queue.Queue()
+    done = Queue.Queue()
+
+    def worker():
+        while True:
+            arp = tasks.get()
+            if arp is None:
+                return
+            done.put(safehostrecords(arp, lookupmac, lookupcdp))
+
+    for arp in arpentries:
+        tasks.put(arp)
+    threads = []
+    for _ in range(min(workers, len(arpentries))):
+        tasks.put(None)
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for _ in arpentries:
+        yield done.get()
+    # Let the workers see their stop marker before the interpreter exits
+    for thread in threads:
+        thread.join()
 
 
 def main():
+    # argparse is only needed here, so it is not paid for at import time
+    from argparse import ArgumentParser
+    timing.mark('imports')
 
     # Perform some basic argument parsing for parameters passed to the script
     parser = ArgumentParser('Supercommand')
     parser.add_argument(
         'ip', help='IP address to query. Use all for every IP in arp')
+    parser.add_argument(
+        '--per-host', action='store_true',
+        help='With all, look up each host separately instead of fetching '
+             'the MAC, port-channel and CDP tables once')
+    parser.add_argument(
+        '--workers', type=int, default=8,
+        help='Hosts resolved concurrently with --per-host (default 8)')
+    parser.add_argument(
+        '--format', choices=('text', 'json', 'csv'), default='text',
+        help='text report, or one JSON object or CSV row per host port')
+    parser.add_argument(
+        '--timing', action='store_true',
+        help='Print how long startup and each stage took, to stderr')
+    add_backend_arguments(parser)
     args = parser.parse_args()
+    backend_from_args(args)
     ip = args.ip
-
-    output = []
-
-    try:
-        if ip == 'all':
-            arpentries = getarpentry()
-        else:
-            arpentries = getarpentry(ip)
-        if not arpentries:
-            print 'Unable to find {0} in ARP table'.format(ip)
-            arpentries = []
-
-        for arp in arpentries:
-            depth = 2
-            ip, timer, mac, interface = arp
-            output += ['Here is some information on {0}:'.format(ip)]
-            if len(arpentries) > 1:
-                output += [' ' * depth + 'ARP entry on {0}'.format(interface)]
-                depth = 4
-            output += [' ' * depth + 'MAC address: {0}'.format(mac)]
-            output += [' ' * depth + 'L3 gateway: {0}'.format(interface)]
-            if 'Vlan' in interface:
-                vlanfilter = interface.split('Vlan')[1]
-            else:
-                vlanfilter = None
-            macentries = getmacentry(mac, vlanfilter=vlanfilter)
-            if not macentries:
-                print 'Unable to find {0} in MAC table'.format(mac)
-                macentries = []
-
-            topdepth = depth
-            for macentry in macentries:
-                depth = topdepth
-                # print "TITU", macentry
-                vlan, mac, entrytype, age, secure, ntfy, port, parentport = macentry
-                # print "TITU VLAN : ", vlan
-                if len(macentries) > 1:
-                    output += [' ' * depth +
-                               'Port Channel {0} member {1}'.format(parentport, port)]
-                    depth += 2
-                output += [' ' * depth + 'Local interface: {0}'.format(port)]
-                output += [' ' * depth + 'VLAN: {0}'.format(vlan)]
-                if 'Eth' in port.lower() or 'mgmt' in port.lower():
-                    cdp = getcdpentry(port)
-                else:
-                    cdp = None
-                if cdp:
-                    output += [' ' * depth +
-                               'CDP Platform: {0}'.format(cdp['platform_id'])]
-                    output += [' ' * depth +
-                               'CDP Device ID: {0}'.format(cdp['device_id'])]
-                    output += [' ' * depth +
-                               'CDP Remote Port ID: {0}'.format(cdp['port_id'])]
-    finally:
-        print(chr(10).join(output))
+    timing.mark('arguments')
+
+    workers = 1
+    lookupmac, lookupcdp = getmacentry, getcdpentry
+
+    if ip == 'all' and not args.per_host:
+        tables = BulkTables()
+        arpentries = tables.arp
+        lookupmac, lookupcdp = tables.getmacentry, tables.getcdpentry
+    elif ip == 'all':
+        arpentries = getarpentry()
+        workers = args.workers
+    else:
+        arpentries = getarpentry(ip)
+    timing.mark('tables' if ip == 'all' and not args.per_host else 'arp')
+    if not arpentries:
+        # Keep structured output parseable
+        notice = sys.stdout if args.format == 'text' else sys.stderr
+        print >> notice, 'Unable to find {0} in ARP table'.format(ip)
+        arpentries = []
+
+    writer = RecordWriter(args.format, many=len(arpentries) > 1)
+    for records in resolvehosts(arpentries, lookupmac, lookupcdp, workers):
+        writer.write(records)
+    timing.mark('resolve')
+    if args.timing:
+        timing.report()
 
 if __name__ == '__main__':
     main()
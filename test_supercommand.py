@@ -0,0 +1,132 @@
+#
+# Copyright (C) 2014 Cisco Systems Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Checks supercommand's reports against recorded outputs, off box:
+#
+#   python -m unittest test_supercommand
+#
+
+import csv
+import json
+import unittest
+from cStringIO import StringIO
+
+import clibackend
+import supercommand
+
+
+def macrow(mac, port):
+    return {'disp_mac_addr': mac, 'disp_vlan': '10', 'disp_type': '*',
+            'disp_age': '0', 'disp_is_secure': 'disabled',
+            'disp_is_ntfy': 'disabled', 'disp_port': port}
+
+
+def cdptable(rows):
+    return {'TABLE_cdp_neighbor_brief_info': {
+        'ROW_cdp_neighbor_brief_info': rows}}
+
+
+# 10.0.0.1 has a CDP neighbour on Eth1/1, 10.0.0.2 has none on Eth1/2
+NEIGHBOUR = {'intf_id': 'Ethernet1/1', 'device_id': 'server1',
+             'platform_id': 'N2K-C2248TP', 'port_id': 'Ethernet0/1'}
+MACS = [macrow('0000.0000.0001', 'Eth1/1'),
+        macrow('0000.0000.0002', 'Eth1/2')]
+FIXTURES = {'clidict': {
+    'show ip arp vrf all': {'TABLE_vrf': {'ROW_vrf': {'TABLE_adj': {
+        'ROW_adj': [
+            {'ip-addr-out': '10.0.0.1', 'time-stamp': '00:01:00',
+             'mac': '0000.0000.0001', 'intf-out': 'Vlan10'},
+            {'ip-addr-out': '10.0.0.2', 'time-stamp': '00:01:00',
+             'mac': '0000.0000.0002', 'intf-out': 'Vlan10'}]}}}},
+    'show mac address-table': {'TABLE_mac_address': {
+        'ROW_mac_address': MACS}},
+    'show mac address-table address 0000.0000.0001': {
+        'TABLE_mac_address': {'ROW_mac_address': MACS[0]}},
+    'show mac address-table address 0000.0000.0002': {
+        'TABLE_mac_address': {'ROW_mac_address': MACS[1]}},
+    'show port-channel summary': {'TABLE_channel': {'ROW_channel': []}},
+    'show cdp neighbors': cdptable([NEIGHBOUR]),
+    'show cdp neighbor interface Eth1/1': cdptable(NEIGHBOUR),
+    'show cdp neighbor interface Eth1/2': {},
+}, 'cli': {}, 'clic': {}}
+
+
+class ReportTest(unittest.TestCase):
+
+    def setUp(self):
+        clibackend.use(clibackend.ReplayBackend(FIXTURES))
+        if supercommand.clicache:
+            supercommand.clicache.invalidate()
+
+    def resolve(self, bulk, fmt):
+        if bulk:
+            tables = supercommand.BulkTables()
+            arpentries = tables.arp
+            lookupmac, lookupcdp = tables.getmacentry, tables.getcdpentry
+            workers = 1
+        else:
+            arpentries = supercommand.getarpentry()
+            lookupmac = supercommand.getmacentry
+            lookupcdp = supercommand.getcdpentry
+            workers = 2
+        stream = StringIO()
+        writer = supercommand.RecordWriter(fmt, stream, many=True)
+        for records in supercommand.resolvehosts(arpentries, lookupmac,
+                                                 lookupcdp, workers):
+            writer.write(records)
+        return stream.getvalue()
+
+    def records(self, bulk):
+        records = [json.loads(line)
+                   for line in self.resolve(bulk, 'json').splitlines()]
+        return dict((record['ip'], record) for record in records)
+
+    def check_cdp(self, records):
+        neighbour, alone = records['10.0.0.1'], records['10.0.0.2']
+        self.assertEqual(neighbour['cdp_device_id'], 'server1')
+        self.assertEqual(neighbour['cdp_platform'], 'N2K-C2248TP')
+        self.assertEqual(neighbour['cdp_port_id'], 'Ethernet0/1')
+        self.assertEqual(neighbour['error'], None)
+        for field in ('cdp_device_id', 'cdp_platform', 'cdp_port_id',
+                      'error'):
+            self.assertEqual(alone[field], None)
+
+    def test_bulk_json_has_cdp_neighbour(self):
+        self.check_cdp(self.records(bulk=True))
+
+    def test_per_host_json_has_cdp_neighbour(self):
+        self.check_cdp(self.records(bulk=False))
+
+    def test_csv_has_cdp_columns(self):
+        for bulk in (True, False):
+            rows = list(csv.DictReader(StringIO(self.resolve(bulk, 'csv'))))
+            byip = dict((row['ip'], row) for row in rows)
+            self.assertEqual(byip['10.0.0.1']['cdp_device_id'], 'server1')
+            self.assertEqual(byip['10.0.0.1']['cdp_port_id'], 'Ethernet0/1')
+            self.assertEqual(byip['10.0.0.2']['cdp_device_id'], '')
+            self.assertEqual(byip['10.0.0.2']['error'], '')
+
+    def test_text_has_cdp_neighbour(self):
+        for bulk in (True, False):
+            output = self.resolve(bulk, 'text')
+            self.assertIn('CDP Device ID: server1', output)
+            self.assertIn('CDP Remote Port ID: Ethernet0/1', output)
+            # No neighbour on Eth1/2 is not a failed lookup, either way
+            self.assertNotIn('Lookup failed', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
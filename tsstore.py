@@ -0,0 +1,528 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2014 Cisco Systems Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# A small append-only time-series store for what the scripts sample, kept
+# in a directory on bootflash or on a collector host:
+#
+#   store = TimeSeriesStore('/bootflash/ifstats')
+#   store.append('Ethernet1/1', time.time(), (inbytes, outbytes))
+#   for when, values in store.query('Ethernet1/1', start=time.time() - 600):
+#       ...
+#   store.rollup('Ethernet1/1', 60, how='rate')   # per minute rates
+#
+# Each series is a name and a fixed number of integer values per sample.
+# Samples go into segment files of a fixed size, written through mmap.
+# Within a segment, timestamps (in milliseconds) and values are stored as
+# the change in their difference from the previous sample of the series,
+# as zigzag varints, so a counter growing at a steady rate sampled every
+# second takes a byte or two per value. Every segment starts its series
+# afresh and can be read or deleted on its own. When the newest segment is
+# full a new one is started and the oldest ones beyond max_segments, or
+# older than retention seconds, are deleted, which bounds the space used.
+#
+# Segments record their first and last times, so range queries only
+# decode the segments that overlap the range. From the shell:
+#
+#   python tsstore.py /bootflash/ifstats
+#   python tsstore.py /bootflash/ifstats Ethernet1/1 --last 3600 \
+#       --step 60 --how rate
+#
+
+import errno
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from argparse import ArgumentParser
+
+# magic, version, reserved, segment size, first and last time (ms), bytes
+# of records used
+HEADER = struct.Struct('<4sHHIqqI')
+MAGIC = 'TSS1'
+VERSION = 1
+
+SEGMENT_SIZE = 256 * 1024
+MAX_SEGMENTS = 16
+
+SEGMENT_NAME = 'segment-%08d.tss'
+
+# Ways rollup() reduces the samples of each step
+ROLLUPS = ('mean', 'min', 'max', 'first', 'last', 'rate')
+
+
+class StoreError(Exception):
+    pass
+
+
+def put_varint(out, value):
+    '''Appends value, any integer, to bytearray out as a zigzag varint'''
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def get_varint(data, offset):
+    '''Reads a zigzag varint from bytearray data. Returns (value, offset
+       after it)'''
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1 if not value & 1 else -(value >> 1) - 1), offset
+
+
+class Segment:
+    '''One segment file. Records are:
+
+         varint id * 2 + 1, varint name length, name, varint field count
+           to give a series its id within the segment, before its first
+           sample, and
+         varint id * 2, then for the time and each value the difference
+           between its change since the previous sample and the change
+           before that
+
+       states holds, per series id, [samples, time, time change, values,
+       value changes] of its last sample, which the next one is encoded
+       against'''
+
+    def __init__(self, path, size=None, writable=False):
+        self.path = path
+        self.writable = writable
+        self.ids = {}
+        self.names = []
+        self.fields = []
+        self.states = []
+        if size is not None and not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, 0, size, 0, 0, 0))
+                f.truncate(size)
+        self.file = open(path, 'r+b' if writable else 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=(
+                mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ))
+        except (mmap.error, ValueError), e:
+            # An empty file, just being created
+            self.file.close()
+            raise StoreError('Cannot map %s: %s' % (path, e))
+        try:
+            (magic, version, _, self.size, self.first, self.last,
+             self.used) = HEADER.unpack_from(self.map)
+        except struct.error:
+            magic = None
+        if magic != MAGIC or version != VERSION or \
+                self.size != len(self.map) or \
+                self.used > self.size - HEADER.size:
+            self.close()
+            raise StoreError('%s is not a version %d segment' % (path,
+                                                                VERSION))
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def flush(self):
+        if self.writable:
+            self.map.flush()
+
+    def overlaps(self, start, end):
+        if not self.used:
+            return False
+        return (start is None or self.last >= start) and \
+            (end is None or self.first <= end)
+
+    def records(self, only=None):
+        '''Yields (series, time in ms, values) for every sample, in the
+           order they were written, rebuilding states on the way. With
+           only, just that series' samples are decoded and yielded'''
+        data = bytearray(self.map[HEADER.size:HEADER.size + self.used])
+        self.ids, self.names, self.fields, self.states = {}, [], [], []
+        offset = 0
+        end = len(data)
+        while offset < end:
+            tag, offset = get_varint(data, offset)
+            series = tag >> 1
+            if tag & 1:
+                length, offset = get_varint(data, offset)
+                name = str(data[offset:offset + length])
+                offset += length
+                count, offset = get_varint(data, offset)
+                self.ids[name] = len(self.names)
+                self.names.append(name)
+                self.fields.append(count)
+                self.states.append(None)
+                continue
+            if only is not None and self.names[series] != only:
+                # Step over the varints without decoding them
+                for _ in range(self.fields[series] + 1):
+                    while data[offset] >= 0x80:
+                        offset += 1
+                    offset += 1
+                continue
+            changes = []
+            for _ in range(self.fields[series] + 1):
+                change, offset = get_varint(data, offset)
+                changes.append(change)
+            state = self.states[series]
+            if state is None:
+                now, values = changes[0], changes[1:]
+                self.states[series] = [1, now, 0, values,
+                                       [0] * len(values)]
+            else:
+                tdelta = state[2] + changes[0]
+                deltas = [delta + change for delta, change in
+                          zip(state[4], changes[1:])]
+                now = state[1] + tdelta
+                values = [value + delta for value, delta in
+                          zip(state[3], deltas)]
+                self.states[series] = [state[0] + 1, now, tdelta, values,
+                                       deltas]
+            yield self.names[series], now, values
+
+    def encode(self, out, name, now, values):
+        '''Appends the records of one sample to bytearray out and updates
+           the states as if they were written'''
+        series = self.ids.get(name)
+        if series is None:
+            series = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.fields.append(len(values))
+            self.states.append(None)
+            put_varint(out, series * 2 + 1)
+            put_varint(out, len(name))
+            out.extend(name)
+            put_varint(out, len(values))
+        elif len(values) != self.fields[series]:
+            raise StoreError('%s has %d values, not %d' % (
+                name, self.fields[series], len(values)))
+        put_varint(out, series * 2)
+        state = self.states[series]
+        if state is None:
+            put_varint(out, now)
+            for value in values:
+                put_varint(out, value)
+            self.states[series] = [1, now, 0, list(values),
+                                   [0] * len(values)]
+            return
+        tdelta = now - state[1]
+        put_varint(out, tdelta - state[2])
+        deltas = []
+        for value, previous, delta in zip(values, state[3], state[4]):
+            deltas.append(value - previous)
+            put_varint(out, value - previous - delta)
+        self.states[series] = [state[0] + 1, now, tdelta, list(values),
+                               deltas]
+
+    def write(self, data, first, last):
+        '''Writes encoded records at the end of the used space. The header
+           is updated after the records, so a record cut short by a crash
+           is never read'''
+        start = HEADER.size + self.used
+        self.map[start:start + len(data)] = str(data)
+        self.used += len(data)
+        if not self.first:
+            self.first = first
+        self.last = max(self.last, last)
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, 0, self.size,
+                         self.first, self.last, self.used)
+
+    def room(self):
+        return self.size - HEADER.size - self.used
+
+
+class TimeSeriesStore:
+    '''Series of integer samples kept in the directory path. Only one
+       process writes to a store at a time; any number may read it.
+       Appends are thread safe'''
+
+    def __init__(self, path, segment_size=SEGMENT_SIZE,
+                 max_segments=MAX_SEGMENTS, retention=None, readonly=False):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.retention = retention
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self.current = None
+        self.lockfile = None
+        if readonly:
+            return
+        try:
+            os.makedirs(path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.lockfile = open(os.path.join(path, 'lock'), 'w')
+        try:
+            fcntl.flock(self.lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self.lockfile.close()
+            raise StoreError('%s is open for writing elsewhere' % path)
+
+    def segments(self):
+        '''Returns the sequence numbers of the segments, oldest first'''
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        numbers = []
+        for name in names:
+            if name.startswith('segment-') and name.endswith('.tss'):
+                try:
+                    numbers.append(int(name[8:-4]))
+                except ValueError:
+                    pass
+        return sorted(numbers)
+
+    def segment_path(self, number):
+        return os.path.join(self.path, SEGMENT_NAME % number)
+
+    def open_current(self):
+        '''Opens the newest segment for writing, or starts one'''
+        numbers = self.segments()
+        if numbers:
+            try:
+                segment = Segment(self.segment_path(numbers[-1]),
+                                  writable=True)
+            except StoreError:
+                segment = None
+            if segment is not None and segment.size == self.segment_size:
+                # Read through once for the state new samples follow on
+                for _ in segment.records():
+                    pass
+                self.current = (numbers[-1], segment)
+                return
+            if segment is not None:
+                segment.close()
+        self.roll(numbers[-1] + 1 if numbers else 0)
+
+    def roll(self, number):
+        if self.current is not None:
+            self.current[1].close()
+        self.current = (number, Segment(self.segment_path(number),
+                                        self.segment_size, writable=True))
+        self.expire()
+
+    def expire(self):
+        '''Deletes the segments the retention policy no longer keeps'''
+        numbers = self.segments()
+        keep = self.current[0] if self.current else None
+        now = int(time.time() * 1000)
+        for index, number in enumerate(numbers):
+            if number == keep:
+                continue
+            expired = len(numbers) - index > self.max_segments
+            if not expired and self.retention is not None:
+                try:
+                    segment = Segment(self.segment_path(number))
+                except (StoreError, IOError):
+                    continue
+                expired = segment.last < now - self.retention * 1000
+                segment.close()
+            if expired:
+                try:
+                    os.remove(self.segment_path(number))
+                except OSError:
+                    pass
+
+    def append(self, series, when, values):
+        '''Adds one sample, at when seconds since the epoch'''
+        self.extend(when, [(series, values)])
+
+    def extend(self, when, samples):
+        '''Adds samples, [(series, values)], all taken at when'''
+        if self.readonly:
+            raise StoreError('%s is open read only' % self.path)
+        now = int(round(when * 1000))
+        with self.lock:
+            if self.current is None:
+                self.open_current()
+            for attempt in range(2):
+                segment = self.current[1]
+                saved = (dict(segment.ids), list(segment.names),
+                         list(segment.fields), list(segment.states))
+                data = bytearray()
+                try:
+                    for series, values in samples:
+                        segment.encode(data, series, now,
+                                       [int(value) for value in values])
+                except Exception:
+                    # Nothing of the batch is written, so the states must
+                    # not move on either
+                    (segment.ids, segment.names, segment.fields,
+                     segment.states) = saved
+                    raise
+                if len(data) <= segment.room():
+                    segment.write(data, now, now)
+                    return
+                # Did not fit: undo the encoding and start a new segment,
+                # where the samples are encoded afresh
+                (segment.ids, segment.names, segment.fields,
+                 segment.states) = saved
+                self.roll(self.current[0] + 1)
+            raise StoreError('%d samples do not fit in a segment of %d '
+                             'bytes' % (len(samples), self.segment_size))
+
+    def flush(self):
+        with self.lock:
+            if self.current is not None:
+                self.current[1].flush()
+
+    def close(self):
+        with self.lock:
+            if self.current is not None:
+                self.current[1].flush()
+                self.current[1].close()
+                self.current = None
+            if self.lockfile is not None:
+                self.lockfile.close()
+                self.lockfile = None
+
+    def readable(self, start=None, end=None):
+        '''Yields the segments that overlap start to end, in ms'''
+        for number in self.segments():
+            try:
+                segment = Segment(self.segment_path(number))
+            except (StoreError, IOError):
+                # Deleted by the writer's retention, or being created
+                continue
+            try:
+                if segment.overlaps(start, end):
+                    yield segment
+            finally:
+                segment.close()
+
+    def series(self):
+        '''Returns the names of all series, sorted'''
+        names = set()
+        for segment in self.readable():
+            for _ in segment.records():
+                pass
+            names.update(segment.names)
+        return sorted(names)
+
+    def query(self, series, start=None, end=None):
+        '''Yields (time, values) of series from start to end, in seconds
+           since the epoch, oldest first'''
+        self.flush()
+        first = int(start * 1000) if start is not None else None
+        last = int(end * 1000) if end is not None else None
+        for segment in self.readable(first, last):
+            for name, now, values in segment.records(series):
+                if (first is None or now >= first) and \
+                        (last is None or now <= last):
+                    yield now / 1000.0, values
+
+    def rollup(self, series, step, start=None, end=None, how='mean'):
+        '''Returns [(step start, values)] of series over start to end, one
+           entry per step seconds that has samples. how is one of ROLLUPS;
+           rate is the per second increase of counters within the step,
+           counting from the last sample before it, and skipping
+           decreases, where a counter was cleared'''
+        if how not in ROLLUPS:
+            raise ValueError('how must be one of ' + ', '.join(ROLLUPS))
+        buckets = []
+        previous = None
+        for now, values in self.query(series, start, end):
+            bucket = now - now % step
+            if not buckets or buckets[-1][0] != bucket:
+                buckets.append([bucket, 0, [0] * len(values), 0.0, values,
+                                list(values), list(values), values])
+            entry = buckets[-1]
+            entry[1] += 1
+            entry[5] = map(min, entry[5], values)
+            entry[6] = map(max, entry[6], values)
+            entry[7] = values
+            if how == 'mean':
+                entry[2] = [total + value for total, value in
+                            zip(entry[2], values)]
+            elif how == 'rate' and previous is not None:
+                seconds = now - previous[0]
+                growth = [value - last for value, last in
+                          zip(values, previous[1])]
+                if seconds > 0 and min(growth) >= 0:
+                    entry[2] = [total + grown for total, grown in
+                                zip(entry[2], growth)]
+                    entry[3] += seconds
+            previous = (now, values)
+        rolled = []
+        for (bucket, count, totals, seconds, first, low, high,
+             last) in buckets:
+            if how == 'mean':
+                values = [total / float(count) for total in totals]
+            elif how == 'rate':
+                if not seconds:
+                    continue
+                values = [total / seconds for total in totals]
+            else:
+                values = {'min': low, 'max': high, 'first': first,
+                          'last': last}[how]
+            rolled.append((bucket, values))
+        return rolled
+
+    def usage(self):
+        '''Returns (segments, bytes on disk, bytes of samples)'''
+        files = size = used = 0
+        for segment in self.readable():
+            files += 1
+            size += segment.size
+            used += segment.used
+        return files, size, used
+
+
+def main():
+    parser = ArgumentParser('tsstore')
+    parser.add_argument('path', help='Store directory')
+    parser.add_argument('series', nargs='?',
+                        help='Series to print; without it, list the series')
+    parser.add_argument('--last', type=float,
+                        help='Only the last this many seconds')
+    parser.add_argument('--step', type=float,
+                        help='Roll samples up into steps of this many seconds')
+    parser.add_argument('--how', choices=ROLLUPS, default='mean',
+                        help='How --step combines samples (default mean)')
+    args = parser.parse_args()
+
+    store = TimeSeriesStore(args.path, readonly=True)
+    if not args.series:
+        files, size, used = store.usage()
+        print '%d segments, %d bytes, %d bytes of samples' % (files, size,
+                                                             used)
+        for name in store.series():
+            print name
+        return
+    start = time.time() - args.last if args.last else None
+    if args.step:
+        rows = store.rollup(args.series, args.step, start, how=args.how)
+    else:
+        rows = store.query(args.series, start)
+    for now, values in rows:
+        print '%s.%03d  %s' % (
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)),
+            int(now * 1000) % 1000,
+            '  '.join(('%.1f' % value) if isinstance(value, float)
+                      else str(value) for value in values))
+
+if __name__ == '__main__':
+    main()
@@ -197,6 +197,106 @@ def parse(xml_input, encoding='utf-8', expat=expat, *args, **kwargs):
         parser.Parse(xml_input, True)
     return handler.item
 
+_NOT_COLLECTING = float('inf')
+
+class _DictSAXStreamHandler(_DictSAXHandler):
+    """Handler for `iterparse`: collects every element whose path ends
+    with `item_path`, at whatever depth it appears. Nothing outside the
+    current item is kept."""
+    def __init__(self, item_path, item_callback, context=(), **kwargs):
+        _DictSAXHandler.__init__(self,
+                                 item_depth=_NOT_COLLECTING,
+                                 item_callback=item_callback,
+                                 **kwargs)
+        self.item_path = item_path
+        self.names = []
+        self.context_names = set(context)
+        self.context = {}
+        self.capture = None
+
+    def startElement(self, name, attrs):
+        self.names.append(name.split(':')[-1])
+        if self.item_depth == _NOT_COLLECTING:
+            if self.names[-len(self.item_path):] == self.item_path:
+                self.item_depth = len(self.path) + 1
+                self.item = self.data = None
+            elif self.names[-1] in self.context_names:
+                self.capture = []
+        _DictSAXHandler.startElement(self, name, attrs)
+
+    def endElement(self, name):
+        depth = len(self.path)
+        _DictSAXHandler.endElement(self, name)
+        if self.capture is not None:
+            self.context[self.names[-1]] = ''.join(self.capture).strip()
+            self.capture = None
+        self.names.pop()
+        if depth == self.item_depth:
+            self.item_depth = _NOT_COLLECTING
+            self.item = self.data = None
+
+    def characters(self, data):
+        # Text between items is never part of a result, except for the
+        # context elements the caller asked to see
+        if self.item_depth != _NOT_COLLECTING:
+            _DictSAXHandler.characters(self, data)
+        elif self.capture is not None:
+            self.capture.append(data)
+
+def iterparse(xml_input, item_path, encoding='utf-8', expat=expat,
+              chunk_size=16384, context=(), **kwargs):
+    """Incrementally parse `xml_input` and yield each item found at
+    `item_path` as soon as its end tag has been parsed.
+    `item_path` is a `/`-separated list of element names matched against
+    the end of the element's path, so wrappers above it need not be
+    spelled out; namespace prefixes are ignored. `xml_input` can be a
+    string, a file-like object such as an HTTP response, or an iterator
+    of strings. Only the item being built is held in memory.
+    Example::
+        >>> for row in xmltodict.iterparse(resp, 'TABLE_prefix/ROW_prefix'):
+        ...     print row['ipprefix']
+    If `context` lists element names, the generator yields `(ctx, item)`
+    pairs instead, where `ctx` maps each of those names to the text of
+    its most recent occurrence outside an item. This recovers values
+    such as the VRF name that precede a table of rows::
+        >>> for ctx, row in xmltodict.iterparse(
+        ...         resp, 'ROW_prefix', context=['vrf-name-out']):
+        ...     print ctx['vrf-name-out'], row['ipprefix']
+    Other keyword arguments are the same as for `parse`.
+    """
+    items = []
+    handler = None
+    def collect(path, item):
+        if context:
+            item = (dict(handler.context), item)
+        items.append(item)
+        return True
+    handler = _DictSAXStreamHandler(item_path.strip('/').split('/'),
+                                    collect, context, **kwargs)
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.StartElementHandler = handler.startElement
+    parser.EndElementHandler = handler.endElement
+    parser.CharacterDataHandler = handler.characters
+    if isinstance(xml_input, _basestring):
+        chunks = iter([xml_input])
+    elif hasattr(xml_input, 'read'):
+        chunks = iter(lambda: xml_input.read(chunk_size), '')
+    else:
+        chunks = iter(xml_input)
+    for chunk in chunks:
+        if isinstance(chunk, _unicode):
+            chunk = chunk.encode(encoding)
+        parser.Parse(chunk, False)
+        if items:
+            pending = items[:]
+            del items[:]
+            for item in pending:
+                yield item
+    parser.Parse('', True)
+    for item in items:
+        yield item
+
 def _emit(key, value, content_handler,
           attr_prefix='@',
           cdata_key='#text',